@@ -0,0 +1,95 @@
+"""
+Latency of the hot lookups: ORM path against the prepared-statement path.
+
+Runs the user language lookup and the month survey range through
+``Postgres.get_entity_parameter`` / a session ``select`` and through
+``Postgres.queries`` on the same pool. Needs the PG* environment of the
+bot and an existing user:
+
+    python -m benchmarks.hot_queries --user 123456789 --iterations 2000
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+from datetime import datetime
+
+from dateutil.relativedelta import relativedelta
+from sqlalchemy import select
+
+from services.database import Postgres, Survey, User
+from services.save_survey_response import get_surveys_for_month
+from utils.datetime_utils import get_current_time_in_almaty_naive
+
+
+async def measure(name: str, call, iterations: int, concurrency: int):
+    # Прогрев: соединения пула и кэш подготовленных запросов
+    for _ in range(concurrency):
+        await call()
+
+    samples = []
+
+    async def worker(count: int):
+        for _ in range(count):
+            started = time.perf_counter()
+            await call()
+            samples.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(
+        *(worker(iterations // concurrency) for _ in range(concurrency))
+    )
+    elapsed = time.perf_counter() - started
+    samples.sort()
+    print(
+        f"{name:<28} {len(samples) / elapsed:>8,.0f}/s  "
+        f"median {statistics.median(samples) * 1e3:.2f}ms  "
+        f"p99 {samples[int(len(samples) * 0.99)] * 1e3:.2f}ms"
+    )
+
+
+async def orm_surveys_for_month(database, user_id, month, year):
+    # Прежний путь: сессия, identity map и полные ORM-объекты
+    start = datetime(year, month, 1)
+    async with database.Session() as session:
+        result = await session.execute(
+            select(Survey)
+            .where(Survey.userid == user_id)
+            .where(Survey.created_at >= start)
+            .where(Survey.created_at < start + relativedelta(months=1))
+        )
+        return result.scalars().all()
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--user", type=int, required=True)
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args()
+
+    database = Postgres()
+    today = get_current_time_in_almaty_naive()
+    user_id = args.user
+    cases = {
+        "language, ORM": lambda: database.get_entity_parameter(
+            model_class=User, filters={"userid": user_id}, parameter="language"
+        ),
+        "language, prepared": lambda: database.queries.user_language(user_id),
+        "month surveys, ORM": lambda: orm_surveys_for_month(
+            database, user_id, today.month, today.year
+        ),
+        "month surveys, prepared": lambda: get_surveys_for_month(
+            database, user_id, today.month, today.year
+        ),
+    }
+    try:
+        for name, call in cases.items():
+            await measure(name, call, args.iterations, args.concurrency)
+    finally:
+        await database.engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
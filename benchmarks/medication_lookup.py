@@ -0,0 +1,109 @@
+"""
+Throughput of fuzzy medication lookups.
+
+Builds a dictionary of several thousand brand and generic names (the
+bundled list plus generated names) and looks up noisy variants of them,
+the kind STT produces: dropped, doubled and swapped letters.
+
+    python -m benchmarks.medication_lookup --names 5000 --queries 20000
+"""
+
+import argparse
+import random
+import time
+
+from services.medications import MedicationIndex, DICTIONARY_PATH
+
+SYLLABLES = (
+    "ба",
+    "ве",
+    "ги",
+    "до",
+    "ка",
+    "ле",
+    "ми",
+    "но",
+    "пра",
+    "ро",
+    "се",
+    "ти",
+    "фу",
+    "цин",
+    "зол",
+    "мет",
+    "прил",
+    "сар",
+    "тан",
+    "флу",
+    "кси",
+)
+SUFFIXES = ("ин", "ол", "ан", "ид", "амин", "афен", "профен", "триптан")
+
+
+def generated_names(count: int, rng: random.Random) -> list[str]:
+    names = set()
+    while len(names) < count:
+        parts = rng.randint(2, 4)
+        name = "".join(rng.choice(SYLLABLES) for _ in range(parts))
+        names.add(name + rng.choice(SUFFIXES))
+    return sorted(names)
+
+
+def noisy(name: str, rng: random.Random) -> str:
+    chars = list(name)
+    position = rng.randrange(len(chars))
+    kind = rng.choice(("drop", "double", "swap", "replace", "dosage"))
+    if kind == "drop" and len(chars) > 4:
+        del chars[position]
+    elif kind == "double":
+        chars.insert(position, chars[position])
+    elif kind == "swap" and position < len(chars) - 1:
+        chars[position], chars[position + 1] = (
+            chars[position + 1],
+            chars[position],
+        )
+    elif kind == "replace":
+        chars[position] = rng.choice("аоеиуя")
+    elif kind == "dosage":
+        return f"{name} {rng.choice((100, 200, 400, 500))} мг"
+    return "".join(chars)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--names", type=int, default=5000)
+    parser.add_argument("--queries", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    index = MedicationIndex()
+    started = time.perf_counter()
+    index.load_file(DICTIONARY_PATH)
+    for name in generated_names(max(args.names - len(index), 0), rng):
+        index.add(name)
+    build_time = time.perf_counter() - started
+
+    spellings = list(index._exact)
+    targets = [rng.choice(spellings) for _ in range(args.queries)]
+    queries = [noisy(name, rng) for name in targets]
+
+    started = time.perf_counter()
+    results = [index.canonicalize(query) for query in queries]
+    lookup_time = time.perf_counter() - started
+
+    expected = [index.canonicalize(name) for name in targets]
+    correct = sum(
+        result == target for result, target in zip(results, expected)
+    )
+    print(f"dictionary: {len(index)} spellings, built in {build_time:.3f}s")
+    print(
+        f"lookups: {args.queries} in {lookup_time:.3f}s, "
+        f"{args.queries / lookup_time:,.0f}/s, "
+        f"{lookup_time / args.queries * 1e6:.1f}us each"
+    )
+    print(f"matched to the intended name: {correct / args.queries:.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -8,6 +8,7 @@ from aiogram.types import (
     CallbackQuery,
     Message,
     FSInputFile,
+    BufferedInputFile,
 )
 from aiogram.fsm.context import FSMContext
 import aiofiles
@@ -24,6 +25,8 @@ from services.save_survey_response import (
     generate_calendar_markup,
     get_survey_by_date,
 )
+from services.export_cache import export_cache, get_export_version
+from services.report_pool import ReportQueueFull
 from services.statistics import generate_statistics_file
 from utils.datetime_utils import get_current_time_in_almaty_naive
 
@@ -49,9 +52,7 @@ async def menu_command_headache(
 
     # Check if user exists
     user_id = message.from_user.id
-    existing_user_language = await database.get_entity_parameter(
-        model_class=User, filters={"userid": user_id}, parameter="language"
-    )
+    existing_user_language = await database.queries.user_language(user_id)
     # Путь к изображению
     photo_path = "static/img/diary.jpeg"
 
@@ -79,10 +80,15 @@ async def generate_diary_title(marks):
     if not marks:
         return "Записей в этом месяце нет."
 
-    counter = Counter(marks.get("headache_medicament_today", []))
+    # Подсчёт по нормализованным названиям делает SQL-запрос
+    medication_counts = marks.get("medication_counts")
+    if medication_counts is None:
+        medication_counts = Counter(
+            marks.get("headache_medicament_today", [])
+        ).items()
     medicament_output = "\n".join(
         f"{medicament.title()} - {count}"
-        for medicament, count in counter.items()
+        for medicament, count in medication_counts
     )
 
     diary_title = (
@@ -243,7 +249,11 @@ async def back_to_calendar(
     )
 
 
-@router.callback_query(lambda c: c.data and c.data.startswith("add_"))
+# Опрос начинается с вызова GPT, перевода и TTS
+@router.callback_query(
+    lambda c: c.data and c.data.startswith("add_"),
+    flags={"unit_of_work": False},
+)
 async def add_or_update_record(
     callback_query: CallbackQuery, state: FSMContext
 ):
@@ -274,9 +284,7 @@ async def menu_command_statistics(message: Message, database: Postgres):
 
     # Check if user exists
     user_id = message.from_user.id
-    existing_user = await database.get_entity_parameter(
-        model_class=User, filters={"userid": user_id}
-    )
+    existing_user = await database.queries.user_exists(user_id)
 
     if existing_user:
         await message.answer_photo(
@@ -291,50 +299,69 @@ async def menu_command_statistics(message: Message, database: Postgres):
         )
 
 
-@router.callback_query(F.data == "download_statistics")
+# Отчёт строится в пуле процессов: соединение на это время не держим
+@router.callback_query(
+    F.data == "download_statistics", flags={"unit_of_work": False}
+)
 async def send_statistics_file(
     callback_query: CallbackQuery, state: FSMContext, database: Postgres
 ):
     user_id = callback_query.from_user.id
 
     try:
-        # Получаем данные из базы данных
-        entities = await database.get_entities(Survey)
-        user_info = await database.get_entities(User)
+        user = await database.get_entity_parameter(User, {"userid": user_id})
+        version = await get_export_version(database, user_id, user)
 
-        if not entities:
+        if not version[0]:
             await callback_query.message.answer(
                 "К сожалению, у вас пока нет записей в дневнике."
             )
             return
 
-        # Фильтруем записи по user_id
-        user_records = [
-            entity for entity in entities if entity.userid == user_id
-        ]
-
-        if not user_records:
-            await callback_query.message.answer(
-                "К сожалению, у вас пока нет записей в дневнике."
+        # Данные не менялись — отдаём уже загруженный в Telegram файл
+        cached = export_cache.get(user_id, version)
+        if cached is not None and cached.file_id:
+            try:
+                await callback_query.message.answer_document(
+                    document=cached.file_id
+                )
+                logging.info(f"User {user_id} got cached statistics.")
+                return
+            except Exception as e:
+                logging.warning(f"Cached statistics file_id failed: {e}")
+                export_cache.forget_file_id(user_id)
+                cached = None
+
+        if cached is not None and cached.data:
+            file_bytes = cached.data
+        else:
+            # Получаем из базы данных только записи этого пользователя
+            user_records = await database.get_entities_parameter(
+                Survey, {"userid": user_id}
             )
-            return
-
-        # Подготовка и отправка файла
-        temp_file_path = await generate_statistics_file(
-            user_records, user_info, user_id
-        )
+            # Файл строится в пуле процессов, цикл событий не блокируется
+            file_bytes = await generate_statistics_file(
+                user_records or [], [user] if user else []
+            )
+            export_cache.put(user_id, version, file_bytes)
 
-        # Отправляем файл пользователю
-        await callback_query.message.answer_document(
-            document=FSInputFile(temp_file_path, filename="statistics.xlsx")
+        # Отправляем файл пользователю прямо из памяти
+        sent = await callback_query.message.answer_document(
+            document=BufferedInputFile(file_bytes, filename="statistics.xlsx")
         )
+        if sent.document:
+            export_cache.remember_file_id(
+                user_id, version, sent.document.file_id
+            )
         logging.info(
             f"User {user_id} successfully downloaded their statistics."
         )
 
-        # Удаляем временный файл
-        os.remove(temp_file_path)
-
+    except ReportQueueFull:
+        logging.warning(f"Statistics queue is full, user {user_id} rejected")
+        await callback_query.message.answer(
+            "Сейчас формируется много отчётов, попробуйте через минуту."
+        )
     except Exception as e:
         logging.error(f"Error generating statistics for user {user_id}: {e}")
         await callback_query.message.answer(
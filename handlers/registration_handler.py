@@ -1,4 +1,3 @@
-import os
 from typing import Optional
 from aiogram import Router, F, Bot
 from aiogram.filters import CommandStart
@@ -7,13 +6,14 @@ from aiogram.types import (
     InlineKeyboardMarkup,
     CallbackQuery,
     Message,
-    FSInputFile,
 )
 from aiogram.fsm.context import FSMContext
 from services.openai_service import process_question, get_new_thread_id
 
-from services.yandex_service import translate_text, synthesize_speech
+from services.yandex_service import translate_reply
+from services.voice_reply import send_voice_reply
 from services.database import User, Postgres
+from services.database.write_behind import profile_writes
 from settings import ASSISTANT_ID, ASSISTANT2_ID
 from states.states import Form
 from utils.datetime_utils import get_current_time_in_almaty_naive
@@ -42,14 +42,10 @@ async def process_start_command(
     print(f"User ID in process_start_command: {user_id}")
 
     # Check if user exists
-    existing_user = await database.get_entity_parameter(
-        model_class=User, filters={"userid": user_id}
-    )
+    existing_user = await database.queries.user_exists(user_id)
     logger.info(f"existing_user in databasee checking: {existing_user}")
 
-    existing_user_language = await database.get_entity_parameter(
-        model_class=User, filters={"userid": user_id}, parameter="language"
-    )
+    existing_user_language = await database.queries.user_language(user_id)
 
     logger.info(f"existing_user language: {existing_user_language}")
 
@@ -65,10 +61,13 @@ async def process_start_command(
     )
 
 
+# Регистрация и опрос ждут GPT, перевод и TTS — соединение не держим,
+# и новая строка пользователя фиксируется сразу, а не после ответа GPT
 @router.callback_query(
     F.data.in_(
         ["set_lang_ru", "set_lang_kk", "record_for_ru", "record_for_kk"]
-    )
+    ),
+    flags={"unit_of_work": False},
 )
 async def set_language(
     callback_query: CallbackQuery,
@@ -85,13 +84,6 @@ async def set_language(
 
     language = callback_query.data.split("_")[-1]
 
-    await database.update_entity_parameter(
-        entity_id=user_id,
-        parameter="language",
-        value=language,
-        model_class=User,
-    )
-
     messages_to_delete = []
 
     if callback_query.data == "set_lang_ru":
@@ -108,9 +100,11 @@ async def set_language(
     await callback_query.answer(text="Одну секундочку...")
 
     # Check if user exists
-    existing_user = await database.get_entity_parameter(
-        model_class=User, filters={"userid": user_id}
-    )
+    existing_user = await database.queries.user_exists(user_id)
+    if existing_user:
+        # Ответ не ждёт записи в базу: язык уйдёт в пакетном UPDATE
+        profile_writes.write(user_id, language=language)
+    # Новому пользователю язык из состояния запишет process_registration
 
     # Обновляем состояние
     await state.update_data(language=language, existing_user=existing_user)
@@ -215,33 +209,17 @@ async def process_registration(
     # Перевод ответа на казахский язык, если выбран казахский язык
     if user_lang == "kk":
         logger.info(f"response_text: {response_text}")
-        response_text = translate_text(
+        response_text = await translate_reply(
             response_text, source_lang="ru", target_lang="kk"
         )
 
     # Преобразование текстового ответа в аудио с использованием TTS API
-    logger.info("Generating speech audio with TTS API")
-    audio_response_bytes = synthesize_speech(
-        response_text, lang_code=user_lang
-    )
-    logger.info("Generated speech audio")
-
-    mp3_audio_path = "response.mp3"
-    with open(mp3_audio_path, "wb") as mp3_audio_file:
-        mp3_audio_file.write(audio_response_bytes)
-
     try:
-        await message.answer_voice(
-            voice=FSInputFile(mp3_audio_path), caption=response_text
-        )
+        await send_voice_reply(response_text, user_lang, message=message)
         logger.info("Voice response for registration successfully sent")
     except Exception as e:
         logger.error(f"Failed to send voice response for registration: {e}")
         await message.answer("Не удалось отправить голосовой ответ.")
-    finally:
-        if os.path.exists(mp3_audio_path):
-            os.remove(mp3_audio_path)
-            logger.info(f"File {mp3_audio_path} deleted")
 
     await state.set_state(Form.waiting_for_voice)
 
@@ -284,36 +262,22 @@ async def start_survey(
     # Перевод ответа на казахский язык, если выбран казахский язык
     if user_lang == "kk":
         logger.info(f"response_text: {response_text}")
-        response_text = translate_text(
+        response_text = await translate_reply(
             response_text, source_lang="ru", target_lang="kk"
         )
 
     # Преобразование текстового ответа в аудио с использованием TTS API
-    logger.info("Generating speech audio with TTS API")
-    audio_response_bytes = synthesize_speech(
-        response_text, lang_code=user_lang
-    )
-    logger.info("Generated speech audio")
-
-    mp3_audio_path = "response.mp3"
-    with open(mp3_audio_path, "wb") as mp3_audio_file:
-        mp3_audio_file.write(audio_response_bytes)
-
     try:
         if user_id:
-            bot_voice_message = await bot.send_voice(
-                chat_id=user_id,
-                voice=FSInputFile(mp3_audio_path),
-                caption=response_text,
+            bot_voice_message = await send_voice_reply(
+                response_text, user_lang, bot=bot, chat_id=user_id
             )
-            bot_voice_message_id = bot_voice_message.message_id
-            logger.info("Voice response for survey successfully sent")
         else:
-            bot_voice_message = await message.answer_voice(
-                voice=FSInputFile(mp3_audio_path), caption=response_text
+            bot_voice_message = await send_voice_reply(
+                response_text, user_lang, message=message
             )
-            bot_voice_message_id = bot_voice_message.message_id
-            logger.info("Voice response for survey successfully sent")
+        bot_voice_message_id = bot_voice_message.message_id
+        logger.info("Voice response for survey successfully sent")
 
         # Сохранение идентификатора голосового сообщения бота в состоянии
         await state.update_data(bot_voice_message_id=bot_voice_message_id)
@@ -321,9 +285,5 @@ async def start_survey(
     except Exception as e:
         logger.error(f"Failed to send voice response for survey: {e}")
         await message.answer("Не удалось отправить голосовой ответ.")
-    finally:
-        if os.path.exists(mp3_audio_path):
-            os.remove(mp3_audio_path)
-            logger.info(f"File {mp3_audio_path} deleted")
 
     await state.set_state(Form.waiting_for_voice)
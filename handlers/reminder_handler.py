@@ -1,4 +1,4 @@
-from aiogram import Router, F, Bot
+from aiogram import Router, F
 from aiogram.types import (
     Message,
     InlineKeyboardButton,
@@ -7,10 +7,10 @@ from aiogram.types import (
 )
 from aiogram.fsm.context import FSMContext
 from services.database import Postgres, User
+from services.database.write_behind import profile_writes
 from datetime import datetime
 import logging
 
-from services.scheduler_service import ReminderManager
 from states.states import ReminderStates, PersonalSettingsStates
 
 logger = logging.getLogger(__name__)
@@ -43,10 +43,8 @@ async def show_settings_menu(message: Message, state: FSMContext, database: Post
     data = await state.get_data()
     existing_user = data.get("existing_user")
 
-    if existing_user is None:
-        existing_user = await database.get_entity_parameter(
-            model_class=User, filters={"userid": user_id}
-        )
+    if not existing_user:
+        existing_user = await database.queries.user_exists(user_id)
         if existing_user:
             await state.update_data(existing_user=True)
 
@@ -96,7 +94,7 @@ async def set_reminder_time(callback_query: CallbackQuery, state: FSMContext):
 
 @router.message(ReminderStates.set_time)
 async def process_set_time(
-    message: Message, state: FSMContext, database: Postgres, bot: Bot
+    message: Message, state: FSMContext, database: Postgres
 ):
     try:
         reminder_time_str = message.text
@@ -110,13 +108,8 @@ async def process_set_time(
             model_class=User,
         )
 
+        # Напоминание отправит ведущий экземпляр по reminder_time
         await state.clear()
-        reminder_manager = ReminderManager(database, bot, state)
-        # await reminder_manager.schedule_reminder(
-        #     user_id, reminder_time
-        # )
-        # Устанавливаем напоминание
-        await reminder_manager.schedule_reminder(user_id, reminder_time)
 
         await message.answer(
             "Время напоминания установлено.\n До скорой встречи!"
@@ -138,7 +131,6 @@ async def disable_reminder(
     callback_query: CallbackQuery,
     state: FSMContext,
     database: Postgres,
-    bot: Bot,
 ):
     try:
         user_id = callback_query.from_user.id
@@ -150,11 +142,6 @@ async def disable_reminder(
         )
         await state.clear()
 
-        reminder_manager = ReminderManager(database, bot, state)
-
-        # Отменяем напоминание
-        await reminder_manager.cancel_reminder(user_id)
-
         await callback_query.message.answer("Напоминание отключено.")
     except Exception as e:
         logger.error(f"Error disabling reminder: {e}")
@@ -204,12 +191,7 @@ async def receive_fullname(message: Message, state: FSMContext, database: Postgr
     fullname = message.text
 
     try:
-        await database.update_entity_parameter(
-            entity_id=user_id,
-            parameter="fio",
-            value=fullname,
-            model_class=User
-        )
+        profile_writes.write(user_id, fio=fullname)
         await state.clear()
         await message.answer("ФИО обновлено.")
     except Exception as e:
@@ -236,12 +218,7 @@ async def receive_menstrual_cycle(callback_query: CallbackQuery, state: FSMConte
     menstrual_cycle = "да" if callback_query.data == "menstrual_cycle_yes" else "нет"
 
     try:
-        await database.update_entity_parameter(
-            entity_id=user_id,
-            parameter="menstrual_cycle",
-            value=menstrual_cycle,
-            model_class=User
-        )
+        profile_writes.write(user_id, menstrual_cycle=menstrual_cycle)
         await callback_query.message.delete()
         await callback_query.message.answer("Данные о менструальном цикле обновлены.")
     except Exception as e:
@@ -267,12 +244,7 @@ async def receive_country(message: Message, state: FSMContext, database: Postgre
     country = message.text
 
     try:
-        await database.update_entity_parameter(
-            entity_id=user_id,
-            parameter="country",
-            value=country,
-            model_class=User
-        )
+        profile_writes.write(user_id, country=country)
         await state.clear()
         await message.answer("Ваша страна обновлена.")
     except Exception as e:
@@ -296,12 +268,7 @@ async def receive_city(message: Message, state: FSMContext, database: Postgres):
     city = message.text
 
     try:
-        await database.update_entity_parameter(
-            entity_id=user_id,
-            parameter="city",
-            value=city,
-            model_class=User
-        )
+        profile_writes.write(user_id, city=city)
         await state.clear()
         await message.answer("Ваш город обновлен.")
     except Exception as e:
@@ -331,12 +298,7 @@ async def receive_medicament(message: Message, state: FSMContext, database: Post
     medicament = message.text
 
     try:
-        await database.update_entity_parameter(
-            entity_id=user_id,
-            parameter="const_medication_name",
-            value=medicament,
-            model_class=User
-        )
+        profile_writes.write(user_id, const_medication_name=medicament)
         await state.clear()
         await message.answer("Название постоянного медикамента обновлено.")
     except Exception as e:
@@ -372,12 +334,7 @@ async def set_language(callback_query: CallbackQuery, state: FSMContext, databas
     language_text = "Русский" if language == "ru" else "Қазақ"
 
     try:
-        await database.update_entity_parameter(
-            entity_id=user_id,
-            parameter="language",
-            value=language,
-            model_class=User
-        )
+        profile_writes.write(user_id, language=language)
         await state.update_data(language=language)
         await callback_query.message.delete()
         await callback_query.message.answer(f"Выбран {language_text} язык.")
@@ -1,33 +1,85 @@
 from datetime import datetime
+from typing import Optional
 from aiogram import Router, F, Bot
-from aiogram.types import Message, FSInputFile
+from aiogram.types import Message
 from aiogram.fsm.context import FSMContext
 from pydub import AudioSegment
-import aiohttp
 import os
 import logging
+from services.http_clients import http_clients
+from services.metrics import errors
 from services.openai_service import process_question, get_new_thread_id
 from services.save_survey_response import save_survey_response
-from services.scheduler_service import ReminderManager
+from services.user_turns import TurnSuperseded, user_turns
 from services.yandex_service import (
     recognize_speech,
-    synthesize_speech,
     translate_text,
+    translate_reply,
 )
+from services.voice_reply import send_voice_reply, send_try_again_reply
 from settings import ASSISTANT2_ID, ASSISTANT_ID
 from states.states import Form
 import json
 from services.database import Postgres, User
+from utils.config import VOICE_TURN_DEADLINE
 from utils.datetime_utils import get_current_time_in_almaty_naive
+from utils.deadline import (
+    DeadlineExceeded,
+    record_exhausted,
+    run_stage,
+    turn_deadline,
+)
 from dateutil import parser
 
 router = Router()
 logger = logging.getLogger(__name__)
 
 
-@router.message(Form.waiting_for_voice, F.voice | F.text)
+async def download_voice_file(bot: Bot, file_id: str) -> Optional[bytes]:
+    logger.info(f"Voice file id: {file_id}")
+    file_info = await bot.get_file(file_id)
+    file_url = (
+        f"https://api.telegram.org/file/bot{bot.token}/{file_info.file_path}"
+    )
+
+    # Общий пул соединений с api.telegram.org вместо новой сессии
+    session = http_clients.session("telegram_file")
+    async with session.get(file_url) as response:
+        if response.status == 200:
+            return await response.read()
+        logger.error(f"Failed to download file: HTTP status {response.status}")
+        return None
+
+
+# Между запросами к базе идут долгие вызовы STT и GPT — соединение
+# не держим, каждый запрос к базе берёт своё
+@router.message(
+    Form.waiting_for_voice,
+    F.voice | F.text,
+    flags={"unit_of_work": False},
+)
 async def handle_voice_message(
     message: Message, state: FSMContext, bot: Bot, database: Postgres
+):
+    # Ограничиваем весь ход общим бюджетом времени
+    with turn_deadline(VOICE_TURN_DEADLINE):
+        try:
+            await process_voice_turn(message, state, bot, database)
+        except DeadlineExceeded as e:
+            record_exhausted(e.stage)
+            data = await state.get_data()
+            await send_try_again_reply(message, data.get("language", "ru"))
+        except TurnSuperseded:
+            logger.info(
+                f"Turn of user {message.from_user.id} superseded "
+                "by a newer message"
+            )
+        finally:
+            user_turns.release(message.from_user.id)
+
+
+async def process_voice_turn(
+    message: Message, state: FSMContext, bot: Bot, database: Postgres
 ):
     try:
         # logger.info("Received voice message")
@@ -59,26 +111,14 @@ async def handle_voice_message(
         logger.info(f"User language in handle_voice_message: {user_lang}")
         file_content = []
         if message.voice:
-            voice_file_id = message.voice.file_id
-            logger.info(f"Voice file id: {voice_file_id}")
-            file_info = await bot.get_file(voice_file_id)
-            file_url = f"https://api.telegram.org/file/bot{bot.token}/{file_info.file_path}"
-            logger.info(f"File URL: {file_url}")
-
-            async with aiohttp.ClientSession() as session:
-                async with session.get(file_url) as response:
-                    if response.status == 200:
-                        file_content = await response.read()
-                        with open("voice.oga", "wb") as voice_file:
-                            voice_file.write(file_content)
-                        logger.info(
-                            "File successfully downloaded and saved as voice.oga"
-                        )
-                    else:
-                        logger.error(
-                            f"Failed to download file: HTTP status {response.status}"
-                        )
-                        return
+            file_content = await run_stage(
+                "download", download_voice_file(bot, message.voice.file_id)
+            )
+            if file_content is None:
+                return
+            with open("voice.oga", "wb") as voice_file:
+                voice_file.write(file_content)
+            logger.info("File successfully downloaded and saved as voice.oga")
 
             # Конвертация файла в mp3
             logger.info("Converting OGA to MP3")
@@ -89,8 +129,12 @@ async def handle_voice_message(
         # Преобразование аудио в текст с использованием Yandex STT
         logger.info("Starting transcription with Yandex STT")
         if file_content:
-            recognized_text_original = recognize_speech(
-                file_content, lang="kk-KK" if user_lang == "kk" else "ru-RU"
+            recognized_text_original = await run_stage(
+                "stt",
+                recognize_speech(
+                    file_content,
+                    lang="kk-KK" if user_lang == "kk" else "ru-RU",
+                ),
             )
         else:
             recognized_text_original = message.text
@@ -110,10 +154,13 @@ async def handle_voice_message(
         else:
             # messages_to_delete = []
             if user_lang == "kk":
-                recognized_text = translate_text(
-                    recognized_text_original,
-                    source_lang="kk",
-                    target_lang="ru",
+                recognized_text = await run_stage(
+                    "translate_in",
+                    translate_text(
+                        recognized_text_original,
+                        source_lang="kk",
+                        target_lang="ru",
+                    ),
                 )
                 logger.info(f"Recognized text: {recognized_text}")
 
@@ -128,6 +175,16 @@ async def handle_voice_message(
                 # messages_to_delete.append(delete_message_ru.message_id)
                 recognized_text = recognized_text_original
 
+            # Один ход на пользователя: ждём завершения предыдущего
+            recognized_text = await user_turns.acquire(
+                user_id, recognized_text
+            )
+            if recognized_text is None:
+                logger.info(f"Message of user {user_id} merged into a turn")
+                return
+            # Предыдущий ход мог обновить состояние
+            data = await state.get_data()
+
             # Получаем thread_id и тип ассистента из состояния
             thread_id = data.get("thread_id")
             assistant_type = data.get("assistant_type", "registration")
@@ -144,18 +201,23 @@ async def handle_voice_message(
             logger.info(
                 f"Sending question to GPT-4 with assistant_id: {assistant_id} and thread_id: {thread_id}"
             )
-            response_text, new_thread_id, full_response = (
-                await process_question(
-                    recognized_text, thread_id, assistant_id
-                )
+            response_text, new_thread_id, full_response = await run_stage(
+                "llm",
+                user_turns.run_llm(
+                    user_id,
+                    process_question(recognized_text, thread_id, assistant_id),
+                ),
             )
             logger.info(
                 f"Response from GPT: {response_text}, new thread_id: {new_thread_id}, full_response: {full_response}"
             )
 
             if user_lang == "kk":
-                response_text = translate_text(
-                    response_text, source_lang="ru", target_lang="kk"
+                response_text = await run_stage(
+                    "translate_out",
+                    translate_reply(
+                        response_text, source_lang="ru", target_lang="kk"
+                    ),
                 )
 
             # Сохраняем новый thread_id и тип ассистента в состоянии
@@ -164,19 +226,9 @@ async def handle_voice_message(
             )
 
         # Преобразование текстового ответа в аудио с использованием TTS API
-        logger.info("Generating speech audio with TTS API")
-        audio_response_bytes = synthesize_speech(
-            response_text, lang_code=user_lang
-        )
-        logger.info("Generated speech audio")
-
-        mp3_audio_path = "response.mp3"
-        with open(mp3_audio_path, "wb") as mp3_audio_file:
-            mp3_audio_file.write(audio_response_bytes)
-
         try:
-            bot_voice_message = await message.answer_voice(
-                voice=FSInputFile(mp3_audio_path), caption=response_text
+            bot_voice_message = await send_voice_reply(
+                response_text, user_lang, message=message
             )
             bot_voice_message_id = bot_voice_message.message_id
             await state.update_data(bot_voice_message_id=bot_voice_message_id)
@@ -192,15 +244,14 @@ async def handle_voice_message(
             logger.info(
                 f"Current state in handle_voice_message: {current_state}"
             )
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             logger.error(f"Failed to send voice response: {e}")
             await message.answer(
                 "Не удалось отправить голосовой ответ. Попробуйте позже."
             )
         finally:
-            if os.path.exists(mp3_audio_path):
-                os.remove(mp3_audio_path)
-                logger.info(f"File {mp3_audio_path} deleted")
             if os.path.exists("voice.oga"):
                 os.remove("voice.oga")
                 logger.info("File voice.oga deleted")
@@ -308,13 +359,6 @@ async def handle_voice_message(
                             f"Converted reminder_time: {reminder_time}"
                         )
 
-                        reminder_manager = ReminderManager(
-                            database, bot, state
-                        )
-                        await reminder_manager.schedule_reminder(
-                            user_id, reminder_time
-                        )
-
                     except ValueError as e:
                         logger.error(f"Error parsing reminder_time: {e}")
 
@@ -381,10 +425,15 @@ async def handle_voice_message(
                     await state.set_state(Form.waiting_for_voice)
 
                     # Отправка вопроса "Здравствуйте" второму ассистенту
-                    new_thread_id = await get_new_thread_id()
+                    new_thread_id = await run_stage(
+                        "thread_create", get_new_thread_id()
+                    )
                     response_text, new_thread_id, full_response = (
-                        await process_question(
-                            "Здравствуйте", new_thread_id, ASSISTANT_ID
+                        await run_stage(
+                            "llm",
+                            process_question(
+                                "Здравствуйте", new_thread_id, ASSISTANT_ID
+                            ),
                         )
                     )
                     logger.info(
@@ -393,30 +442,25 @@ async def handle_voice_message(
                     await state.update_data(thread_id=new_thread_id)
 
                     if user_lang == "kk":
-                        response_text = translate_text(
-                            response_text,
-                            source_lang="ru",
-                            target_lang="kk",
+                        response_text = await run_stage(
+                            "translate_out",
+                            translate_reply(
+                                response_text,
+                                source_lang="ru",
+                                target_lang="kk",
+                            ),
                         )
 
                     # Преобразование текстового ответа в аудио с использованием TTS API
-                    audio_response_bytes = synthesize_speech(
-                        response_text, lang_code=user_lang
-                    )
-                    logger.info("Generated speech audio for headache")
-
-                    mp3_audio_path = "response_headache.mp3"
-                    with open(mp3_audio_path, "wb") as mp3_audio_file:
-                        mp3_audio_file.write(audio_response_bytes)
-
                     try:
-                        await message.answer_voice(
-                            voice=FSInputFile(mp3_audio_path),
-                            caption=response_text,
+                        await send_voice_reply(
+                            response_text, user_lang, message=message
                         )
                         logger.info(
                             "Voice response for headache successfully sent"
                         )
+                    except DeadlineExceeded:
+                        raise
                     except Exception as e:
                         logger.error(
                             f"Failed to send voice response for headache: {e}"
@@ -424,14 +468,15 @@ async def handle_voice_message(
                         await message.answer(
                             "Не удалось отправить голосовой ответ."
                         )
-                    finally:
-                        if os.path.exists(mp3_audio_path):
-                            os.remove(mp3_audio_path)
-                            logger.info(f"File {mp3_audio_path} deleted")
                 else:
                     logger.error("It was not registration, but survey")
+            except DeadlineExceeded:
+                raise
             except Exception as e:
                 logger.error(f"Error saving response to database: {e}")
 
+    except (DeadlineExceeded, TurnSuperseded):
+        raise
     except Exception as e:
+        errors.inc(kind="unhandled", place="voice_turn")
         logger.error(f"Error in handle_voice_message: {e}")
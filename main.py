@@ -1,30 +1,53 @@
-import asyncio
 import logging
-import os
 from datetime import datetime
 from fastapi import FastAPI
 from aiogram import Bot, Dispatcher
 from aiogram.fsm.storage.memory import MemoryStorage
-from middlewares import ThrottlingMiddleware
+from middlewares import (
+    QueryProfilerMiddleware,
+    ThrottlingMiddleware,
+    UnitOfWorkMiddleware,
+)
 from services.database import Postgres
+from services.database.leader import SharedTokens, leader
+from services.database.migrations import run_migrations
+from services.database.partitions import partition_maintainer
+from services.database.write_behind import profile_writes
 from settings import (
     TELEGRAM_BOT_TOKEN,
     Settings,
     create_bot,
     create_dispatcher,
+    run_front,
     run_webhook,
 )
-from services.yandex_service import get_iam_token, refresh_iam_token
+from services.http_clients import http_clients
+from services.loop_watchdog import loop_watchdog
+from services.medications import load_medications
+from services.report_pool import report_pool
+from services.scheduler_service import ReminderManager
+from services.tracing import install_log_correlation, tracer
+from services.workers import ChatRing, WorkerPool
+from services.yandex_service import iam_token_manager
 from handlers import (
     registration_handler,
     voice_handler,
     menu_handlers,
     reminder_handler,
 )
-from utils.config import WEBHOOK_URL, WEBHOOK_PATH, WEBAPP_HOST, WEBAPP_PORT
+from utils.config import (
+    MIGRATE_ON_STARTUP,
+    WEB_WORKERS,
+    WORKER_INDEX,
+    WEBHOOK_URL,
+    WEBHOOK_PATH,
+    WEBAPP_HOST,
+    WEBAPP_PORT,
+)
 
 # Настройки Telegram-бота
 logging.basicConfig(level=logging.INFO)
+install_log_correlation()
 logger = logging.getLogger(__name__)
 
 app = FastAPI()
@@ -32,12 +55,35 @@ app = FastAPI()
 
 @app.on_event("startup")
 async def startup():
-    logger.info("Starting bot")
-    get_iam_token()
-    task = asyncio.create_task(refresh_iam_token())
-    _ = task
+    if WEB_WORKERS > 1 and WORKER_INDEX is None:
+        await start_front()
+        return
+
+    logger.info(
+        "Starting bot"
+        + (f" worker {WORKER_INDEX}" if WORKER_INDEX is not None else "")
+    )
+    await http_clients.start()
+    tracer.start()
+    loop_watchdog.start()
 
     database = Postgres()
+    if MIGRATE_ON_STARTUP:
+        await run_migrations(database)
+    profile_writes.start(database)
+    # Фоновые задачи в одном экземпляре работают только у ведущего;
+    # токен получаем в фоне, не блокируя запуск
+    iam_token_manager.share(SharedTokens(database, leader))
+    iam_token_manager.follow()
+    leader.add_duty(
+        "iam_token", iam_token_manager.start, iam_token_manager.stop
+    )
+    leader.add_duty(
+        "survey_partitions",
+        lambda: partition_maintainer.start(database),
+        partition_maintainer.stop,
+    )
+    await load_medications(database)
 
     settings: Settings = Settings(
         bot_token=TELEGRAM_BOT_TOKEN,
@@ -58,24 +104,82 @@ async def startup():
     dp.include_router(menu_handlers.router)
     dp.include_router(reminder_handler.router)
 
+    reminder_manager = ReminderManager(
+        database,
+        bot,
+        dp.storage,
+        ring=ChatRing(WEB_WORKERS) if WEB_WORKERS > 1 else None,
+    )
+    leader.add_duty("reminders", reminder_manager.start, reminder_manager.stop)
+    leader.start(database)
+
     dp.message.middleware(ThrottlingMiddleware())
     dp.callback_query.middleware(ThrottlingMiddleware())
+    # Счётчики запросов на обработчик, включая коммит единицы работы
+    dp.message.middleware(QueryProfilerMiddleware())
+    dp.callback_query.middleware(QueryProfilerMiddleware())
+    # Один сеанс базы данных и один коммит на обработчик
+    dp.message.middleware(UnitOfWorkMiddleware())
+    dp.callback_query.middleware(UnitOfWorkMiddleware())
 
     # Логирование текущего времени
     current_time = datetime.now()
     logger.info(f"Current time at bot start: {current_time}")
 
-    await run_webhook(
+    # Вебхук обслуживает aiohttp в фоне: запуск возвращает управление
+    # uvicorn, и по SIGTERM выполняется shutdown
+    app.state.runner = await run_webhook(
         app_dispatcher=dp,
         bot=bot,
         webhook_url=WEBHOOK_URL,
         webhook_path=WEBHOOK_PATH,
         host=WEBAPP_HOST,
         port=WEBAPP_PORT,
+        reminders=reminder_manager,
+    )
+
+
+async def start_front():
+    """
+    Run the front of the multi-worker mode: it sets the webhook and
+    passes each update to the worker process owning its chat.
+    """
+    logger.info(f"Starting front with {WEB_WORKERS} workers")
+    await http_clients.start()
+    bot = Bot(token=TELEGRAM_BOT_TOKEN)
+    app.state.pool = WorkerPool(WEB_WORKERS)
+    app.state.runner = await run_front(
+        bot=bot,
+        pool=app.state.pool,
+        webhook_url=WEBHOOK_URL,
+        webhook_path=WEBHOOK_PATH,
+        host=WEBAPP_HOST,
+        port=WEBAPP_PORT,
     )
 
 
+@app.on_event("shutdown")
+async def shutdown():
+    # Сначала перестаём принимать обновления
+    runner = getattr(app.state, "runner", None)
+    if runner is not None:
+        await runner.cleanup()
+    pool = getattr(app.state, "pool", None)
+    if pool is not None:
+        await pool.stop()
+        return
+    # Останавливает обязанности ведущего и отпускает блокировку
+    await leader.stop()
+    await iam_token_manager.stop_following()
+    # Отложенные записи профиля сбрасываются до остановки
+    await profile_writes.stop()
+    report_pool.shutdown()
+    # В строгом режиме завершение упадёт, если цикл блокировался
+    await loop_watchdog.stop()
+
+
 if __name__ == "__main__":
     import uvicorn
 
-    uvicorn.run("main:app", host="0.0.0.0", port=int(os.getenv("PORT", 8080)))
+    # Порт PORT занимает вебхук, у самого uvicorn маршрутов нет
+    uvicorn.run("main:app", host="127.0.0.1", port=0)
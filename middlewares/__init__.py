@@ -1 +1,3 @@
 from .throttling import ThrottlingMiddleware
+from .unit_of_work import UnitOfWorkMiddleware
+from .query_profiler import QueryProfilerMiddleware
@@ -0,0 +1,29 @@
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from services.database.profiler import query_profiler
+from services.tracing import current_update_id
+
+
+class QueryProfilerMiddleware(BaseMiddleware):
+    """
+    Attributes the database statements of a handler call to the handler,
+    for per-handler query counts and N+1 detection.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        handler_object = data.get("handler")
+        name = (
+            handler_object.callback.__name__
+            if handler_object is not None
+            else type(event).__name__
+        )
+        with query_profiler.profile(name, current_update_id()):
+            return await handler(event, data)
@@ -5,6 +5,7 @@ from typing import Any, Awaitable, Callable
 from aiogram import BaseMiddleware, Bot
 from aiogram.types import TelegramObject, User
 from cachetools import TTLCache
+from services.metrics import errors, throttled
 from utils.config import THROTTLING_TIME_PERIOD, THROTTLING_MAX_RATE
 
 
@@ -47,11 +48,13 @@ class ThrottlingMiddleware(BaseMiddleware):
                         text="Дождитесь ответа или повторите попытку",
                     )
                     throttling_data.sent_warning = True
+                throttled.inc()
                 return None
 
             throttling_data.rate += 1
             return await handler(event, data)
 
         except Exception as e:
+            errors.inc(kind="unhandled", place="throttling_middleware")
             logging.error("Произошла ошибка: %s", e, exc_info=True)
 
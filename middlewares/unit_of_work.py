@@ -0,0 +1,32 @@
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.flags import get_flag
+from aiogram.types import TelegramObject
+
+from services.database.unit_of_work import unit_of_work
+
+
+class UnitOfWorkMiddleware(BaseMiddleware):
+    """
+    Runs a handler in one database unit of work: a single session and
+    connection for all its queries, committed once when it returns.
+
+    Handlers that wait on slow external services between queries opt out
+    with ``flags={"unit_of_work": False}`` so they do not hold a pooled
+    connection while waiting.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        database = data.get("database")
+        if database is None or not get_flag(
+            data, "unit_of_work", default=True
+        ):
+            return await handler(event, data)
+        async with unit_of_work(database):
+            return await handler(event, data)
@@ -1,2 +1,13 @@
 from .crud import Postgres
-from .models import User, Survey, Database
+from .models import (
+    User,
+    Survey,
+    SurveyDailySummary,
+    Medication,
+    UnmatchedMedication,
+    ProfileWriteOutbox,
+    LeaderLease,
+    SharedToken,
+    ReminderDelivery,
+    Database,
+)
@@ -1,5 +1,8 @@
+import itertools
 import logging
-from typing import Optional, Union, Type, Any
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional, Sequence, Union, Type, Any
 from sqlalchemy import (
     select,
     update,
@@ -9,20 +12,51 @@ from sqlalchemy import (
     String,
     Integer,
     func,
+    tuple_,
 )
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.ext.asyncio import (
     create_async_engine,
+    AsyncEngine,
     AsyncSession,
     async_sessionmaker,
 )
-from .models import Base, Database
-from utils.config import DB_NAME, DB_PASSWORD, DB_USER, DB_HOST, DB_PORT
+from cachetools import TTLCache
+from .hot_queries import HotQueries
+from .models import Base, Database, User
+from .profiler import query_profiler
+from .unit_of_work import current_unit_of_work
+from .write_behind import ProfileSettleError, profile_writes
+from services.metrics import db_latency, db_reads, timed_db
+from services.tracing import span, traced
+from utils.config import (
+    DB_NAME,
+    DB_PASSWORD,
+    DB_USER,
+    DB_HOST,
+    DB_PORT,
+    DB_REPLICA_HOSTS,
+    READ_YOUR_WRITES_WINDOW,
+)
+
+# Размер страницы потокового чтения по умолчанию
+ITER_BATCH_SIZE = 1000
 
 
 logger = logging.getLogger(__name__)
 
 
+def _filtered_user(filters: Optional[dict]) -> Optional[int]:
+    return filters.get("userid") if filters else None
+
+
+def _written_user(entity_id: Union[int, tuple]) -> Optional[int]:
+    # Составной ключ опроса — (survey_id, userid, created_at)
+    if isinstance(entity_id, tuple):
+        return entity_id[1] if len(entity_id) > 1 else None
+    return entity_id
+
+
 class Postgres(Database):
     """
     Implementation of the Database interface for PostgreSQL.
@@ -36,22 +70,133 @@ class Postgres(Database):
         self._DB_PASSWORD = DB_PASSWORD
 
         try:
-            self.engine = create_async_engine(
-                f"postgresql+asyncpg://{self._DB_USER}:{self._DB_PASSWORD}"
-                f"@{self._DB_HOST}:{self._DB_PORT}/{self._DB_NAME}",
-                pool_size=10,  # Установите размер пула соединений
-                max_overflow=20,  # Установите максимальное количество соединений
-                pool_timeout=30,  # Установите время ожидания в секундах
-                pool_recycle=1800,  # Установите время переработки соединений в секундах
-                pool_pre_ping=True  # Включите pre-ping для проверки соединения
-            )
+            self.engine = self._create_engine(self._DB_HOST, self._DB_PORT)
             self.Session = async_sessionmaker(
                 bind=self.engine, expire_on_commit=False, class_=AsyncSession
             )
+            # Реплики только для чтения, если заданы
+            self.replica_engines = [
+                self._create_engine(*self._split_host(host))
+                for host in DB_REPLICA_HOSTS
+            ]
+            self.ReplicaSessions = [
+                async_sessionmaker(
+                    bind=engine, expire_on_commit=False, class_=AsyncSession
+                )
+                for engine in self.replica_engines
+            ]
+            self._replica_order = itertools.cycle(
+                range(len(self.replica_engines))
+            )
+            # Пользователи, недавно писавшие в базу: их чтения идут на
+            # основной сервер, пока реплики не догонят
+            self._pinned: TTLCache[int, bool] = TTLCache(
+                maxsize=100_000, ttl=READ_YOUR_WRITES_WINDOW
+            )
+            for engine in (self.engine, *self.replica_engines):
+                query_profiler.instrument(engine)
+            # Подготовленные запросы горячих путей без ORM
+            self.queries = HotQueries(self, self.engine)
             logger.info("Database engine and session initialized successfully")
         except Exception as e:
             logger.error(f"Class <Postgres> connection error: {e}")
 
+    def _create_engine(self, host: str, port: str) -> AsyncEngine:
+        return create_async_engine(
+            f"postgresql+asyncpg://{self._DB_USER}:{self._DB_PASSWORD}"
+            f"@{host}:{port}/{self._DB_NAME}",
+            pool_size=10,  # Установите размер пула соединений
+            max_overflow=20,  # Установите максимальное количество соединений
+            pool_timeout=30,  # Установите время ожидания в секундах
+            pool_recycle=1800,  # Установите время переработки соединений в секундах
+            pool_pre_ping=True  # Включите pre-ping для проверки соединения
+        )
+
+    def _split_host(self, host: str) -> tuple[str, str]:
+        name, _, port = host.partition(":")
+        return name, port or self._DB_PORT
+
+    def pin_primary(self, user_id: Optional[int]) -> None:
+        """
+        Send the user's reads to the primary for READ_YOUR_WRITES_WINDOW
+        seconds after a write.
+        """
+        if self.replica_engines and user_id is not None:
+            self._pinned[user_id] = True
+
+    def _pick_replica(self, user_id: Optional[int]) -> Optional[int]:
+        if not self.replica_engines:
+            return None
+        uow = current_unit_of_work(self)
+        if uow is not None and uow.started:
+            # Обновление уже работает в общей сессии и должно видеть
+            # свои незакоммиченные записи
+            return None
+        if user_id is not None and user_id in self._pinned:
+            return None
+        return next(self._replica_order)
+
+    def read_engine(self, user_id: Optional[int] = None) -> AsyncEngine:
+        """
+        Engine for a read-only statement about the user.
+        """
+        replica = self._pick_replica(user_id)
+        if replica is None:
+            db_reads.inc(target="primary")
+            return self.engine
+        db_reads.inc(target="replica")
+        return self.replica_engines[replica]
+
+    @asynccontextmanager
+    async def read_scope(
+        self, user_id: Optional[int] = None
+    ) -> AsyncIterator[AsyncSession]:
+        """
+        Session for a read-only operation: a replica unless the user wrote
+        recently or a unit of work is active. A replica that cannot be
+        reached falls back to the primary.
+        """
+        replica = self._pick_replica(user_id)
+        if replica is not None:
+            session = self.ReplicaSessions[replica]()
+            try:
+                await session.connection()
+            except Exception as e:
+                await session.close()
+                logger.warning(f"Replica {replica} unavailable: {e}")
+            else:
+                db_reads.inc(target="replica")
+                try:
+                    yield session
+                finally:
+                    await session.close()
+                return
+
+        db_reads.inc(target="primary")
+        async with self.session_scope() as session:
+            yield session
+
+    @asynccontextmanager
+    async def session_scope(self) -> AsyncIterator[AsyncSession]:
+        """
+        Session for one database operation.
+
+        Inside the unit of work of an update this is its shared session,
+        and the operation runs in a savepoint: a failed statement undoes
+        only itself, and the unit of work commits once at the end. Outside
+        of it a new session is opened and committed on exit.
+        """
+        uow = current_unit_of_work(self)
+        if uow is None:
+            async with self.Session() as session:
+                yield session
+                await session.commit()
+            return
+
+        session = uow.session()
+        async with session.begin_nested():
+            yield session
+
     async def create_tables(self) -> None:
         """
         Create tables in database.
@@ -60,8 +205,10 @@ class Postgres(Database):
             async with self.engine.begin() as connection:
                 await connection.run_sync(Base.metadata.create_all)
         except Exception as e:
-            print(f"class <Postgres> create_tables error: {e}")
+            logger.exception(f"Error in create_tables: {e}")
 
+    @timed_db
+    @traced("db")
     async def add_entity(
         self,
         entity_data: Union[dict, Base],
@@ -77,17 +224,26 @@ class Postgres(Database):
         :return: None
         """
         try:
-            async with self.Session() as session:
+            async with self.session_scope() as session:
                 if isinstance(entity_data, dict):
                     entity = model_class(**entity_data)
                 else:
                     entity = entity_data
 
+                self.pin_primary(getattr(entity, "userid", None))
+                if model_class is User:
+                    # Отложенные записи не должны лечь поверх новой строки
+                    await profile_writes.settle(entity.userid, session=session)
                 session.add(entity)
-                await session.commit()
+        except ProfileSettleError:
+            # Иначе отложенные значения позже легли бы поверх прямой записи
+            logger.exception("Error in add_entity")
+            raise
         except Exception as e:
-            print(f"class <Postgres> add_entity error: {e}")
+            logger.exception(f"Error in add_entity: {e}")
 
+    @timed_db
+    @traced("db")
     async def get_entity_parameter(
         self,
         model_class: type[Base],
@@ -104,12 +260,14 @@ class Postgres(Database):
         :return: The entity or the value of the specified parameter.
         """
         try:
-            async with self.Session() as session:
+            async with self.read_scope(_filtered_user(filters)) as session:
                 if filters:
                     stmt = select(model_class).filter_by(**filters)
                     result = await session.execute(stmt)
                     entity = result.scalars().first()
 
+                    if entity and model_class is User:
+                        profile_writes.apply_overlay(entity)
                     if entity and parameter:
                         return getattr(entity, parameter, None)
                     return entity
@@ -120,6 +278,8 @@ class Postgres(Database):
             logger.error(f"Error in get_entity_parameter: {e}")
         return None
 
+    @timed_db
+    @traced("db")
     async def get_entities_parameter(
         self, model_class: Type[Base], filters: Optional[dict] = None
     ) -> Optional[list[Base]]:
@@ -132,11 +292,15 @@ class Postgres(Database):
         :return: A list of entities.
         """
         try:
-            async with self.Session() as session:
+            async with self.read_scope(_filtered_user(filters)) as session:
                 if filters:
                     stmt = select(model_class).filter_by(**filters)
                     result = await session.execute(stmt)
-                    return result.scalars().all()
+                    entities = result.scalars().all()
+                    if model_class is User:
+                        for entity in entities:
+                            profile_writes.apply_overlay(entity)
+                    return entities
 
         except SQLAlchemyError as e:
             logger.error(f"SQLAlchemy error in get_entities_parameter: {e}")
@@ -144,6 +308,8 @@ class Postgres(Database):
             logger.error(f"Error in get_entities_parameter: {e}")
         return None
 
+    @timed_db
+    @traced("db")
     async def get_entities(self, model_class: type[Base]) -> Optional[list]:
         """
         Retrieve a list of entities from the database.
@@ -153,16 +319,103 @@ class Postgres(Database):
         :return: A list of entity objects or None if an error occurs.
         """
         try:
-            async with self.Session() as session:
+            async with self.read_scope() as session:
                 entities = await session.execute(select(model_class))
                 return entities.scalars().all()
 
         except SQLAlchemyError as e:
             logger.error(f"SQLAlchemy error in get_entities: {e}")
         except Exception as e:
-            print(f"class <Postgres> get_entities error:", e)
+            logger.exception(f"Error in get_entities: {e}")
             return None
 
+    async def iter_entities(
+        self,
+        model_class: type[Base],
+        filters: Optional[dict] = None,
+        order_by: Sequence[str] = (),
+        columns: Optional[Sequence[str]] = None,
+        descending: bool = False,
+        batch_size: int = ITER_BATCH_SIZE,
+    ) -> AsyncIterator[Any]:
+        """
+        Stream entities in keyset-paginated batches.
+
+        Each batch is one short query ``WHERE (keys) > (last keys) ORDER
+        BY keys LIMIT batch_size`` in its own session, so memory stays at
+        one batch and no transaction is held open between batches. The
+        keys are ``order_by`` followed by the primary key, which makes the
+        order total; ordering columns must not be NULL.
+
+        Batches are read from a replica when one is configured and do not
+        see uncommitted writes of the current unit of work.
+
+        :param model_class: The class of the model corresponding to the entities.
+        :param filters: Equality filters, as in get_entities_parameter.
+        :param order_by: Names of the columns to order by.
+        :param columns: Only these columns (plus the keys) as lightweight
+        rows instead of ORM entities.
+        :param descending: Order all keys descending.
+        :param batch_size: Rows per query.
+
+        :return: Async iterator of entities or rows. Errors are raised,
+        a silently truncated stream would be worse.
+        """
+        table = model_class.__table__
+        keys = [table.c[name] for name in order_by]
+        keys += [column for column in table.primary_key if column not in keys]
+        if columns is None:
+            stmt = select(model_class)
+        else:
+            selected = [table.c[name] for name in columns]
+            selected += [key for key in keys if key not in selected]
+            stmt = select(*selected)
+        if filters:
+            stmt = stmt.filter_by(**filters)
+        stmt = stmt.order_by(
+            *(key.desc() if descending else key.asc() for key in keys)
+        ).limit(batch_size)
+
+        key_names = [key.name for key in keys]
+        user_id = _filtered_user(filters)
+        last = None
+        while True:
+            page = stmt
+            if last is not None:
+                bound, after = tuple_(*keys), tuple_(*last)
+                page = stmt.where(bound < after if descending else bound > after)
+            started = time.perf_counter()
+            try:
+                with span("db.iter_entities", batch_size=batch_size):
+                    replica = self._pick_replica(user_id)
+                    sessions = (
+                        self.Session
+                        if replica is None
+                        else self.ReplicaSessions[replica]
+                    )
+                    async with sessions() as session:
+                        result = await session.execute(page)
+                        batch = (
+                            result.scalars().all()
+                            if columns is None
+                            else result.all()
+                        )
+            except Exception as e:
+                logger.error(f"Error in iter_entities: {e}")
+                raise
+            finally:
+                db_latency.observe(
+                    time.perf_counter() - started, operation="iter_entities"
+                )
+
+            for item in batch:
+                yield item
+            if len(batch) < batch_size:
+                return
+            last = tuple(getattr(batch[-1], name) for name in key_names)
+
+    @timed_db
+    @traced("db")
     async def update_entity_parameter(
         self,
         entity_id: Union[int, tuple],
@@ -181,7 +434,10 @@ class Postgres(Database):
         :return: None
         """
         try:
-            async with self.Session() as session:
+            self.pin_primary(_written_user(entity_id))
+            async with self.session_scope() as session:
+                if model_class is User:
+                    await profile_writes.settle(entity_id, parameter, session)
                 if isinstance(entity_id, tuple):
                     entity = await session.get(model_class, entity_id)
                 else:
@@ -189,13 +445,18 @@ class Postgres(Database):
 
                 if entity:
                     setattr(entity, parameter, value)
-                    await session.commit()
 
+        except ProfileSettleError:
+            # Иначе отложенные значения позже легли бы поверх прямой записи
+            logger.exception("Error in update_entity_parameter")
+            raise
         except SQLAlchemyError as e:
             logger.error(f"SQLAlchemy error in update_entity_parameter: {e}")
         except Exception as e:
-            print(f"class <Postgres> update_entity_parameter error: {e}")
+            logger.exception(f"Error in update_entity_parameter: {e}")
 
+    @timed_db
+    @traced("db")
     async def delete_entity(
         self, entity_id: int, model_class: type[Base]
     ) -> None:
@@ -208,17 +469,25 @@ class Postgres(Database):
         :return: None
         """
         try:
-            async with self.Session() as session:
+            self.pin_primary(_written_user(entity_id))
+            async with self.session_scope() as session:
+                if model_class is User:
+                    await profile_writes.settle(entity_id, session=session)
                 entity = await session.get(model_class, entity_id)
                 if entity:
                     await session.delete(entity)
-                    await session.commit()
 
+        except ProfileSettleError:
+            # Иначе отложенные значения позже легли бы поверх прямой записи
+            logger.exception("Error in delete_entity")
+            raise
         except SQLAlchemyError as e:
             logger.error(f"SQLAlchemy error in delete_entity: {e}")
         except Exception as e:
-            print(f"class <Postgres> delete_entity error: {e}")
+            logger.exception(f"Error in delete_entity: {e}")
 
+    @timed_db
+    @traced("db")
     async def delete_entity_parameter(
         self,
         entity_id: int,
@@ -235,16 +504,22 @@ class Postgres(Database):
         :return: None
         """
         try:
-            async with self.Session() as session:
+            self.pin_primary(_written_user(entity_id))
+            async with self.session_scope() as session:
+                if model_class is User:
+                    await profile_writes.settle(entity_id, parameter, session)
                 stmt = (
                     update(model_class)
                     .where(model_class.userid == entity_id)
                     .values({parameter: None})
                 )
                 await session.execute(stmt)
-                await session.commit()
 
+        except ProfileSettleError:
+            # Иначе отложенные значения позже легли бы поверх прямой записи
+            logger.exception("Error in delete_entity_parameter")
+            raise
         except SQLAlchemyError as e:
             logger.error(f"SQLAlchemy error in delete_entity_parameter: {e}")
         except Exception as e:
-            print(f"class <Postgres> delete_entity_parameter error: {e}")
+            logger.exception(f"Error in delete_entity_parameter: {e}")
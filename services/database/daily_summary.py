@@ -0,0 +1,111 @@
+import asyncio
+import logging
+from typing import Optional
+
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .models import Survey, SurveyDailySummary
+
+logger = logging.getLogger(__name__)
+
+
+def headache_flag(headache_today: Optional[str]) -> Optional[bool]:
+    """
+    Classify the free-text answer the same way the calendar always did:
+    "да" means pain, "нет" means no pain, anything else is unknown.
+    """
+    if not headache_today:
+        return None
+    answer = headache_today.lower()
+    if "да" in answer:
+        return True
+    if "нет" in answer:
+        return False
+    return None
+
+
+async def upsert_daily_summary(session: AsyncSession, survey: Survey) -> None:
+    """
+    Write the summary row of the survey's day within the caller's
+    transaction; the caller commits. The normalized survey columns must
+    already be filled.
+    """
+    values = {
+        "userid": survey.userid,
+        "day": survey.created_at.date(),
+        "survey_id": survey.survey_id,
+        "has_headache": survey.has_headache,
+        "has_medication": survey.has_medication,
+        "medication_id": survey.medication_id,
+        "medicament_today": survey.medicament_today,
+        "pain_intensity": survey.pain_intensity,
+        "updated_at": survey.updated_at,
+    }
+    stmt = insert(SurveyDailySummary).values(**values)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[SurveyDailySummary.userid, SurveyDailySummary.day],
+        set_={
+            key: stmt.excluded[key]
+            for key in values
+            if key not in ("userid", "day")
+        },
+    )
+    await session.execute(stmt)
+
+
+# Опрос дня — с наименьшим survey_id, как у save_survey_response и
+# SURVEY_OF_DAY_SQL: его обновляют повторные ответы за день.
+# Нормализованные колонки опроса заполняет миграция 2
+# (или python -m services.medications), она идёт раньше
+BACKFILL_SQL = """
+INSERT INTO survey_daily_summary (
+    userid, day, survey_id, has_headache, has_medication, medication_id,
+    medicament_today, pain_intensity, updated_at
+)
+SELECT DISTINCT ON (userid, created_at::date)
+    userid,
+    created_at::date,
+    survey_id,
+    has_headache,
+    has_medication,
+    medication_id,
+    medicament_today,
+    pain_intensity,
+    updated_at
+FROM survey
+WHERE created_at IS NOT NULL
+ORDER BY userid, created_at::date, survey_id
+ON CONFLICT (userid, day) DO UPDATE SET
+    survey_id = EXCLUDED.survey_id,
+    has_headache = EXCLUDED.has_headache,
+    has_medication = EXCLUDED.has_medication,
+    medication_id = EXCLUDED.medication_id,
+    medicament_today = EXCLUDED.medicament_today,
+    pain_intensity = EXCLUDED.pain_intensity,
+    updated_at = EXCLUDED.updated_at
+"""
+
+
+async def backfill_daily_summary(database) -> int:
+    """
+    Create the summary table if needed and rebuild it from all surveys.
+
+    :return: Number of summary rows written.
+    """
+    async with database.engine.begin() as connection:
+        await connection.run_sync(
+            SurveyDailySummary.__table__.create, checkfirst=True
+        )
+        result = await connection.execute(text(BACKFILL_SQL))
+    logger.info(f"Daily summary backfilled: {result.rowcount} rows")
+    return result.rowcount
+
+
+if __name__ == "__main__":
+    # python -m services.database.daily_summary
+    from .crud import Postgres
+
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(backfill_daily_summary(Postgres()))
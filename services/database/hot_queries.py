@@ -0,0 +1,159 @@
+import logging
+from datetime import date, datetime, time, timedelta
+from time import perf_counter
+from typing import NamedTuple, Optional
+
+from dateutil.relativedelta import relativedelta
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from .profiler import query_profiler
+from .unit_of_work import current_unit_of_work
+from .write_behind import profile_writes
+from services.metrics import timed_db
+from services.tracing import traced
+
+logger = logging.getLogger(__name__)
+
+
+class SurveyRow(NamedTuple):
+    """
+    Survey columns the handlers read; a plain tuple, no ORM state.
+    """
+
+    survey_id: int
+    userid: int
+    created_at: datetime
+    updated_at: Optional[datetime]
+    headache_today: Optional[str]
+    medicament_today: Optional[str]
+    pain_intensity: Optional[int]
+    pain_area: Optional[str]
+    area_detail: Optional[str]
+    pain_type: Optional[str]
+    comments: Optional[str]
+
+
+_SURVEY_SELECT = f"SELECT {', '.join(SurveyRow._fields)} FROM survey"
+
+USER_LANGUAGE_SQL = "SELECT language FROM users WHERE userid = $1"
+USER_EXISTS_SQL = "SELECT EXISTS (SELECT 1 FROM users WHERE userid = $1)"
+REMINDER_TIME_SQL = "SELECT reminder_time FROM users WHERE userid = $1"
+SURVEYS_IN_RANGE_SQL = (
+    f"{_SURVEY_SELECT} WHERE userid = $1 "
+    "AND created_at >= $2 AND created_at < $3 ORDER BY created_at"
+)
+SURVEY_OF_DAY_SQL = (
+    f"{_SURVEY_SELECT} WHERE userid = $1 "
+    "AND created_at >= $2 AND created_at < $3 ORDER BY survey_id LIMIT 1"
+)
+
+
+class HotQueries:
+    """
+    The few lookups every update makes, run straight on asyncpg.
+
+    Connections come from the SQLAlchemy engine pool, so there is no
+    second pool to size. Statements go through asyncpg's per-connection
+    statement cache and are parsed and planned once per connection, rows
+    come back as tuples without a session or identity map.
+    """
+
+    def __init__(self, database, engine: AsyncEngine):
+        self._database = database
+        self._engine = engine
+
+    async def _fetch(self, method: str, query: str, *args, default=None):
+        """
+        Run one statement with ``fetch``, ``fetchrow`` or ``fetchval`` of
+        the asyncpg connection; errors are logged like in Postgres.
+
+        The first parameter of every statement is the user id, it picks a
+        replica or the primary. On the primary inside a unit of work the
+        statement runs on its connection in a savepoint, so it sees what
+        the update has written but not yet committed, and a failed
+        statement does not abort the update's transaction.
+        """
+        engine = self._database.read_engine(args[0])
+        try:
+            if engine is not self._engine:
+                try:
+                    return await self._run(engine, method, query, *args)
+                except Exception as e:
+                    logger.warning(f"Replica query failed, using primary: {e}")
+
+            uow = current_unit_of_work(self._database)
+            if uow is not None:
+                connection = await uow.session().connection()
+                raw = await connection.get_raw_connection()
+                # Внутри транзакции единицы работы — точка сохранения:
+                # ошибка запроса не прерывает всю транзакцию
+                async with raw.driver_connection.transaction():
+                    return await self._call(raw, method, query, *args)
+            return await self._run(self._engine, method, query, *args)
+        except Exception as e:
+            logger.error(f"Error in hot query {method}: {e}")
+            return default
+
+    async def _run(self, engine: AsyncEngine, method: str, query: str, *args):
+        async with engine.connect() as connection:
+            raw = await connection.get_raw_connection()
+            return await self._call(raw, method, query, *args)
+
+    async def _call(self, raw, method: str, query: str, *args):
+        # Вызовы asyncpg мимо SQLAlchemy не видны событиям движка
+        started = perf_counter()
+        try:
+            return await getattr(raw.driver_connection, method)(query, *args)
+        finally:
+            query_profiler.record(query, args, perf_counter() - started)
+
+    @timed_db
+    @traced("db")
+    async def user_language(self, user_id: int) -> Optional[str]:
+        pending = profile_writes.overlay(user_id).get("language")
+        if pending is not None:
+            return pending
+        return await self._fetch("fetchval", USER_LANGUAGE_SQL, user_id)
+
+    @timed_db
+    @traced("db")
+    async def user_exists(self, user_id: int) -> bool:
+        return await self._fetch(
+            "fetchval", USER_EXISTS_SQL, user_id, default=False
+        )
+
+    @timed_db
+    @traced("db")
+    async def reminder_time(self, user_id: int) -> Optional[time]:
+        return await self._fetch("fetchval", REMINDER_TIME_SQL, user_id)
+
+    @timed_db
+    @traced("db")
+    async def surveys_for_month(
+        self, user_id: int, month: int, year: int
+    ) -> list[SurveyRow]:
+        start = datetime(year, month, 1)
+        records = await self._fetch(
+            "fetch",
+            SURVEYS_IN_RANGE_SQL,
+            user_id,
+            start,
+            start + relativedelta(months=1),
+            default=[],
+        )
+        return [SurveyRow(*record) for record in records]
+
+    @timed_db
+    @traced("db")
+    async def survey_by_date(
+        self, user_id: int, day: date
+    ) -> Optional[SurveyRow]:
+        start = datetime.combine(day, time.min)
+        record = await self._fetch(
+            "fetchrow",
+            SURVEY_OF_DAY_SQL,
+            user_id,
+            start,
+            start + timedelta(days=1),
+        )
+        return SurveyRow(*record) if record else None
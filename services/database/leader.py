@@ -0,0 +1,298 @@
+import asyncio
+import inspect
+import logging
+import os
+import socket
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Awaitable, Callable, Optional, Union
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from services.metrics import register_collected
+from utils.config import LEADER_ELECTION_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+# Ключ advisory-блокировки ведущего: держит её только один процесс
+LEADER_LOCK_KEY = 0x656D6C64
+
+LEASE_NAME = "bot"
+
+# Условие записи ведущего: эпоха не сменилась, то есть за это время
+# не был выбран новый ведущий
+FENCE_SQL = (
+    "EXISTS (SELECT 1 FROM leader_lease "
+    "WHERE name = :lease AND epoch = :epoch)"
+)
+
+NEXT_EPOCH_SQL = """
+INSERT INTO leader_lease (name, epoch, holder, acquired_at)
+VALUES (:lease, 1, :holder, now())
+ON CONFLICT (name) DO UPDATE SET
+    epoch = leader_lease.epoch + 1,
+    holder = excluded.holder,
+    acquired_at = excluded.acquired_at
+RETURNING epoch
+"""
+
+PUBLISH_TOKEN_SQL = f"""
+INSERT INTO shared_tokens (name, token, expires_at, epoch)
+SELECT :name, :token, :expires_at, :epoch WHERE {FENCE_SQL}
+ON CONFLICT (name) DO UPDATE SET
+    token = excluded.token,
+    expires_at = excluded.expires_at,
+    epoch = excluded.epoch
+WHERE shared_tokens.epoch <= excluded.epoch
+"""
+
+LOAD_TOKEN_SQL = (
+    "SELECT token, expires_at FROM shared_tokens "
+    "WHERE name = :name AND expires_at > now()"
+)
+
+
+class NotLeaderError(RuntimeError):
+    """
+    Raised when leader-only work is attempted by an instance that is not
+    the leader.
+    """
+
+
+@dataclass(kw_only=True, slots=True)
+class Duty:
+    name: str
+    start: Callable[[], Union[None, Awaitable[None]]]
+    stop: Callable[[], Awaitable[None]]
+
+
+class LeaderElection:
+    """
+    Elects one instance to run the singleton background duties.
+
+    The leader holds a session-level Postgres advisory lock on a dedicated
+    connection. The lock goes away with the connection, so when the
+    leader dies another instance takes over within ``interval`` seconds.
+
+    Every new leader raises the fencing epoch in leader_lease. Writes of
+    leader-only work are made conditional on that epoch with FENCE_SQL,
+    so a deposed leader that has not noticed yet (a stalled loop, a lost
+    connection) cannot act twice next to its successor.
+    """
+
+    def __init__(
+        self,
+        lease: str = LEASE_NAME,
+        interval: float = LEADER_ELECTION_INTERVAL,
+    ):
+        self.lease = lease
+        self.interval = interval
+        self.holder = f"{socket.gethostname()}:{os.getpid()}"
+        self.epoch: Optional[int] = None
+        self._database = None
+        self._connection: Optional[AsyncConnection] = None
+        self._duties: list[Duty] = []
+        self._task: Optional[asyncio.Task] = None
+        self._stats = {"elected": 0, "lost": 0}
+
+    @property
+    def is_leader(self) -> bool:
+        return self.epoch is not None
+
+    def add_duty(
+        self,
+        name: str,
+        start: Callable[[], Union[None, Awaitable[None]]],
+        stop: Callable[[], Awaitable[None]],
+    ) -> None:
+        """
+        Register a background duty run only while this instance leads.
+        Duties start in the order added and stop in reverse.
+        """
+        self._duties.append(Duty(name=name, start=start, stop=stop))
+
+    def fence(self) -> dict:
+        """
+        Parameters for FENCE_SQL.
+        """
+        if self.epoch is None:
+            raise NotLeaderError("This instance is not the leader")
+        return {"lease": self.lease, "epoch": self.epoch}
+
+    def start(self, database) -> None:
+        self._database = database
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._election_loop())
+
+    async def stop(self) -> None:
+        """
+        Stop the duties and release the lock, so another instance can take
+        over without waiting for the connection to time out.
+        """
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self._step_down()
+
+    async def _election_loop(self) -> None:
+        while True:
+            try:
+                if self.is_leader:
+                    await self._check()
+                else:
+                    await self._try_acquire()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Leader election failed: {e}")
+                await self._step_down()
+            await asyncio.sleep(self.interval)
+
+    async def _try_acquire(self) -> None:
+        connection = await self._database.engine.connect()
+        try:
+            acquired = await connection.execute(
+                text("SELECT pg_try_advisory_lock(:key)"),
+                {"key": LEADER_LOCK_KEY},
+            )
+            if not acquired.scalar():
+                await connection.close()
+                return
+            epoch = await connection.execute(
+                text(NEXT_EPOCH_SQL),
+                {"lease": self.lease, "holder": self.holder},
+            )
+            epoch = epoch.scalar()
+            await connection.commit()
+        except BaseException:
+            # Блокировка сеанса не должна вернуться в пул вместе с ним
+            await connection.invalidate()
+            await connection.close()
+            raise
+
+        self._connection = connection
+        self.epoch = epoch
+        self._stats["elected"] += 1
+        logger.info(f"Elected leader with epoch {epoch} as {self.holder}")
+        for duty in self._duties:
+            try:
+                started = duty.start()
+                if inspect.isawaitable(started):
+                    await started
+            except Exception as e:
+                logger.error(f"Leader duty {duty.name} failed to start: {e}")
+
+    async def _check(self) -> None:
+        result = await self._connection.execute(
+            text("SELECT epoch FROM leader_lease WHERE name = :lease"),
+            {"lease": self.lease},
+        )
+        epoch = result.scalar()
+        await self._connection.commit()
+        if epoch != self.epoch:
+            raise NotLeaderError(
+                f"Epoch moved from {self.epoch} to {epoch}, leadership lost"
+            )
+
+    async def _step_down(self) -> None:
+        connection, self._connection = self._connection, None
+        if self.epoch is not None:
+            logger.warning(f"Stepping down as leader of epoch {self.epoch}")
+            self.epoch = None
+            self._stats["lost"] += 1
+            # Сначала останавливаются обязанности, потом отпускается
+            # блокировка: два ведущих не должны работать одновременно
+            for duty in reversed(self._duties):
+                try:
+                    await duty.stop()
+                except Exception as e:
+                    logger.error(
+                        f"Leader duty {duty.name} failed to stop: {e}"
+                    )
+        if connection is None:
+            return
+        try:
+            await connection.execute(
+                text("SELECT pg_advisory_unlock(:key)"),
+                {"key": LEADER_LOCK_KEY},
+            )
+            await connection.commit()
+            await connection.close()
+        except Exception as e:
+            logger.warning(f"Leader lock not released cleanly: {e}")
+            await connection.invalidate()
+            await connection.close()
+
+    def stats(self) -> dict:
+        return {
+            "leader": self.is_leader,
+            "epoch": self.epoch,
+            "holder": self.holder,
+            "duties": [duty.name for duty in self._duties],
+            **self._stats,
+        }
+
+
+class SharedTokens:
+    """
+    Tokens published by the leader for the other instances to read.
+    """
+
+    def __init__(self, database, election: "LeaderElection"):
+        self._database = database
+        self._election = election
+
+    async def publish(
+        self, name: str, token: str, expires_at: datetime
+    ) -> bool:
+        """
+        Store the token unless this instance has been deposed.
+
+        :return: Whether the token was stored.
+        """
+        async with self._database.engine.begin() as connection:
+            result = await connection.execute(
+                text(PUBLISH_TOKEN_SQL),
+                {
+                    "name": name,
+                    "token": token,
+                    "expires_at": expires_at,
+                    **self._election.fence(),
+                },
+            )
+        return result.rowcount > 0
+
+    async def load(self, name: str) -> Optional[tuple[str, datetime]]:
+        """
+        :return: The token and its expiry time, None if there is no
+        unexpired token.
+        """
+        async with self._database.engine.connect() as connection:
+            result = await connection.execute(
+                text(LOAD_TOKEN_SQL), {"name": name}
+            )
+            row = result.first()
+        return (row.token, row.expires_at) if row else None
+
+
+leader = LeaderElection()
+
+register_collected(
+    "bot_leader",
+    "1 while this instance is the leader running singleton duties",
+    lambda: [({}, 1 if leader.is_leader else 0)],
+)
+register_collected(
+    "bot_leader_transitions_total",
+    "Leadership gained and lost by this instance",
+    lambda: [
+        ({"event": event}, leader.stats()[event])
+        for event in ("elected", "lost")
+    ],
+    kind="counter",
+)
@@ -0,0 +1,355 @@
+import asyncio
+import json
+import logging
+import sys
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Union
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+
+from .daily_summary import BACKFILL_SQL
+from .models import (
+    LeaderLease,
+    Medication,
+    ProfileWriteOutbox,
+    ReminderDelivery,
+    SharedToken,
+    Survey,
+    SurveyDailySummary,
+    UnmatchedMedication,
+    User,
+)
+from .partitions import is_partitioned, partition_survey
+
+logger = logging.getLogger(__name__)
+
+# Ключ advisory-блокировки: миграции выполняет только один процесс
+MIGRATION_LOCK_KEY = 0x656D6D69
+
+Step = Union[str, Callable[[AsyncConnection], Awaitable[None]]]
+
+
+@dataclass(kw_only=True, slots=True)
+class Migration:
+    """
+    One schema version: SQL statements and Python steps applied in a
+    single transaction together with the version record.
+    """
+
+    version: int
+    name: str
+    steps: tuple[Step, ...]
+
+
+async def _create_baseline(connection: AsyncConnection) -> None:
+    for model in (User, Medication, Survey, SurveyDailySummary):
+        await connection.run_sync(model.__table__.create, checkfirst=True)
+
+
+async def _create_profile_write_outbox(connection: AsyncConnection) -> None:
+    await connection.run_sync(
+        ProfileWriteOutbox.__table__.create, checkfirst=True
+    )
+
+
+async def _create_leader_tables(connection: AsyncConnection) -> None:
+    for model in (LeaderLease, SharedToken, ReminderDelivery):
+        await connection.run_sync(model.__table__.create, checkfirst=True)
+
+
+async def _backfill_medications(connection: AsyncConnection) -> None:
+    # Импорт здесь: services.medications сам импортирует services.database
+    from services.medications import backfill_medication_columns
+
+    session = AsyncSession(bind=connection)
+    await backfill_medication_columns(session)
+    await session.flush()
+
+
+# Названия, которые не использует ни один опрос: свободный текст,
+# записанный как название до проверки по словарю
+DELETE_UNUSED_MEDICATIONS_SQL = """
+DELETE FROM medications
+WHERE NOT EXISTS (
+    SELECT 1 FROM survey WHERE survey.medication_id = medications.id
+)
+AND NOT EXISTS (
+    SELECT 1 FROM survey_daily_summary
+    WHERE survey_daily_summary.medication_id = medications.id
+)
+"""
+
+
+async def _create_unmatched_medications(connection: AsyncConnection) -> None:
+    await connection.run_sync(
+        UnmatchedMedication.__table__.create, checkfirst=True
+    )
+
+
+async def _add_medication_columns(connection: AsyncConnection) -> None:
+    from services.medications import SCHEMA_SQL
+
+    for statement in SCHEMA_SQL:
+        await connection.execute(text(statement))
+
+
+MIGRATIONS: tuple[Migration, ...] = (
+    Migration(version=1, name="baseline", steps=(_create_baseline,)),
+    Migration(
+        version=2,
+        name="normalized_medications",
+        steps=(_add_medication_columns, _backfill_medications),
+    ),
+    Migration(version=3, name="survey_daily_summary", steps=(BACKFILL_SQL,)),
+    Migration(
+        version=4,
+        name="hot_query_indexes",
+        steps=(
+            "CREATE INDEX IF NOT EXISTS ix_survey_userid_created_at "
+            "ON survey (userid, created_at)",
+            "CREATE INDEX IF NOT EXISTS ix_users_reminder_time "
+            "ON users (reminder_time) WHERE reminder_time IS NOT NULL",
+            "ANALYZE survey",
+            "ANALYZE users",
+        ),
+    ),
+    Migration(
+        version=5, name="partition_survey_by_month", steps=(partition_survey,)
+    ),
+    Migration(
+        version=6,
+        name="profile_write_outbox",
+        steps=(_create_profile_write_outbox,),
+    ),
+    Migration(
+        version=7, name="leader_election", steps=(_create_leader_tables,)
+    ),
+    # Версия 3 брала последний опрос дня, а запись — первый
+    Migration(
+        version=8, name="survey_daily_summary_first", steps=(BACKFILL_SQL,)
+    ),
+    # Ответы без совпадения в словаре больше не становятся названиями:
+    # пересчёт medication_id и удаление таких названий
+    Migration(
+        version=9,
+        name="unmatched_medications",
+        steps=(
+            _create_unmatched_medications,
+            _backfill_medications,
+            DELETE_UNUSED_MEDICATIONS_SQL,
+        ),
+    ),
+)
+
+CREATE_VERSION_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version integer PRIMARY KEY,
+    name text NOT NULL,
+    applied_at timestamptz NOT NULL DEFAULT now()
+)
+"""
+
+
+async def _applied_versions(connection: AsyncConnection) -> set[int]:
+    result = await connection.execute(
+        text("SELECT version FROM schema_migrations")
+    )
+    return set(result.scalars())
+
+
+async def run_migrations(database) -> list[int]:
+    """
+    Apply every migration newer than the recorded schema version.
+
+    Runs under a session-level advisory lock, so several processes
+    starting at once apply each migration exactly once.
+
+    :return: Versions applied by this call.
+    """
+    applied = []
+    async with database.engine.connect() as connection:
+        await connection.execute(
+            text("SELECT pg_advisory_lock(:key)"), {"key": MIGRATION_LOCK_KEY}
+        )
+        await connection.commit()
+        try:
+            async with connection.begin():
+                await connection.execute(text(CREATE_VERSION_TABLE_SQL))
+            async with connection.begin():
+                done = await _applied_versions(connection)
+
+            for migration in MIGRATIONS:
+                if migration.version in done:
+                    continue
+                logger.info(
+                    f"Applying migration {migration.version} {migration.name}"
+                )
+                async with connection.begin():
+                    for step in migration.steps:
+                        if isinstance(step, str):
+                            await connection.execute(text(step))
+                        else:
+                            await step(connection)
+                    await connection.execute(
+                        text(
+                            "INSERT INTO schema_migrations (version, name) "
+                            "VALUES (:version, :name)"
+                        ),
+                        {"version": migration.version, "name": migration.name},
+                    )
+                applied.append(migration.version)
+        finally:
+            await connection.execute(
+                text("SELECT pg_advisory_unlock(:key)"),
+                {"key": MIGRATION_LOCK_KEY},
+            )
+            await connection.commit()
+
+    if applied:
+        logger.info(f"Schema migrated, applied versions {applied}")
+    return applied
+
+
+async def migration_status(database) -> list[tuple[int, str, bool]]:
+    """
+    :return: (version, name, applied) for every known migration.
+    """
+    async with database.engine.begin() as connection:
+        await connection.execute(text(CREATE_VERSION_TABLE_SQL))
+        done = await _applied_versions(connection)
+    return [
+        (migration.version, migration.name, migration.version in done)
+        for migration in MIGRATIONS
+    ]
+
+
+# Запросы горячих путей и индекс, который каждый из них обязан использовать
+HOT_QUERIES: dict[str, tuple[str, str]] = {
+    "surveys_for_month": (
+        "SELECT * FROM survey WHERE userid = 1 "
+        "AND created_at >= '2024-01-01' AND created_at < '2024-02-01'",
+        "ix_survey_userid_created_at",
+    ),
+    "surveys_of_user": (
+        "SELECT * FROM survey WHERE userid = 1",
+        "ix_survey_userid_created_at",
+    ),
+    "daily_summary_for_month": (
+        "SELECT * FROM survey_daily_summary WHERE userid = 1 "
+        "AND day >= '2024-01-01' AND day < '2024-02-01'",
+        "survey_daily_summary_pkey",
+    ),
+    "export_version": (
+        "SELECT count(*), max(updated_at) FROM survey_daily_summary "
+        "WHERE userid = 1",
+        "survey_daily_summary_pkey",
+    ),
+    "user_by_id": (
+        "SELECT language FROM users WHERE userid = 1",
+        "users_pkey",
+    ),
+    "users_by_reminder_time": (
+        "SELECT userid FROM users "
+        "WHERE reminder_time >= '09:00' AND reminder_time < '09:01'",
+        "ix_users_reminder_time",
+    ),
+}
+
+# Помесячные запросы к партиционированной survey читают одну партицию
+PRUNED_QUERIES = ("surveys_for_month",)
+
+
+def _plan_scans(plan: dict) -> tuple[set[str], set[str]]:
+    """
+    Indexes and relations any node of an EXPLAIN (FORMAT JSON) plan scans.
+    """
+    indexes, relations = set(), set()
+    if "Index Name" in plan:
+        indexes.add(plan["Index Name"])
+    if "Relation Name" in plan:
+        relations.add(plan["Relation Name"])
+    for child in plan.get("Plans", ()):
+        child_indexes, child_relations = _plan_scans(child)
+        indexes |= child_indexes
+        relations |= child_relations
+    return indexes, relations
+
+
+async def check_plans(database) -> dict[str, str]:
+    """
+    EXPLAIN every hot query and check it scans its index.
+
+    Sequential scans are disabled for the check: on a small table the
+    planner rightly prefers them, and the question is only whether an
+    index usable by the query exists.
+
+    :return: Query name -> problem description, empty if all plans pass.
+    """
+    failures = {}
+    async with database.engine.connect() as connection:
+        async with connection.begin():
+            partitioned = await is_partitioned(connection)
+        for name, (query, index) in HOT_QUERIES.items():
+            async with connection.begin():
+                await connection.execute(
+                    text("SET LOCAL enable_seqscan = off")
+                )
+                result = await connection.execute(
+                    text(f"EXPLAIN (FORMAT JSON) {query}")
+                )
+                plan = result.scalar()
+                if isinstance(plan, str):
+                    plan = json.loads(plan)
+                indexes, relations = _plan_scans(plan[0]["Plan"])
+                # Индексы партиций приводятся к индексу родительской таблицы
+                roots = await connection.execute(
+                    text(
+                        "SELECT coalesce(pg_partition_root(to_regclass(name))"
+                        "::text, name) FROM unnest(CAST(:names AS text[])) "
+                        "AS name"
+                    ),
+                    {"names": sorted(indexes)},
+                )
+                indexes = set(roots.scalars())
+            if index not in indexes:
+                failures[name] = (
+                    f"expected {index}, plan uses {sorted(indexes) or 'no index'}"
+                )
+            elif partitioned and name in PRUNED_QUERIES and len(relations) > 1:
+                failures[name] = f"not pruned, plan scans {sorted(relations)}"
+    return failures
+
+
+async def _main(command: str) -> int:
+    from .crud import Postgres
+
+    database = Postgres()
+    try:
+        if command == "upgrade":
+            await run_migrations(database)
+        elif command == "status":
+            for version, name, applied in await migration_status(database):
+                print(
+                    f"{version:>4} {name:<28} {'applied' if applied else '-'}"
+                )
+        elif command == "check-plans":
+            failures = await check_plans(database)
+            for name, problem in failures.items():
+                print(f"FAIL {name}: {problem}")
+            print(f"{len(HOT_QUERIES) - len(failures)}/{len(HOT_QUERIES)} ok")
+            return 1 if failures else 0
+        else:
+            print("usage: migrations [upgrade|status|check-plans]")
+            return 2
+        return 0
+    finally:
+        await database.engine.dispose()
+
+
+if __name__ == "__main__":
+    # python -m services.database.migrations upgrade
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(
+        asyncio.run(_main(sys.argv[1] if len(sys.argv) > 1 else "upgrade"))
+    )
@@ -1,6 +1,6 @@
 from abc import ABC, abstractmethod
 from enum import Enum
-from typing import Union, Optional, Type, Any
+from typing import AsyncIterator, Union, Optional, Sequence, Type, Any
 
 from sqlalchemy import (
     Column,
@@ -11,7 +11,10 @@ from sqlalchemy import (
     Time,
     Date,
     DateTime,
+    Boolean,
+    Index,
 )
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
 
@@ -44,6 +47,15 @@ class User(Base):
     language = Column(String)
     role = Column(String)
 
+    # Напоминания выбирают только пользователей с заданным временем
+    __table_args__ = (
+        Index(
+            "ix_users_reminder_time",
+            reminder_time,
+            postgresql_where=reminder_time.is_not(None),
+        ),
+    )
+
     def __repr__(self):
         return (
             "<userid={}, "
@@ -84,6 +96,23 @@ class User(Base):
         )
 
 
+class Medication(Base):
+    """
+    Dictionary of canonical medication names.
+    """
+
+    __tablename__ = "medications"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    name = Column(String, unique=True, nullable=False)
+    created_at = Column(DateTime)
+
+    def __repr__(self):
+        return "<id={}, name='{}', created_at='{}')>".format(
+            self.id, self.name, self.created_at
+        )
+
+
 class Survey(Base):
     """
     Model for survey in the database.
@@ -97,7 +126,8 @@ class Survey(Base):
         ForeignKey("users.userid", ondelete="CASCADE"),
         primary_key=True,
     )
-    created_at = Column(DateTime)
+    # Ключ помесячных партиций, поэтому входит в первичный ключ
+    created_at = Column(DateTime, primary_key=True)
     updated_at = Column(DateTime)
     headache_today = Column(String)
     medicament_today = Column(String)
@@ -106,9 +136,19 @@ class Survey(Base):
     area_detail = Column(String)
     pain_type = Column(String)
     comments = Column(String)
+    has_headache = Column(Boolean)
+    has_medication = Column(Boolean)
+    medication_id = Column(Integer, ForeignKey("medications.id"))
 
     user = relationship("User", backref="survey")
 
+    # Первичный ключ начинается с survey_id, запросы же идут по
+    # пользователю и диапазону дат
+    __table_args__ = (
+        Index("ix_survey_userid_created_at", userid, created_at),
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
+
     def __repr__(self):
         return (
             "<survey_id={}, "
@@ -121,7 +161,10 @@ class Survey(Base):
             "pain_area='{}', "
             "area_detail='{}', "
             "pain_type='{}', "
-            "comments='{}')>"
+            "comments='{}', "
+            "has_headache={}, "
+            "has_medication={}, "
+            "medication_id={})>"
         ).format(
             self.survey_id,
             self.userid,
@@ -134,6 +177,147 @@ class Survey(Base):
             self.area_detail,
             self.pain_type,
             self.comments,
+            self.has_headache,
+            self.has_medication,
+            self.medication_id,
+        )
+
+
+class SurveyDailySummary(Base):
+    """
+    One row per user and day derived from the survey of that day.
+
+    Maintained in the same transaction as the survey itself, so calendar
+    and diary reads touch only the days they show.
+    """
+
+    __tablename__ = "survey_daily_summary"
+
+    userid = Column(
+        BigInteger,
+        ForeignKey("users.userid", ondelete="CASCADE"),
+        primary_key=True,
+    )
+    day = Column(Date, primary_key=True)
+    survey_id = Column(Integer)
+    has_headache = Column(Boolean)
+    has_medication = Column(Boolean)
+    medication_id = Column(Integer, ForeignKey("medications.id"))
+    medicament_today = Column(String)
+    pain_intensity = Column(Integer)
+    updated_at = Column(DateTime)
+
+    def __repr__(self):
+        return (
+            "<userid={}, "
+            "day='{}', "
+            "survey_id={}, "
+            "has_headache={}, "
+            "has_medication={}, "
+            "medication_id={}, "
+            "medicament_today='{}', "
+            "pain_intensity={}, "
+            "updated_at='{}')>"
+        ).format(
+            self.userid,
+            self.day,
+            self.survey_id,
+            self.has_headache,
+            self.has_medication,
+            self.medication_id,
+            self.medicament_today,
+            self.pain_intensity,
+            self.updated_at,
+        )
+
+
+class UnmatchedMedication(Base):
+    """
+    Medication answers not found in the dictionary, kept for review
+    instead of becoming canonical names.
+    """
+
+    __tablename__ = "unmatched_medications"
+
+    answer = Column(String, primary_key=True)
+    seen = Column(Integer, nullable=False, default=1)
+    last_seen_at = Column(DateTime)
+
+    def __repr__(self):
+        return "<answer='{}', seen={}, last_seen_at='{}')>".format(
+            self.answer, self.seen, self.last_seen_at
+        )
+
+
+class ProfileWriteOutbox(Base):
+    """
+    Deferred profile writes that could not be applied to users yet.
+    """
+
+    __tablename__ = "profile_write_outbox"
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    userid = Column(BigInteger, nullable=False)
+    fields = Column(JSONB, nullable=False)
+    created_at = Column(DateTime)
+
+    def __repr__(self):
+        return "<id={}, userid={}, fields={}, created_at='{}')>".format(
+            self.id, self.userid, self.fields, self.created_at
+        )
+
+
+class LeaderLease(Base):
+    """
+    Fencing epoch of a leader election, raised by every new leader.
+    """
+
+    __tablename__ = "leader_lease"
+
+    name = Column(String, primary_key=True)
+    epoch = Column(BigInteger, nullable=False)
+    holder = Column(String)
+    acquired_at = Column(DateTime(timezone=True))
+
+    def __repr__(self):
+        return "<name='{}', epoch={}, holder='{}', acquired_at='{}')>".format(
+            self.name, self.epoch, self.holder, self.acquired_at
+        )
+
+
+class SharedToken(Base):
+    """
+    Access token fetched by the leader and read by the other instances.
+    """
+
+    __tablename__ = "shared_tokens"
+
+    name = Column(String, primary_key=True)
+    token = Column(String, nullable=False)
+    expires_at = Column(DateTime(timezone=True), nullable=False)
+    epoch = Column(BigInteger, nullable=False)
+
+    def __repr__(self):
+        return "<name='{}', expires_at='{}', epoch={})>".format(
+            self.name, self.expires_at, self.epoch
+        )
+
+
+class ReminderDelivery(Base):
+    """
+    Reminders claimed for sending, at most one per user and reminder time.
+    """
+
+    __tablename__ = "reminder_deliveries"
+
+    userid = Column(BigInteger, primary_key=True)
+    remind_at = Column(DateTime, primary_key=True)
+    epoch = Column(BigInteger, nullable=False)
+    sent_at = Column(DateTime)
+
+    def __repr__(self):
+        return "<userid={}, remind_at='{}', epoch={}, sent_at='{}')>".format(
+            self.userid, self.remind_at, self.epoch, self.sent_at
         )
 
 
@@ -205,6 +389,31 @@ class Database(ABC):
         """
         pass
 
+    @abstractmethod
+    def iter_entities(
+        self,
+        model_class: type[Base],
+        filters: Optional[dict] = None,
+        order_by: Sequence[str] = (),
+        columns: Optional[Sequence[str]] = None,
+        descending: bool = False,
+        batch_size: int = 1000,
+    ) -> AsyncIterator[Any]:
+        """
+        Stream entities of a table in keyset-paginated batches.
+
+        :param model_class: The class of the model corresponding to the entities.
+        :param filters: A dictionary of filters to apply.
+        :param order_by: Names of the columns to order by.
+        :param columns: Names of the columns to return as rows instead of
+        entities.
+        :param descending: Whether to order descending.
+        :param batch_size: Number of rows fetched per query.
+
+        :return: An async iterator of entities or rows.
+        """
+        pass
+
     @abstractmethod
     async def update_entity_parameter(
         self,
@@ -0,0 +1,270 @@
+import asyncio
+import logging
+from datetime import date
+from typing import Optional
+
+from dateutil.relativedelta import relativedelta
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from utils.config import (
+    SURVEY_BRIN_AFTER_MONTHS,
+    SURVEY_PARTITION_CHECK_INTERVAL,
+    SURVEY_PARTITIONS_AHEAD,
+)
+from utils.datetime_utils import get_current_time_in_almaty_naive
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PARTITION = "survey_default"
+
+# Ключ advisory-блокировки: партиции создаёт один процесс за раз
+PARTITION_LOCK_KEY = 0x656D7061
+
+
+def month_start(value: date) -> date:
+    return date(value.year, value.month, 1)
+
+
+def partition_name(month: date) -> str:
+    """
+    Name of the survey partition holding the given month: survey_y2024m07.
+    """
+    return f"survey_y{month.year}m{month.month:02d}"
+
+
+async def is_partitioned(connection: AsyncConnection) -> bool:
+    result = await connection.execute(
+        text("SELECT relkind FROM pg_class WHERE oid = to_regclass('survey')")
+    )
+    return result.scalar() == "p"
+
+
+async def _existing_partitions(connection: AsyncConnection) -> set[str]:
+    result = await connection.execute(
+        text(
+            "SELECT child.relname FROM pg_inherits "
+            "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+            "WHERE pg_inherits.inhparent = 'survey'::regclass"
+        )
+    )
+    return set(result.scalars())
+
+
+async def _create_month_partition(
+    connection: AsyncConnection, month: date
+) -> None:
+    """
+    Create and attach the partition of one month.
+
+    Rows of that month that already landed in the default partition are
+    moved over first, otherwise attaching would fail.
+    """
+    name = partition_name(month)
+    bounds = {"start": month, "end": month + relativedelta(months=1)}
+    await connection.execute(
+        text(f"CREATE TABLE {name} (LIKE survey INCLUDING DEFAULTS)")
+    )
+    moved = await connection.execute(
+        text(
+            f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} "
+            "WHERE created_at >= :start AND created_at < :end RETURNING *) "
+            f"INSERT INTO {name} SELECT * FROM moved"
+        ),
+        bounds,
+    )
+    await connection.execute(
+        text(
+            f"ALTER TABLE survey ATTACH PARTITION {name} FOR VALUES "
+            f"FROM ('{bounds['start'].isoformat()}') "
+            f"TO ('{bounds['end'].isoformat()}')"
+        )
+    )
+    if moved.rowcount:
+        logger.warning(
+            f"Moved {moved.rowcount} rows from {DEFAULT_PARTITION} to {name}"
+        )
+
+
+async def ensure_partitions(
+    connection: AsyncConnection,
+    today: date,
+    ahead: int = SURVEY_PARTITIONS_AHEAD,
+    since: Optional[date] = None,
+) -> list[str]:
+    """
+    Make sure monthly partitions exist from ``since`` (the current month by
+    default) to ``ahead`` months after it, plus the default partition.
+
+    :return: Names of the partitions created.
+    """
+    await connection.execute(
+        text("SELECT pg_advisory_xact_lock(:key)"), {"key": PARTITION_LOCK_KEY}
+    )
+    await connection.execute(
+        text(
+            f"CREATE TABLE IF NOT EXISTS {DEFAULT_PARTITION} "
+            "PARTITION OF survey DEFAULT"
+        )
+    )
+    existing = await _existing_partitions(connection)
+    month = month_start(since or today)
+    last = month_start(today) + relativedelta(months=ahead)
+    created = []
+    while month <= last:
+        if partition_name(month) not in existing:
+            await _create_month_partition(connection, month)
+            created.append(partition_name(month))
+        month += relativedelta(months=1)
+    if created:
+        logger.info(f"Created survey partitions {created}")
+    return created
+
+
+async def add_brin_indexes(
+    connection: AsyncConnection,
+    today: date,
+    after_months: int = SURVEY_BRIN_AFTER_MONTHS,
+) -> None:
+    """
+    Add a BRIN index on created_at to partitions older than
+    ``after_months`` months; 0 turns this off.
+
+    Closed months no longer change, so their rows stay in insertion order
+    and a BRIN index of a few pages serves date ranges of old exports.
+    """
+    if after_months <= 0:
+        return
+    cutoff = partition_name(
+        month_start(today) - relativedelta(months=after_months)
+    )
+    for name in sorted(await _existing_partitions(connection)):
+        # Имена вида survey_y2024m07 сравниваются как даты
+        if name != DEFAULT_PARTITION and name < cutoff:
+            await connection.execute(
+                text(
+                    f"CREATE INDEX IF NOT EXISTS {name}_created_at_brin "
+                    f"ON {name} USING brin (created_at)"
+                )
+            )
+
+
+async def partition_survey(connection: AsyncConnection) -> None:
+    """
+    Turn the plain survey table into one partitioned by month of
+    created_at, within the caller's transaction.
+
+    The primary key of a partitioned table has to contain the partition
+    key, so it becomes (survey_id, userid, created_at); surveys without
+    created_at get their updated_at. If the table is already partitioned
+    (created so by create_all) only the partitions are ensured.
+    """
+    today = get_current_time_in_almaty_naive().date()
+    if await is_partitioned(connection):
+        await ensure_partitions(connection, today)
+        return
+
+    await connection.execute(
+        text(
+            "UPDATE survey SET created_at = "
+            "coalesce(updated_at, localtimestamp) WHERE created_at IS NULL"
+        )
+    )
+    await connection.execute(
+        text("ALTER TABLE survey RENAME TO survey_unpartitioned")
+    )
+    await connection.execute(
+        text(
+            "CREATE TABLE survey (LIKE survey_unpartitioned "
+            "INCLUDING DEFAULTS) PARTITION BY RANGE (created_at)"
+        )
+    )
+    await connection.execute(
+        text("ALTER TABLE survey ALTER COLUMN created_at SET NOT NULL")
+    )
+
+    first = await connection.execute(
+        text("SELECT min(created_at) FROM survey_unpartitioned")
+    )
+    first = first.scalar()
+    await ensure_partitions(
+        connection, today, since=first.date() if first else None
+    )
+    await connection.execute(
+        text("INSERT INTO survey SELECT * FROM survey_unpartitioned")
+    )
+
+    # Последовательность survey_id принадлежит старой таблице и удалилась
+    # бы вместе с ней
+    sequence = await connection.execute(
+        text(
+            "SELECT pg_get_serial_sequence('survey_unpartitioned', 'survey_id')"
+        )
+    )
+    sequence = sequence.scalar()
+    if sequence:
+        await connection.execute(
+            text(f"ALTER SEQUENCE {sequence} OWNED BY survey.survey_id")
+        )
+    await connection.execute(text("DROP TABLE survey_unpartitioned"))
+
+    # Ключи и индексы строятся после загрузки данных
+    for statement in (
+        "ALTER TABLE survey ADD PRIMARY KEY (survey_id, userid, created_at)",
+        "ALTER TABLE survey ADD FOREIGN KEY (userid) "
+        "REFERENCES users (userid) ON DELETE CASCADE",
+        "ALTER TABLE survey ADD FOREIGN KEY (medication_id) "
+        "REFERENCES medications (id)",
+        "CREATE INDEX ix_survey_userid_created_at "
+        "ON survey (userid, created_at)",
+        "ANALYZE survey",
+    ):
+        await connection.execute(text(statement))
+    logger.info("Survey table converted to monthly partitions")
+
+
+class PartitionMaintainer:
+    """
+    Creates survey partitions ahead of time in the background, so new
+    surveys never have to land in the default partition.
+    """
+
+    def __init__(self, interval: float = SURVEY_PARTITION_CHECK_INTERVAL):
+        self.interval = interval
+        self._database = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self, database) -> None:
+        self._database = database
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._maintain_loop())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def maintain(self) -> None:
+        today = get_current_time_in_almaty_naive().date()
+        async with self._database.engine.begin() as connection:
+            if not await is_partitioned(connection):
+                return
+            await ensure_partitions(connection, today)
+            await add_brin_indexes(connection, today)
+
+    async def _maintain_loop(self) -> None:
+        while True:
+            try:
+                await self.maintain()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Survey partition maintenance failed: {e}")
+            await asyncio.sleep(self.interval)
+
+
+partition_maintainer = PartitionMaintainer()
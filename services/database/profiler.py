@@ -0,0 +1,228 @@
+import logging
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Iterator, Optional
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from services.metrics import (
+    repeated_queries,
+    slow_queries,
+    update_db_time,
+    update_queries,
+)
+from utils.config import DB_REPEATED_QUERY_THRESHOLD, DB_SLOW_QUERY_THRESHOLD
+
+logger = logging.getLogger(__name__)
+
+# Длина текста запроса в логах и статистике
+STATEMENT_PREVIEW = 300
+
+
+def _normalize(statement: str) -> str:
+    return " ".join(statement.split())
+
+
+def _preview(statement: str) -> str:
+    statement = _normalize(statement)
+    if len(statement) > STATEMENT_PREVIEW:
+        return statement[:STATEMENT_PREVIEW] + "..."
+    return statement
+
+
+def _redact(parameters: Any) -> Any:
+    """
+    Replace parameter values by their types: values are user data
+    (names, answers, cities) and must not reach the logs.
+    """
+    if isinstance(parameters, dict):
+        return {key: _redact(value) for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        if parameters and isinstance(parameters[0], (dict, list, tuple)):
+            # executemany: одна строка для примера и их количество
+            return [_redact(parameters[0]), f"... {len(parameters)} rows"]
+        return [_redact(value) for value in parameters]
+    if parameters is None:
+        return None
+    return f"<{type(parameters).__name__}>"
+
+
+class QueryProfile:
+    """
+    Statements run during one handler call.
+    """
+
+    __slots__ = ("handler", "update_id", "count", "duration", "statements")
+
+    def __init__(self, handler: str, update_id: Optional[int]):
+        self.handler = handler
+        self.update_id = update_id
+        self.count = 0
+        self.duration = 0.0
+        self.statements: Counter[str] = Counter()
+
+    def repeated(self, threshold: int) -> list[tuple[str, int]]:
+        return [
+            (statement, count)
+            for statement, count in self.statements.most_common()
+            if count >= threshold
+        ]
+
+
+_current_profile: ContextVar[Optional[QueryProfile]] = ContextVar(
+    "query_profile", default=None
+)
+
+
+class QueryProfiler:
+    """
+    Counts statements and database time per handler call, logs slow
+    statements with redacted parameters and repeated statements.
+
+    SQLAlchemy statements are seen through engine cursor events, raw
+    asyncpg calls of HotQueries report themselves with ``record``. An
+    ``executemany`` counts as one statement, so only real round trips
+    add up. A statement run ``repeat_threshold`` times or more in one
+    handler call is reported as a likely N+1.
+    """
+
+    def __init__(
+        self,
+        slow_threshold: float = DB_SLOW_QUERY_THRESHOLD,
+        repeat_threshold: int = DB_REPEATED_QUERY_THRESHOLD,
+        keep: int = 50,
+    ):
+        self.slow_threshold = slow_threshold
+        self.repeat_threshold = repeat_threshold
+        self.slow: deque[dict] = deque(maxlen=keep)
+        self.repeated: deque[dict] = deque(maxlen=keep)
+        # handler -> [вызовы, запросы, секунды]
+        self._handlers: dict[str, list[float]] = {}
+
+    def instrument(self, engine: AsyncEngine) -> None:
+        sync_engine = engine.sync_engine
+        if event.contains(
+            sync_engine, "before_cursor_execute", self._before_execute
+        ):
+            return
+        event.listen(
+            sync_engine, "before_cursor_execute", self._before_execute
+        )
+        event.listen(sync_engine, "after_cursor_execute", self._after_execute)
+        event.listen(sync_engine, "handle_error", self._on_error)
+
+    def _before_execute(
+        self, conn, cursor, statement, parameters, context, executemany
+    ) -> None:
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    def _after_execute(
+        self, conn, cursor, statement, parameters, context, executemany
+    ) -> None:
+        started = conn.info["query_started"].pop()
+        self.record(statement, parameters, time.perf_counter() - started)
+
+    def _on_error(self, context) -> None:
+        if context.connection is not None:
+            stack = context.connection.info.get("query_started")
+            if stack:
+                stack.pop()
+
+    def record(self, statement: str, parameters: Any, seconds: float) -> None:
+        profile = _current_profile.get()
+        if profile is not None:
+            profile.count += 1
+            profile.duration += seconds
+            profile.statements[_normalize(statement)] += 1
+        if seconds >= self.slow_threshold:
+            self._record_slow(statement, parameters, seconds, profile)
+
+    def _record_slow(
+        self,
+        statement: str,
+        parameters: Any,
+        seconds: float,
+        profile: Optional[QueryProfile],
+    ) -> None:
+        handler = profile.handler if profile else "-"
+        slow_queries.inc(handler=handler)
+        entry = {
+            "at": time.time(),
+            "duration_ms": round(seconds * 1000, 1),
+            "handler": handler,
+            "update_id": profile.update_id if profile else None,
+            "statement": _preview(statement),
+            "parameters": _redact(parameters),
+        }
+        self.slow.append(entry)
+        logger.warning(
+            f"Slow query {entry['duration_ms']}ms in {handler}: "
+            f"{entry['statement']} parameters {entry['parameters']}"
+        )
+
+    @contextmanager
+    def profile(
+        self, handler: str, update_id: Optional[int] = None
+    ) -> Iterator[QueryProfile]:
+        """
+        Attribute the statements of the body to a handler call.
+        """
+        profile = QueryProfile(handler, update_id)
+        token = _current_profile.set(profile)
+        try:
+            yield profile
+        finally:
+            _current_profile.reset(token)
+            self._finish(profile)
+
+    def _finish(self, profile: QueryProfile) -> None:
+        totals = self._handlers.setdefault(profile.handler, [0, 0, 0.0])
+        totals[0] += 1
+        totals[1] += profile.count
+        totals[2] += profile.duration
+        update_queries.observe(profile.count, handler=profile.handler)
+        update_db_time.observe(profile.duration, handler=profile.handler)
+
+        repeated = profile.repeated(self.repeat_threshold)
+        if not repeated:
+            return
+        repeated_queries.inc(handler=profile.handler)
+        for statement, count in repeated:
+            self.repeated.append(
+                {
+                    "at": time.time(),
+                    "handler": profile.handler,
+                    "update_id": profile.update_id,
+                    "count": count,
+                    "statement": _preview(statement),
+                }
+            )
+            logger.warning(
+                f"Possible N+1 in {profile.handler}: statement run {count} "
+                f"times in update {profile.update_id}: {_preview(statement)}"
+            )
+
+    def stats(self) -> dict:
+        return {
+            "slow_threshold_ms": self.slow_threshold * 1000,
+            "repeat_threshold": self.repeat_threshold,
+            "handlers": {
+                handler: {
+                    "calls": int(calls),
+                    "queries": int(queries),
+                    "queries_per_call": round(queries / calls, 2),
+                    "db_ms_per_call": round(seconds / calls * 1000, 2),
+                }
+                for handler, (calls, queries, seconds) in sorted(
+                    self._handlers.items()
+                )
+            },
+            "recent_slow": list(self.slow),
+            "recent_repeated": list(self.repeated),
+        }
+
+
+query_profiler = QueryProfiler()
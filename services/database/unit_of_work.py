@@ -0,0 +1,103 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+logger = logging.getLogger(__name__)
+
+
+class UnitOfWork:
+    """
+    One session shared by all database calls of a Telegram update.
+
+    The session, and with it a pooled connection, is taken on the first
+    call only, and the work is committed once when the update is handled.
+    Only the task that opened the unit of work uses it: tasks started from
+    a handler copy the context but run concurrently with it, and a session
+    must not be shared between them.
+    """
+
+    def __init__(self, database):
+        self.database = database
+        self._session: Optional[AsyncSession] = None
+        self._owner = asyncio.current_task()
+        self._closed = False
+
+    @property
+    def active(self) -> bool:
+        return not self._closed and asyncio.current_task() is self._owner
+
+    @property
+    def started(self) -> bool:
+        """
+        Whether the unit of work has a session, i.e. may hold writes.
+        """
+        return self._session is not None
+
+    def session(self) -> AsyncSession:
+        if self._session is None:
+            self._session = self.database.Session()
+        return self._session
+
+    async def commit(self) -> None:
+        """
+        Commit the work done so far. The connection goes back to the pool
+        until the next call, so long handlers may commit before slow steps.
+        """
+        if self._session is not None:
+            await self._session.commit()
+
+    async def rollback(self) -> None:
+        if self._session is not None:
+            await self._session.rollback()
+
+    async def close(self) -> None:
+        self._closed = True
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+_current_unit_of_work: ContextVar[Optional[UnitOfWork]] = ContextVar(
+    "unit_of_work", default=None
+)
+
+
+def current_unit_of_work(database=None) -> Optional[UnitOfWork]:
+    """
+    The unit of work of the running update, if the calling task owns one
+    (for the given database, when passed).
+    """
+    uow = _current_unit_of_work.get()
+    if uow is None or not uow.active:
+        return None
+    if database is not None and uow.database is not database:
+        return None
+    return uow
+
+
+@asynccontextmanager
+async def unit_of_work(database):
+    """
+    Run the body in one unit of work: commit at the end, roll back on
+    error. Nested scopes join the outer one.
+    """
+    uow = current_unit_of_work(database)
+    if uow is not None:
+        yield uow
+        return
+
+    uow = UnitOfWork(database)
+    token = _current_unit_of_work.set(uow)
+    try:
+        yield uow
+        await uow.commit()
+    except BaseException:
+        await uow.rollback()
+        raise
+    finally:
+        _current_unit_of_work.reset(token)
+        await uow.close()
@@ -0,0 +1,386 @@
+import asyncio
+import logging
+from typing import Optional
+
+from sqlalchemy import bindparam, delete, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm.attributes import set_committed_value
+
+from .models import ProfileWriteOutbox, User
+from services.metrics import register_collected
+from utils.config import WRITE_BEHIND_INTERVAL, WRITE_BEHIND_MAX_PENDING
+from utils.datetime_utils import get_current_time_in_almaty_naive
+
+logger = logging.getLogger(__name__)
+
+# Поля профиля, которые можно записывать отложенно: только строки,
+# чтобы они без потерь проходили через JSON в outbox
+DEFERRABLE_FIELDS = frozenset(
+    {
+        "fio",
+        "country",
+        "city",
+        "menstrual_cycle",
+        "language",
+        "const_medication_name",
+    }
+)
+
+
+class ProfileSettleError(RuntimeError):
+    """
+    Raised when queued profile writes could not be applied before a
+    direct write of the same user; the direct write must not go ahead.
+    """
+
+
+async def _apply_updates(
+    session: AsyncSession, pending: dict[int, dict[str, str]]
+) -> None:
+    # UPDATE уровня Core: без проверки числа строк, значения для
+    # пользователей, которых ещё нет в users, просто отбрасываются.
+    # Пользователи с одинаковым набором полей уходят одним executemany
+    batches: dict[tuple[str, ...], list[dict]] = {}
+    for userid, fields in pending.items():
+        batches.setdefault(tuple(sorted(fields)), []).append(
+            {"b_userid": userid, **fields}
+        )
+    users = User.__table__
+    for fields, rows in batches.items():
+        await session.execute(
+            update(users)
+            .where(users.c.userid == bindparam("b_userid"))
+            .values({field: bindparam(field) for field in fields}),
+            rows,
+        )
+
+
+class ProfileWriteBehind:
+    """
+    Buffers non-critical profile field writes and applies them in batches.
+
+    Writes of one user are coalesced, the last value of a field wins, so
+    a batch is one UPDATE per user at most, all in a single transaction.
+    The buffer is flushed every ``interval`` seconds or as soon as
+    ``max_pending`` users are waiting. A batch that cannot be applied is
+    saved to the profile_write_outbox table with one INSERT and applied
+    from there on a later flush; if even that fails it stays in memory.
+
+    Pending values are visible to reads through ``overlay``.
+    """
+
+    def __init__(
+        self,
+        interval: float = WRITE_BEHIND_INTERVAL,
+        max_pending: int = WRITE_BEHIND_MAX_PENDING,
+    ):
+        self.interval = interval
+        self.max_pending = max_pending
+        self._database = None
+        self._pending: dict[int, dict[str, str]] = {}
+        self._inflight: dict[int, dict[str, str]] = {}
+        # Значения, ждущие в outbox: для чтения они всё ещё не в users
+        self._outboxed: dict[int, dict[str, str]] = {}
+        # При запуске в outbox могли остаться записи прошлого процесса
+        self._outbox_dirty = True
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        # Поля, записанные напрямую во время сброса (None — все поля):
+        # сброс не должен записать поверх них старые значения
+        self._superseded: dict[int, Optional[set[str]]] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._stats = {"writes": 0, "flushed": 0, "outboxed": 0, "failed": 0}
+
+    def start(self, database) -> None:
+        self._database = database
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self) -> None:
+        """
+        Stop the background loop and flush whatever is still buffered.
+        """
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._database is not None:
+            await self.flush()
+        if self._pending:
+            logger.error(
+                f"Profile writes of {len(self._pending)} users are lost "
+                "on shutdown"
+            )
+
+    def write(self, user_id: int, **fields: str) -> None:
+        """
+        Queue profile field values of a user; returns immediately.
+        """
+        unknown = fields.keys() - DEFERRABLE_FIELDS
+        if unknown:
+            raise ValueError(f"Fields {sorted(unknown)} cannot be deferred")
+        self._pending.setdefault(user_id, {}).update(fields)
+        self._stats["writes"] += 1
+        if len(self._pending) >= self.max_pending:
+            self._wakeup.set()
+
+    async def settle(
+        self,
+        user_id: int,
+        field: Optional[str] = None,
+        session: Optional[AsyncSession] = None,
+    ) -> None:
+        """
+        Apply queued values of the user before a direct write of the field
+        (of any field when None), so an older value cannot land after it.
+
+        Pending and outboxed values are written in the session of the
+        direct write, before it and in the same transaction. A batch
+        already being flushed is not waited for: the session may lock the
+        user's row the batch needs. Instead the fields are marked as
+        superseded, and the flush rolls back and applies the batch without
+        them if the direct write came before its commit.
+        """
+        queued = self.overlay(user_id)
+        relevant = queued and (field is None or field in queued)
+        if not relevant and not self._outbox_dirty:
+            return
+        self._supersede(user_id, field)
+        try:
+            if session is None:
+                async with self._database.Session() as session:
+                    await self._settle_in(session, user_id)
+                    await session.commit()
+                return
+            await self._settle_in(session, user_id)
+        except Exception as e:
+            raise ProfileSettleError(
+                f"Queued profile writes of user {user_id} not applied: {e}"
+            ) from e
+
+    def _supersede(self, user_id: int, field: Optional[str]) -> None:
+        if field is None:
+            self._superseded[user_id] = None
+            self._inflight.pop(user_id, None)
+            return
+        fields = self._superseded.setdefault(user_id, set())
+        if fields is not None:
+            fields.add(field)
+        inflight = self._inflight.get(user_id)
+        if inflight and field in inflight:
+            self._inflight[user_id] = {
+                key: value for key, value in inflight.items() if key != field
+            }
+
+    def _without_superseded(
+        self, pending: dict[int, dict[str, str]]
+    ) -> dict[int, dict[str, str]]:
+        result = {}
+        for userid, fields in pending.items():
+            if userid in self._superseded:
+                superseded = self._superseded[userid]
+                if superseded is None:
+                    continue
+                fields = {
+                    key: value
+                    for key, value in fields.items()
+                    if key not in superseded
+                }
+            if fields:
+                result[userid] = fields
+        return result
+
+    async def _settle_in(self, session: AsyncSession, user_id: int) -> None:
+        # Записи пользователя в outbox старше буфера. Пока outbox не
+        # разобран после запуска, в нём могут быть записи прошлого
+        # процесса; другие воркеры пользователя не пишут — его чат
+        # обслуживает один воркер
+        merged: dict[str, str] = {}
+        if user_id in self._outboxed or self._outbox_dirty:
+            result = await session.execute(
+                delete(ProfileWriteOutbox)
+                .where(ProfileWriteOutbox.userid == user_id)
+                .returning(ProfileWriteOutbox.id, ProfileWriteOutbox.fields)
+            )
+            for _, fields in sorted(result.all()):
+                merged.update(fields)
+        pending = self._pending.pop(user_id, {})
+        merged.update(pending)
+        try:
+            if merged:
+                await _apply_updates(session, {user_id: merged})
+        except BaseException:
+            # Вернуть в буфер, не затирая более новые значения
+            if pending:
+                self._pending[user_id] = {
+                    **pending,
+                    **self._pending.get(user_id, {}),
+                }
+            raise
+        self._outboxed.pop(user_id, None)
+
+    def overlay(self, user_id: int) -> dict[str, str]:
+        """
+        Values written for the user but not yet in the users table.
+        """
+        return {
+            **self._outboxed.get(user_id, {}),
+            **self._inflight.get(user_id, {}),
+            **self._pending.get(user_id, {}),
+        }
+
+    def apply_overlay(self, user: User) -> User:
+        """
+        Show queued values on a loaded user without marking it dirty, so
+        a shared session does not write them a second time.
+        """
+        for field, value in self.overlay(user.userid).items():
+            set_committed_value(user, field, value)
+        return user
+
+    def stats(self) -> dict:
+        return {"pending": len(self._pending), **self._stats}
+
+    async def flush(self) -> None:
+        async with self._flush_lock:
+            pending, self._pending = self._pending, {}
+            self._inflight = pending
+            self._superseded = {}
+            try:
+                await self._flush(
+                    {
+                        user: fields
+                        for user, fields in pending.items()
+                        if fields
+                    }
+                )
+            finally:
+                self._inflight = {}
+
+    async def _flush(self, pending: dict[int, dict[str, str]]) -> None:
+        # Сначала outbox: значения в памяти новее и применяются после
+        if self._outbox_dirty:
+            try:
+                async with self._database.Session() as session:
+                    drained = await self._drain_outbox(session)
+                    if self._without_superseded(drained) == drained:
+                        await session.commit()
+                        self._outbox_dirty = False
+                        self._outboxed = {}
+                        self._pin(drained)
+                        if drained:
+                            logger.info(
+                                "Applied outboxed profile writes of "
+                                f"{len(drained)} users"
+                            )
+                    else:
+                        # Прямая запись опередила: при откате строки
+                        # вернутся в outbox, и их применит её settle
+                        await session.rollback()
+            except Exception as e:
+                logger.error(f"Profile write outbox not drained: {e}")
+        pending = self._without_superseded(pending)
+        if not pending:
+            return
+        try:
+            while True:
+                async with self._database.Session() as session:
+                    await _apply_updates(session, pending)
+                    current = self._without_superseded(pending)
+                    if current != pending:
+                        # Прямая запись успела до коммита: откат и повтор
+                        # без её полей
+                        await session.rollback()
+                        pending = current
+                        if not pending:
+                            return
+                        continue
+                    await session.commit()
+                self._pin(pending)
+                self._stats["flushed"] += len(pending)
+                return
+        except Exception as e:
+            logger.error(f"Profile write batch failed: {e}")
+        pending = self._without_superseded(pending)
+        if not pending:
+            return
+
+        try:
+            async with self._database.Session() as session:
+                now = get_current_time_in_almaty_naive()
+                session.add_all(
+                    ProfileWriteOutbox(
+                        userid=userid, fields=fields, created_at=now
+                    )
+                    for userid, fields in pending.items()
+                )
+                await session.commit()
+            self._outbox_dirty = True
+            for userid, fields in pending.items():
+                self._outboxed.setdefault(userid, {}).update(fields)
+            self._stats["outboxed"] += len(pending)
+        except Exception as e:
+            logger.error(f"Profile writes not saved to outbox: {e}")
+            self._stats["failed"] += len(pending)
+            # Вернуть в буфер, не затирая более новые значения
+            for userid, fields in pending.items():
+                self._pending[userid] = {
+                    **fields,
+                    **self._pending.get(userid, {}),
+                }
+
+    async def _drain_outbox(
+        self, session: AsyncSession
+    ) -> dict[int, dict[str, str]]:
+        result = await session.execute(
+            delete(ProfileWriteOutbox).returning(
+                ProfileWriteOutbox.id,
+                ProfileWriteOutbox.userid,
+                ProfileWriteOutbox.fields,
+            )
+        )
+        merged: dict[int, dict[str, str]] = {}
+        for _, userid, fields in sorted(result.all()):
+            merged.setdefault(userid, {}).update(fields)
+        if merged:
+            await _apply_updates(session, merged)
+        return merged
+
+    def _pin(self, applied: dict[int, dict[str, str]]) -> None:
+        for userid in applied:
+            self._database.pin_primary(userid)
+
+    async def _flush_loop(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Profile write-behind flush failed: {e}")
+
+
+profile_writes = ProfileWriteBehind()
+
+register_collected(
+    "bot_profile_writes_pending",
+    "Users with profile writes waiting to be flushed",
+    lambda: [({}, profile_writes.stats()["pending"])],
+)
+register_collected(
+    "bot_profile_writes_total",
+    "Profile write-behind events",
+    lambda: [
+        ({"event": event}, profile_writes.stats()[event])
+        for event in ("writes", "flushed", "outboxed", "failed")
+    ],
+    kind="counter",
+)
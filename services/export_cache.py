@@ -0,0 +1,106 @@
+import logging
+from dataclasses import dataclass, field, replace
+from typing import Optional
+
+from cachetools import LRUCache
+from sqlalchemy import func, select
+
+from services.database import SurveyDailySummary, User
+from services.metrics import cache_requests, register_collected
+from services.statistics import user_rows
+from utils.config import EXPORT_CACHE_MAX_BYTES
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(kw_only=True, slots=True)
+class ExportEntry:
+    version: tuple
+    data: Optional[bytes] = field(default=None)
+    file_id: Optional[str] = field(default=None)
+
+
+def _entry_size(entry: ExportEntry) -> int:
+    # После получения file_id байты не храним, запись почти ничего не весит
+    return len(entry.data) if entry.data else 1
+
+
+class ExportCache:
+    """
+    Statistics exports of users, valid while their data version matches.
+
+    Bounded by the total size of the cached workbooks, least recently used
+    entries are evicted first.
+    """
+
+    def __init__(self, max_bytes: int):
+        self._cache: LRUCache = LRUCache(
+            maxsize=max_bytes, getsizeof=_entry_size
+        )
+
+    def get(self, user_id: int, version: tuple) -> Optional[ExportEntry]:
+        entry = self._cache.get(user_id)
+        if entry is None or entry.version != version:
+            cache_requests.inc(cache="statistics_export", result="miss")
+            return None
+        cache_requests.inc(cache="statistics_export", result="hit")
+        return entry
+
+    def put(self, user_id: int, version: tuple, data: bytes) -> None:
+        if len(data) > self._cache.maxsize:
+            return
+        self._cache[user_id] = ExportEntry(version=version, data=data)
+
+    def remember_file_id(
+        self, user_id: int, version: tuple, file_id: str
+    ) -> None:
+        entry = self._cache.get(user_id)
+        if entry is not None and entry.version == version:
+            self._cache[user_id] = replace(entry, data=None, file_id=file_id)
+
+    def forget_file_id(self, user_id: int) -> None:
+        entry = self._cache.get(user_id)
+        if entry is not None and entry.data is None:
+            del self._cache[user_id]
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._cache),
+            "bytes": self._cache.currsize,
+            "max_bytes": self._cache.maxsize,
+        }
+
+
+async def get_export_version(
+    database, user_id: int, user: Optional[User]
+) -> tuple:
+    """
+    Version of the data that goes into the user's statistics export.
+
+    Read from the daily summary, which gets a new updated_at on every
+    survey save. The sum of updated_at catches edits that do not raise
+    max(updated_at).
+
+    :return: (days with a survey, max updated_at, sum of updated_at
+    epochs, hash of the exported profile row).
+    """
+    async with database.read_scope(user_id) as session:
+        result = await session.execute(
+            select(
+                func.count(),
+                func.max(SurveyDailySummary.updated_at),
+                func.sum(func.extract("epoch", SurveyDailySummary.updated_at)),
+            ).where(SurveyDailySummary.userid == user_id)
+        )
+        count, max_updated_at, updated_sum = result.one()
+    profile = hash(user_rows([user])[0]) if user is not None else None
+    return count, max_updated_at, updated_sum, profile
+
+
+export_cache = ExportCache(EXPORT_CACHE_MAX_BYTES)
+
+register_collected(
+    "bot_export_cache_bytes",
+    "Size of cached statistics exports",
+    lambda: [({}, export_cache.stats()["bytes"])],
+)
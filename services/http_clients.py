@@ -0,0 +1,137 @@
+import logging
+from dataclasses import dataclass
+from typing import Optional
+
+import aiohttp
+import httpx
+
+from services.metrics import register_collected
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True, slots=True)
+class UpstreamConfig:
+    limit: int
+    limit_per_host: int
+    keepalive_timeout: float = 30.0
+    connect_timeout: float = 5.0
+
+
+UPSTREAMS: dict[str, UpstreamConfig] = {
+    # api.telegram.org/file — скачивание голосовых сообщений
+    "telegram_file": UpstreamConfig(limit=50, limit_per_host=50),
+    # iam / stt / tts / translate.api.cloud.yandex.net
+    "yandex": UpstreamConfig(limit=100, limit_per_host=30),
+    # локальный OpenTelemetry collector
+    "otlp": UpstreamConfig(limit=4, limit_per_host=4),
+    # воркеры многопроцессного режима на 127.0.0.1
+    "workers": UpstreamConfig(
+        limit=400, limit_per_host=100, connect_timeout=1.0
+    ),
+}
+
+
+OPENAI_MAX_CONNECTIONS = 50
+
+
+class HttpClients:
+    """
+    Application-scoped outbound HTTP clients, one tuned pool per upstream.
+
+    aiohttp sessions are created in ``start()`` and closed in ``close()``.
+    The OpenAI SDK needs an httpx client, which is created right away
+    because the SDK client is built at import time.
+    """
+
+    def __init__(self, upstreams: dict[str, UpstreamConfig]):
+        self._upstreams = upstreams
+        self._sessions: dict[str, aiohttp.ClientSession] = {}
+        self.openai: httpx.AsyncClient = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=OPENAI_MAX_CONNECTIONS,
+                max_keepalive_connections=20,
+                keepalive_expiry=30,
+            ),
+            timeout=httpx.Timeout(60.0, connect=5.0),
+        )
+
+    async def start(self) -> None:
+        for name in self._upstreams:
+            self.session(name)
+        logger.info(f"HTTP clients started: {', '.join(self._upstreams)}")
+
+    def session(self, name: str) -> aiohttp.ClientSession:
+        """
+        Shared session for the upstream, created on first use.
+        """
+        session = self._sessions.get(name)
+        if session is None or session.closed:
+            config = self._upstreams[name]
+            connector = aiohttp.TCPConnector(
+                limit=config.limit,
+                limit_per_host=config.limit_per_host,
+                keepalive_timeout=config.keepalive_timeout,
+                ttl_dns_cache=300,
+            )
+            session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(
+                    total=None, sock_connect=config.connect_timeout
+                ),
+            )
+            self._sessions[name] = session
+        return session
+
+    async def close(self) -> None:
+        for session in self._sessions.values():
+            await session.close()
+        self._sessions.clear()
+        await self.openai.aclose()
+        logger.info("HTTP clients closed")
+
+    def stats(self) -> dict[str, dict]:
+        stats = {}
+        for name, session in self._sessions.items():
+            connector: Optional[aiohttp.TCPConnector] = session.connector
+            if connector is None:
+                continue
+            # aiohttp не публикует счётчики пула, читаем внутренние поля
+            in_use = len(getattr(connector, "_acquired", ()))
+            idle = sum(
+                len(conns)
+                for conns in getattr(connector, "_conns", {}).values()
+            )
+            stats[name] = {
+                "limit": connector.limit,
+                "in_use": in_use,
+                "idle": idle,
+                "utilization": (
+                    in_use / connector.limit if connector.limit else None
+                ),
+            }
+
+        pool = getattr(getattr(self.openai, "_transport", None), "_pool", None)
+        connections = getattr(pool, "connections", None)
+        if connections is not None:
+            in_use = sum(1 for conn in connections if not conn.is_idle())
+            stats["openai"] = {
+                "limit": OPENAI_MAX_CONNECTIONS,
+                "in_use": in_use,
+                "idle": len(connections) - in_use,
+                "utilization": in_use / OPENAI_MAX_CONNECTIONS,
+            }
+        return stats
+
+
+http_clients = HttpClients(UPSTREAMS)
+
+register_collected(
+    "bot_http_pool_connections",
+    "Outbound connections per upstream pool",
+    lambda: [
+        ({"upstream": name, "state": state}, pool[state])
+        for name, pool in http_clients.stats().items()
+        for state in ("in_use", "idle")
+    ],
+)
@@ -0,0 +1,179 @@
+import asyncio
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Optional
+
+from services.metrics import loop_lag, loop_stalls
+from utils.config import (
+    LOOP_STALL_THRESHOLD,
+    LOOP_WATCHDOG_INTERVAL,
+    LOOP_WATCHDOG_STRICT,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class LoopStallError(RuntimeError):
+    """
+    Raised in strict mode when the event loop was blocked too long.
+    """
+
+
+def _terminate() -> None:
+    os.kill(os.getpid(), signal.SIGTERM)
+
+
+class LoopWatchdog:
+    """
+    Measures event loop lag and captures the stack of blocking code.
+
+    A heartbeat task sleeps for ``interval`` and records how late it woke
+    up. A monitor thread watches the heartbeat; once it is overdue by more
+    than ``threshold`` the thread grabs the current stack of the loop
+    thread, which is the code blocking the loop at that moment.
+
+    In strict mode the first stall fails the process: LoopStallError goes
+    to the loop exception handler and the process is stopped with
+    SIGTERM, so it shuts down the usual way and ``stop`` raises the
+    error again.
+    """
+
+    def __init__(
+        self,
+        interval: float,
+        threshold: float,
+        strict: bool = False,
+        keep: int = 50,
+    ):
+        self.interval = interval
+        self.threshold = threshold
+        self.strict = strict
+        self.stalls: deque[dict] = deque(maxlen=keep)
+        self.violations = 0
+        self.max_lag = 0.0
+        self._last_beat = time.monotonic()
+        self._captured_stack: Optional[str] = None
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    def start(self) -> None:
+        if self._task is not None and not self._task.done():
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.create_task(self._heartbeat())
+        self._task.add_done_callback(self._heartbeat_done)
+        self._thread = threading.Thread(
+            target=self._monitor, name="loop-watchdog", daemon=True
+        )
+        self._thread.start()
+        logger.info(
+            f"Loop watchdog started, threshold {self.threshold * 1000:.0f}ms"
+        )
+
+    async def stop(self) -> None:
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, LoopStallError):
+                # Ошибку строгого режима повторит check
+                pass
+            self._task = None
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+            self._thread = None
+        self.check()
+
+    def _heartbeat_done(self, task: asyncio.Task) -> None:
+        if task.cancelled() or task.exception() is None:
+            return
+        asyncio.get_running_loop().call_exception_handler(
+            {
+                "message": "Loop watchdog failed the process",
+                "exception": task.exception(),
+                "task": task,
+            }
+        )
+        # Обычная остановка: shutdown закончит работу, stop повторит ошибку
+        _terminate()
+
+    def check(self) -> None:
+        """
+        Raise LoopStallError in strict mode if any stall was recorded.
+        """
+        if self.strict and self.violations:
+            last = self.stalls[-1]
+            raise LoopStallError(
+                f"Event loop blocked {self.violations} time(s), last for "
+                f"{last['lag_ms']}ms at:\n{last['stack']}"
+            )
+
+    async def _heartbeat(self) -> None:
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(now - expected, 0.0)
+            self._last_beat = now
+            loop_lag.observe(lag)
+            self.max_lag = max(self.max_lag, lag)
+            if lag >= self.threshold:
+                self._record_stall(lag)
+                self.check()
+
+    def _record_stall(self, lag: float) -> None:
+        stack, self._captured_stack = self._captured_stack, None
+        loop_stalls.inc()
+        self.violations += 1
+        self.stalls.append(
+            {
+                "at": time.time(),
+                "lag_ms": round(lag * 1000, 1),
+                "stack": stack or "<stack was not captured>",
+            }
+        )
+        message = f"Event loop blocked for {lag * 1000:.0f}ms" + (
+            f", blocking code:\n{stack}" if stack else ""
+        )
+        if self.strict:
+            logger.error(message)
+        else:
+            logger.warning(message)
+
+    def _monitor(self) -> None:
+        poll = min(self.interval, self.threshold) / 2
+        while not self._stopped.wait(poll):
+            overdue = time.monotonic() - self._last_beat - self.interval
+            if overdue < self.threshold or self._captured_stack is not None:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is not None:
+                # Стек берём, пока цикл ещё заблокирован
+                self._captured_stack = "".join(traceback.format_stack(frame))
+
+    def stats(self) -> dict:
+        return {
+            "threshold_ms": self.threshold * 1000,
+            "strict": self.strict,
+            "violations": self.violations,
+            "max_lag_ms": round(self.max_lag * 1000, 1),
+            "recent_stalls": list(self.stalls),
+        }
+
+
+loop_watchdog = LoopWatchdog(
+    interval=LOOP_WATCHDOG_INTERVAL,
+    threshold=LOOP_STALL_THRESHOLD,
+    strict=LOOP_WATCHDOG_STRICT,
+)
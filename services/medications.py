@@ -0,0 +1,412 @@
+import asyncio
+import logging
+import re
+from pathlib import Path
+from typing import Iterable, Optional
+
+import numpy as np
+
+from sqlalchemy import func, select, text, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from services.database import (
+    Medication,
+    Survey,
+    SurveyDailySummary,
+    UnmatchedMedication,
+)
+from services.database.daily_summary import headache_flag
+from utils.datetime_utils import get_current_time_in_almaty_naive
+
+logger = logging.getLogger(__name__)
+
+# Дозировка и единицы: «нурофен 200 мг» и «Нурофен» — одно лекарство
+_DOSAGE_RE = re.compile(
+    r"\d+(?:[.,]\d+)?\s*(?:(?:мкг|мг|mg|г|g|мл|ml)(?![а-яёa-z]))?"
+)
+_PUNCTUATION_RE = re.compile(r"[^\w\s-]")
+
+# Ответы, означающие, что лекарство не принимали
+NO_MEDICATION_ANSWERS = frozenset(
+    {
+        "нет",
+        "не",
+        "не принимал",
+        "не принимала",
+        "ничего",
+        "ничего не принимал",
+        "ничего не принимала",
+        "жоқ",
+        "no",
+        "none",
+    }
+)
+
+
+def normalize_medication_name(name: Optional[str]) -> Optional[str]:
+    """
+    Canonical form of a medication name: lower case, no dosage,
+    no punctuation, single spaces.
+
+    :return: The canonical name or None if nothing is left.
+    """
+    if not name:
+        return None
+    name = _DOSAGE_RE.sub(" ", name.lower())
+    name = _PUNCTUATION_RE.sub(" ", name)
+    name = " ".join(name.split())
+    return name or None
+
+
+_WORD_RE = re.compile(r"[^\W_]+")
+
+DICTIONARY_PATH = Path("static/data/medications.txt")
+
+# Порог сходства по умолчанию, как pg_trgm.similarity_threshold
+SIMILARITY_THRESHOLD = 0.3
+# Слова короче не сравниваются по отдельности: «не», «по», «2 раза»
+MIN_WORD_LENGTH = 4
+
+
+def trigrams(value: str) -> frozenset[str]:
+    """
+    Trigrams of a string the way pg_trgm builds them: every word is lower
+    cased and padded with two spaces in front and one behind.
+    """
+    result = set()
+    for word in _WORD_RE.findall(value.lower()):
+        padded = f"  {word} "
+        for i in range(len(padded) - 2):
+            result.add(padded[i : i + 3])
+    return frozenset(result)
+
+
+def similarity(left: str, right: str) -> float:
+    """
+    Same value as pg_trgm ``similarity(left, right)``.
+    """
+    a, b = trigrams(left), trigrams(right)
+    if not a or not b:
+        return 0.0
+    shared = len(a & b)
+    return shared / (len(a) + len(b) - shared)
+
+
+class MedicationIndex:
+    """
+    In-process fuzzy dictionary of medication names.
+
+    Every known spelling (canonical names and their aliases) is indexed
+    by trigram. A lookup counts shared trigrams of all entries at once
+    with numpy over the inverted index, then scores them. Scores equal
+    pg_trgm similarity.
+    """
+
+    def __init__(self, threshold: float = SIMILARITY_THRESHOLD):
+        self.threshold = threshold
+        self._spellings: list[str] = []
+        self._canonical: list[str] = []
+        self._sizes: list[int] = []
+        self._exact: dict[str, int] = {}
+        self._postings: dict[str, list[int]] = {}
+        # Массивы numpy строятся лениво и сбрасываются при добавлении
+        self._posting_arrays: dict[str, np.ndarray] = {}
+        self._size_array: Optional[np.ndarray] = None
+
+    def __len__(self) -> int:
+        return len(self._spellings)
+
+    def add(self, canonical: str, aliases: Iterable[str] = ()) -> None:
+        for spelling in (canonical, *aliases):
+            spelling = normalize_medication_name(spelling)
+            if not spelling or spelling in self._exact:
+                continue
+            entry_id = len(self._spellings)
+            grams = trigrams(spelling)
+            self._spellings.append(spelling)
+            self._canonical.append(canonical)
+            self._sizes.append(len(grams))
+            self._exact[spelling] = entry_id
+            for gram in grams:
+                self._postings.setdefault(gram, []).append(entry_id)
+                self._posting_arrays.pop(gram, None)
+            self._size_array = None
+
+    def load_file(self, path: Path) -> None:
+        """
+        Load lines of ``canonical: alias, alias``; # starts a comment.
+        """
+        with open(path, encoding="utf-8") as file:
+            for line in file:
+                line = line.split("#", 1)[0].strip()
+                if not line:
+                    continue
+                canonical, _, aliases = line.partition(":")
+                self.add(
+                    canonical.strip(),
+                    (alias.strip() for alias in aliases.split(",")),
+                )
+
+    def _posting_array(self, gram: str) -> np.ndarray:
+        array = self._posting_arrays.get(gram)
+        if array is None:
+            array = self._posting_arrays[gram] = np.array(
+                self._postings[gram], dtype=np.int32
+            )
+        return array
+
+    def lookup(self, name: str) -> Optional[tuple[str, float]]:
+        """
+        Best matching canonical name for an already normalized name.
+
+        A name of several words that matches nothing as a whole is matched
+        word by word, so "выпила таблетки цитрамона" finds "цитрамон".
+
+        :return: (canonical name, similarity) or None below the threshold.
+        """
+        match = self._lookup(name)
+        words = name.split()
+        if match is not None or len(words) < 2:
+            return match
+        matches = [
+            self._lookup(word)
+            for word in words
+            if len(word) >= MIN_WORD_LENGTH
+        ]
+        return max(
+            (match for match in matches if match is not None),
+            key=lambda match: match[1],
+            default=None,
+        )
+
+    def _lookup(self, name: str) -> Optional[tuple[str, float]]:
+        entry_id = self._exact.get(name)
+        if entry_id is not None:
+            return self._canonical[entry_id], 1.0
+
+        grams = trigrams(name)
+        query = [gram for gram in grams if gram in self._postings]
+        if not query:
+            return None
+        if self._size_array is None:
+            self._size_array = np.array(self._sizes, dtype=np.float64)
+
+        shared = np.bincount(
+            np.concatenate([self._posting_array(gram) for gram in query]),
+            minlength=len(self._sizes),
+        )
+        # Триграммы запроса без совпадений тоже входят в объединение
+        scores = shared / (len(grams) + self._size_array - shared)
+        best_id = int(scores.argmax())
+        best_score = float(scores[best_id])
+        if best_score < self.threshold:
+            return None
+        return self._canonical[best_id], best_score
+
+    def canonicalize(self, name: Optional[str]) -> Optional[str]:
+        """
+        Canonical dictionary name for a raw answer, or None when nothing
+        in the dictionary is similar enough.
+        """
+        normalized = normalize_medication_name(name)
+        if normalized is None:
+            return None
+        match = self.lookup(normalized)
+        return match[0] if match else None
+
+
+def _build_index() -> MedicationIndex:
+    index = MedicationIndex()
+    try:
+        index.load_file(DICTIONARY_PATH)
+    except OSError as e:
+        logger.error(f"Medication dictionary not loaded: {e}")
+    return index
+
+
+medication_index = _build_index()
+
+
+def medication_flag(name: Optional[str]) -> bool:
+    """
+    Whether the answer names a medication rather than saying "no".
+    """
+    normalized = normalize_medication_name(name)
+    return normalized is not None and normalized not in NO_MEDICATION_ANSWERS
+
+
+async def get_or_create_medication(
+    session: AsyncSession, name: str
+) -> Optional[int]:
+    """
+    Id of the dictionary entry for an already canonical name.
+    """
+    await session.execute(
+        insert(Medication)
+        .values(name=name, created_at=get_current_time_in_almaty_naive())
+        .on_conflict_do_nothing(index_elements=[Medication.name])
+    )
+    result = await session.execute(
+        select(Medication.id).where(Medication.name == name)
+    )
+    return result.scalar()
+
+
+async def record_unmatched(
+    session: AsyncSession, answer: str, seen: int = 1
+) -> None:
+    """
+    Count a medication answer the dictionary does not know, for review.
+    """
+    answer = normalize_medication_name(answer)
+    if answer is None:
+        return
+    now = get_current_time_in_almaty_naive()
+    stmt = insert(UnmatchedMedication).values(
+        answer=answer, seen=seen, last_seen_at=now
+    )
+    await session.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[UnmatchedMedication.answer],
+            set_={
+                "seen": UnmatchedMedication.seen + stmt.excluded.seen,
+                "last_seen_at": stmt.excluded.last_seen_at,
+            },
+        )
+    )
+
+
+async def medication_id_for(
+    session: AsyncSession, answer: Optional[str], seen: int = 1
+) -> Optional[int]:
+    """
+    Dictionary entry id for a medication answer. An answer matching no
+    dictionary name gets no id and is recorded for review: free text
+    must not become a canonical name.
+    """
+    canonical = medication_index.canonicalize(answer)
+    if canonical is None:
+        await record_unmatched(session, answer, seen)
+        return None
+    return await get_or_create_medication(session, canonical)
+
+
+async def apply_survey_flags(session: AsyncSession, survey: Survey) -> None:
+    """
+    Fill the normalized columns of the survey from its free-text answers.
+    """
+    survey.has_headache = headache_flag(survey.headache_today)
+    survey.has_medication = medication_flag(survey.medicament_today)
+    survey.medication_id = None
+    if survey.has_medication:
+        survey.medication_id = await medication_id_for(
+            session, survey.medicament_today
+        )
+
+
+async def load_medications(database) -> None:
+    """
+    Add names already stored in the medications table to the index.
+    """
+    try:
+        async with database.Session() as session:
+            result = await session.execute(select(Medication.name))
+            for name in result.scalars():
+                medication_index.add(name)
+        logger.info(f"Medication index holds {len(medication_index)} names")
+    except Exception as e:
+        logger.error(f"Failed to load medications: {e}")
+
+
+SCHEMA_SQL = (
+    "ALTER TABLE survey ADD COLUMN IF NOT EXISTS has_headache boolean",
+    "ALTER TABLE survey ADD COLUMN IF NOT EXISTS has_medication boolean",
+    "ALTER TABLE survey ADD COLUMN IF NOT EXISTS medication_id integer "
+    "REFERENCES medications (id)",
+    "ALTER TABLE survey_daily_summary "
+    "ADD COLUMN IF NOT EXISTS has_medication boolean",
+    "ALTER TABLE survey_daily_summary ADD COLUMN IF NOT EXISTS "
+    "medication_id integer REFERENCES medications (id)",
+)
+
+BACKFILL_HEADACHE_SQL = """
+UPDATE survey SET has_headache = CASE
+    WHEN lower(headache_today) LIKE '%да%' THEN true
+    WHEN lower(headache_today) LIKE '%нет%' THEN false
+END
+"""
+
+BACKFILL_SUMMARY_SQL = """
+UPDATE survey_daily_summary AS summary SET
+    has_headache = survey.has_headache,
+    has_medication = survey.has_medication,
+    medication_id = survey.medication_id
+FROM survey
+WHERE survey.survey_id = summary.survey_id
+    AND survey.userid = summary.userid
+"""
+
+
+async def backfill_medications(database) -> None:
+    """
+    Add the normalized columns and fill them for existing surveys.
+
+    Medication answers are classified in Python, one UPDATE per distinct
+    raw answer, so old rows get exactly the same values as new ones.
+    """
+    async with database.engine.begin() as connection:
+        await connection.run_sync(Medication.__table__.create, checkfirst=True)
+        await connection.run_sync(
+            SurveyDailySummary.__table__.create, checkfirst=True
+        )
+        for statement in SCHEMA_SQL:
+            await connection.execute(text(statement))
+
+    async with database.Session() as session:
+        await backfill_medication_columns(session)
+        await session.commit()
+
+
+async def backfill_medication_columns(session: AsyncSession) -> None:
+    """
+    Fill the normalized columns of existing surveys and summaries within
+    the caller's transaction.
+    """
+    await session.execute(text(BACKFILL_HEADACHE_SQL))
+    answers = await session.execute(
+        select(Survey.medicament_today, func.count())
+        .where(Survey.medicament_today.is_not(None))
+        .group_by(Survey.medicament_today)
+    )
+    answers = answers.all()
+    for answer, seen in answers:
+        has_medication = medication_flag(answer)
+        medication_id = (
+            await medication_id_for(session, answer, seen)
+            if has_medication
+            else None
+        )
+        await session.execute(
+            update(Survey)
+            .where(Survey.medicament_today == answer)
+            .values(
+                has_medication=has_medication,
+                medication_id=medication_id,
+            )
+        )
+    await session.execute(
+        update(Survey)
+        .where(Survey.medicament_today.is_(None))
+        .values(has_medication=False, medication_id=None)
+    )
+    await session.execute(text(BACKFILL_SUMMARY_SQL))
+    logger.info(f"Medications backfilled from {len(answers)} answers")
+
+
+if __name__ == "__main__":
+    # python -m services.medications
+    from services.database import Postgres
+
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(backfill_medications(Postgres()))
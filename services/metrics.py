@@ -0,0 +1,265 @@
+import functools
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Iterator
+
+# Границы корзин в секундах: от единиц миллисекунд до минуты
+DEFAULT_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+
+
+def _format_labels(labels: tuple[tuple[str, str], ...], **extra) -> str:
+    pairs = list(labels) + list(extra.items())
+    if not pairs:
+        return ""
+    inner = ",".join(
+        f'{key}="{str(value).replace(chr(34), chr(39))}"'
+        for key, value in pairs
+    )
+    return "{" + inner + "}"
+
+
+class Counter:
+    """
+    Monotonic counter with optional labels.
+    """
+
+    __slots__ = ("name", "help", "_values")
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.help}",
+            f"# TYPE {self.name} counter",
+        ]
+        for key, value in self._values.items():
+            lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+
+class Histogram:
+    """
+    Cumulative-bucket histogram in the Prometheus sense.
+
+    An observation is a bisect over the bucket bounds and two additions,
+    around a microsecond, so it is fine on the hot path.
+    """
+
+    __slots__ = ("name", "help", "buckets", "_series")
+
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        self.name = name
+        self.help = help_text
+        self.buckets = buckets
+        # labels -> [bucket counts..., +Inf count, sum]
+        self._series: dict[tuple, list[float]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [0.0] * (len(self.buckets) + 2)
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.help}",
+            f"# TYPE {self.name} histogram",
+        ]
+        for key, series in self._series.items():
+            cumulative = 0.0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(key, le=bound)} "
+                    f"{cumulative}"
+                )
+            cumulative += series[len(self.buckets)]
+            lines.append(
+                f"{self.name}_bucket{_format_labels(key, le='+Inf')} "
+                f"{cumulative}"
+            )
+            lines.append(f"{self.name}_sum{_format_labels(key)} {series[-1]}")
+            lines.append(
+                f"{self.name}_count{_format_labels(key)} {cumulative}"
+            )
+        return lines
+
+
+class Collected:
+    """
+    Metric whose values are read at scrape time from existing stats.
+
+    ``collect`` returns pairs of (labels dict, value).
+    """
+
+    __slots__ = ("name", "help", "kind", "_collect")
+
+    def __init__(self, name: str, help_text: str, collect, kind="gauge"):
+        self.name = name
+        self.help = help_text
+        self.kind = kind
+        self._collect = collect
+
+    def render(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.help}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        for labels, value in self._collect():
+            if value is None:
+                continue
+            key = tuple(sorted(labels.items()))
+            lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: list = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines: list[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+stage_latency = registry.register(
+    Histogram(
+        "bot_stage_duration_seconds",
+        "Duration of voice turn stages",
+    )
+)
+db_latency = registry.register(
+    Histogram(
+        "bot_db_operation_duration_seconds",
+        "Duration of database operations",
+    )
+)
+cache_requests = registry.register(
+    Counter("bot_cache_requests_total", "Cache lookups by cache and result")
+)
+throttled = registry.register(
+    Counter("bot_throttled_total", "Updates dropped by throttling")
+)
+loop_lag = registry.register(
+    Histogram(
+        "bot_event_loop_lag_seconds",
+        "Delay of event loop heartbeats behind schedule",
+        buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0),
+    )
+)
+loop_stalls = registry.register(
+    Counter("bot_event_loop_stalls_total", "Event loop blocks over threshold")
+)
+report_render = registry.register(
+    Histogram(
+        "bot_report_render_seconds",
+        "Time spent rendering a statistics export in the process pool",
+    )
+)
+report_wait = registry.register(
+    Histogram(
+        "bot_report_queue_wait_seconds",
+        "Time a statistics export waited for a free worker",
+    )
+)
+errors = registry.register(
+    Counter("bot_errors_total", "Errors by place where they were caught")
+)
+db_reads = registry.register(
+    Counter("bot_db_reads_total", "Read-only database calls by target")
+)
+update_queries = registry.register(
+    Histogram(
+        "bot_db_queries_per_update",
+        "Database statements run by one handler call",
+        buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100),
+    )
+)
+update_db_time = registry.register(
+    Histogram(
+        "bot_db_time_per_update_seconds",
+        "Total database time of one handler call",
+    )
+)
+slow_queries = registry.register(
+    Counter("bot_db_slow_queries_total", "Statements over the slow threshold")
+)
+repeated_queries = registry.register(
+    Counter(
+        "bot_db_repeated_queries_total",
+        "Handler calls repeating one statement, a likely N+1",
+    )
+)
+
+
+def observe_stage(stage: str, seconds: float) -> None:
+    stage_latency.observe(seconds, stage=stage)
+
+
+def register_collected(
+    name: str, help_text: str, collect, kind: str = "gauge"
+) -> Collected:
+    return registry.register(Collected(name, help_text, collect, kind))
+
+
+def timed_db(func):
+    """
+    Record the duration of a database coroutine under its name.
+    """
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            db_latency.observe(
+                time.perf_counter() - started, operation=func.__name__
+            )
+
+    return wrapper
@@ -1,41 +1,72 @@
 import asyncio
 import logging
-from openai import AsyncOpenAI
+from openai import APIConnectionError, AsyncOpenAI
+from services.http_clients import http_clients
+from services.resilience import get_dependency, register_retryable
 from settings import OPENAI_API_KEY
+from utils.deadline import DeadlineExceeded
 
-client = AsyncOpenAI(api_key=OPENAI_API_KEY)
+# Повторы выполняет слой устойчивости, а не клиент
+client = AsyncOpenAI(
+    api_key=OPENAI_API_KEY, max_retries=0, http_client=http_clients.openai
+)
+openai_dependency = get_dependency("openai")
+# Сетевые ошибки и таймауты клиента OpenAI приходят без HTTP-статуса
+register_retryable(APIConnectionError)
 logger = logging.getLogger(__name__)
 
+# Ссылки на фоновые задачи, чтобы их не собрал сборщик мусора
+_background_tasks: set = set()
+
 
 async def get_new_thread_id():
-    thread = await client.beta.threads.create()
+    thread = await openai_dependency.call(client.beta.threads.create)
     return thread.id
 
 
+async def cancel_run(thread_id, run_id):
+    try:
+        await client.beta.threads.runs.cancel(
+            thread_id=thread_id, run_id=run_id
+        )
+        logger.info(f"Run {run_id} in thread {thread_id} cancelled")
+    except Exception as e:
+        logger.error(f"Failed to cancel run {run_id}: {e}")
+
+
 async def process_question(question, thread_id=None, assistant_id=None):
+    run = None
     try:
         logger.info("Processing question with GPT-4")
         if not thread_id:
-            thread = await client.beta.threads.create()
+            thread = await openai_dependency.call(client.beta.threads.create)
             thread_id = thread.id
             logger.info(f"New thread created with ID: {thread_id}")
 
-        await client.beta.threads.messages.create(
-            thread_id=thread_id, role="user", content=question
+        await openai_dependency.call(
+            lambda: client.beta.threads.messages.create(
+                thread_id=thread_id, role="user", content=question
+            ),
+            idempotent=False,
         )
-        run = await client.beta.threads.runs.create(
-            thread_id=thread_id, assistant_id=assistant_id
+        run = await openai_dependency.call(
+            lambda: client.beta.threads.runs.create(
+                thread_id=thread_id, assistant_id=assistant_id
+            ),
+            idempotent=False,
         )
 
         while run.status in ["queued", "in_progress", "cancelling"]:
             await asyncio.sleep(1)
-            run = await client.beta.threads.runs.retrieve(
-                thread_id=thread_id, run_id=run.id
+            run = await openai_dependency.call(
+                lambda: client.beta.threads.runs.retrieve(
+                    thread_id=thread_id, run_id=run.id
+                )
             )
 
         if run.status == "completed":
-            messages = await client.beta.threads.messages.list(
-                thread_id=thread_id
+            messages = await openai_dependency.call(
+                lambda: client.beta.threads.messages.list(thread_id=thread_id)
             )
             assistant_messages = [
                 msg.content[0].text.value.split("```json")[0]
@@ -52,6 +83,15 @@ async def process_question(question, thread_id=None, assistant_id=None):
                 )
         else:
             return "Не удалось получить ответ от ассистента.", thread_id, run
+    except asyncio.CancelledError:
+        # Ход отменён (например, истёк его бюджет) — останавливаем run
+        if run is not None and run.status in ["queued", "in_progress"]:
+            task = asyncio.create_task(cancel_run(thread_id, run.id))
+            _background_tasks.add(task)
+            task.add_done_callback(_background_tasks.discard)
+        raise
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         logger.error(f"Error in process_question: {e}")
         return "Произошла ошибка при обработке вопроса.", thread_id, None
@@ -0,0 +1,122 @@
+import asyncio
+import logging
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Optional
+
+from services.metrics import register_collected, report_render, report_wait
+from utils.config import REPORT_MAX_QUEUE, REPORT_POOL_WORKERS, REPORT_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+
+class ReportQueueFull(Exception):
+    """
+    Raised when too many exports are already waiting for a worker.
+    """
+
+
+class ReportPool:
+    """
+    Bounded process pool for CPU-heavy report rendering.
+
+    At most ``workers`` reports render at once; up to ``max_queue`` more
+    wait for a slot, further requests are rejected right away. Arguments
+    and results cross the process boundary, so they should be plain
+    tuples and bytes rather than ORM objects.
+    """
+
+    def __init__(self, workers: int, max_queue: int, timeout: float):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.queued = 0
+        self.running = 0
+        self.rejected = 0
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    def _ensure_started(self) -> None:
+        if self._executor is None:
+            # spawn: не копируем в дочерние процессы цикл событий и потоки
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+            self._slots = asyncio.Semaphore(self.workers)
+
+    async def run(self, func: Callable[..., Any], *args) -> Any:
+        """
+        Run ``func(*args)`` in a worker process.
+
+        :raises ReportQueueFull: If the wait queue is full.
+        :raises asyncio.TimeoutError: If the report took too long; its
+        worker keeps the slot until the rendering ends.
+        """
+        self._ensure_started()
+        if self._slots.locked() and self.queued >= self.max_queue:
+            self.rejected += 1
+            raise ReportQueueFull()
+
+        queued_at = time.perf_counter()
+        self.queued += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.queued -= 1
+        report_wait.observe(time.perf_counter() - queued_at)
+
+        self.running += 1
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._executor, func, *args)
+        # Слот занят, пока процесс считает, даже если ждать уже перестали
+        future.add_done_callback(
+            lambda future, slots=self._slots: self._finished(future, slots)
+        )
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), self.timeout)
+        finally:
+            elapsed = time.perf_counter() - started
+            report_render.observe(elapsed, report=func.__name__)
+            logger.info(f"Report {func.__name__} rendered in {elapsed:.2f}s")
+
+    def _finished(
+        self, future: asyncio.Future, slots: asyncio.Semaphore
+    ) -> None:
+        self.running -= 1
+        slots.release()
+        if not future.cancelled() and future.exception() is not None:
+            # Результат брошенного по таймауту отчёта никто не заберёт
+            logger.debug(f"Report failed: {future.exception()!r}")
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+            self._slots = None
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "running": self.running,
+            "queued": self.queued,
+            "rejected": self.rejected,
+        }
+
+
+report_pool = ReportPool(
+    workers=REPORT_POOL_WORKERS,
+    max_queue=REPORT_MAX_QUEUE,
+    timeout=REPORT_TIMEOUT,
+)
+
+register_collected(
+    "bot_report_pool_tasks",
+    "Statistics exports running and waiting for a worker",
+    lambda: [
+        ({"state": "running"}, report_pool.running),
+        ({"state": "queued"}, report_pool.queued),
+    ],
+)
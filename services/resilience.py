@@ -0,0 +1,424 @@
+import asyncio
+import functools
+import logging
+import random
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Optional
+
+import aiohttp
+
+from services.metrics import register_collected
+from services.tracing import span
+from utils.config import HEDGED_REQUESTS_ENABLED
+from utils.deadline import DeadlineExceeded, remaining_time
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised when a call is rejected because the dependency circuit is open.
+    """
+
+    def __init__(self, dependency: str):
+        super().__init__(f"Circuit for {dependency} is open")
+        self.dependency = dependency
+
+
+class CircuitBreaker:
+    """
+    Classic closed / open / half-open circuit breaker.
+
+    After ``failure_threshold`` consecutive failures the circuit opens and
+    rejects calls for ``reset_timeout`` seconds, then lets a single probe
+    through. A successful probe closes the circuit again.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self, name: str, failure_threshold: int, reset_timeout: float
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if (
+            self._state == self.OPEN
+            and time.monotonic() - self._opened_at >= self.reset_timeout
+        ):
+            self._state = self.HALF_OPEN
+            self._probe_in_flight = False
+        return self._state
+
+    @property
+    def is_open(self) -> bool:
+        return self.state == self.OPEN
+
+    def allow_request(self) -> bool:
+        state = self.state
+        if state == self.CLOSED:
+            return True
+        if state == self.HALF_OPEN and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return True
+        return False
+
+    def release_probe(self) -> None:
+        """
+        Let another probe through after one that ended without a verdict:
+        cancelled or out of turn budget. The circuit stays half-open.
+        """
+        self._probe_in_flight = False
+
+    def record_success(self) -> None:
+        self._state = self.CLOSED
+        self._failures = 0
+        self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        self._failures += 1
+        if (
+            self._state == self.HALF_OPEN
+            or self._failures >= self.failure_threshold
+        ):
+            if self._state != self.OPEN:
+                logger.warning(f"Circuit breaker for {self.name} opened")
+            self._state = self.OPEN
+            self._opened_at = time.monotonic()
+            self._probe_in_flight = False
+
+
+@dataclass(kw_only=True, slots=True)
+class DependencyStats:
+    calls: int = field(default=0)
+    successes: int = field(default=0)
+    failures: int = field(default=0)
+    retries: int = field(default=0)
+    timeouts: int = field(default=0)
+    hedges: int = field(default=0)
+    hedge_wins: int = field(default=0)
+    short_circuited: int = field(default=0)
+    latencies: deque = field(default_factory=lambda: deque(maxlen=500))
+
+    def percentile(self, percent: float) -> Optional[float]:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        index = min(
+            int(round(percent / 100 * (len(ordered) - 1))), len(ordered) - 1
+        )
+        return ordered[index]
+
+
+# Ошибки связи без HTTP-статуса; клиенты с собственными типами ошибок
+# добавляют их через register_retryable
+_retryable_errors: tuple[type[BaseException], ...] = (
+    asyncio.TimeoutError,
+    ConnectionError,
+    aiohttp.ClientError,
+)
+
+
+def register_retryable(*errors: type[BaseException]) -> None:
+    """
+    Treat the exception types as transport failures worth retrying.
+    """
+    global _retryable_errors
+    _retryable_errors = (*_retryable_errors, *errors)
+
+
+def _status(error: BaseException) -> Optional[int]:
+    status = getattr(error, "status", None) or getattr(
+        error, "status_code", None
+    )
+    return status if isinstance(status, int) else None
+
+
+def is_retryable(error: BaseException) -> bool:
+    """
+    Timeouts, connection problems, 429 and 5xx are worth retrying.
+    Other client errors are not, and neither are unknown exceptions:
+    a bug in our code says nothing about the dependency.
+    """
+    status = _status(error)
+    if status is not None:
+        return status == 429 or status >= 500
+    return isinstance(error, _retryable_errors)
+
+
+def _turn_expired() -> bool:
+    remaining = remaining_time()
+    return remaining is not None and remaining <= 0
+
+
+class Dependency:
+    """
+    Outbound dependency guarded by a circuit breaker, a per-attempt timeout,
+    bounded retries with full jitter and optional request hedging.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        timeout: float,
+        max_retries: int = 2,
+        backoff_base: float = 0.2,
+        backoff_max: float = 2.0,
+        hedge_percentile: Optional[float] = None,
+        hedge_min_samples: int = 20,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+    ):
+        self.name = name
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.breaker = CircuitBreaker(name, failure_threshold, reset_timeout)
+        self.stats = DependencyStats()
+
+    @property
+    def is_open(self) -> bool:
+        return self.breaker.is_open
+
+    async def call(
+        self,
+        factory: Callable[[], Awaitable[Any]],
+        idempotent: bool = True,
+    ) -> Any:
+        """
+        Run ``factory()`` under the dependency policies.
+
+        :param factory: Creates a fresh coroutine for every attempt.
+        :param idempotent: Non-idempotent calls are neither retried
+        nor hedged.
+
+        :return: The result of the first successful attempt.
+        """
+        self.stats.calls += 1
+        with span(f"dependency.{self.name}") as current:
+            result = await self._call(factory, idempotent, current)
+        return result
+
+    async def _call(
+        self,
+        factory: Callable[[], Awaitable[Any]],
+        idempotent: bool,
+        current,
+    ) -> Any:
+        retries = self.max_retries if idempotent else 0
+        last_error: Optional[BaseException] = None
+
+        for attempt in range(retries + 1):
+            if not self.breaker.allow_request():
+                self.stats.short_circuited += 1
+                raise CircuitOpenError(self.name) from last_error
+            try:
+                result = await self._attempt(factory, hedge=idempotent)
+            except (DeadlineExceeded, CircuitOpenError):
+                # Истёк бюджет хода или открыта цепь вложенной зависимости:
+                # об этой зависимости ничего не известно, повторять нечего
+                self.breaker.release_probe()
+                raise
+            except Exception as e:
+                if isinstance(e, asyncio.TimeoutError) and _turn_expired():
+                    # Истёк бюджет хода, а не таймаут зависимости
+                    self.breaker.release_probe()
+                    raise DeadlineExceeded(self.name) from None
+                last_error = e
+                self.stats.failures += 1
+                if isinstance(e, asyncio.TimeoutError):
+                    self.stats.timeouts += 1
+                if not is_retryable(e):
+                    if _status(e) is not None:
+                        # Ошибка клиента — зависимость жива
+                        self.breaker.record_success()
+                    else:
+                        # Ошибка в нашем коде, не в зависимости
+                        self.breaker.release_probe()
+                    raise
+                self.breaker.record_failure()
+                if attempt == retries:
+                    raise
+                delay = random.uniform(
+                    0, min(self.backoff_max, self.backoff_base * 2**attempt)
+                )
+                remaining = remaining_time()
+                if remaining is not None and remaining <= delay:
+                    raise
+                self.stats.retries += 1
+                logger.warning(
+                    f"{self.name} attempt {attempt + 1} failed: {e!r}, "
+                    f"retrying in {delay:.2f}s"
+                )
+                await asyncio.sleep(delay)
+            except BaseException:
+                # Отмена и прочие выходы без исхода: пробу занимает
+                # следующий запрос, иначе цепь не закроется никогда
+                self.breaker.release_probe()
+                raise
+            else:
+                self.breaker.record_success()
+                self.stats.successes += 1
+                if current is not None and attempt:
+                    current.set(retries=attempt)
+                return result
+
+        raise last_error
+
+    def _hedge_delay(self) -> Optional[float]:
+        if (
+            not HEDGED_REQUESTS_ENABLED
+            or self.hedge_percentile is None
+            or len(self.stats.latencies) < self.hedge_min_samples
+        ):
+            return None
+        return self.stats.percentile(self.hedge_percentile)
+
+    async def _timed(self, factory: Callable[[], Awaitable[Any]]) -> Any:
+        timeout = self.timeout
+        remaining = remaining_time()
+        if remaining is not None:
+            if remaining <= 0:
+                raise DeadlineExceeded(self.name)
+            timeout = min(timeout, remaining)
+        started = time.monotonic()
+        with span(f"{self.name}.attempt", timeout=round(timeout, 3)):
+            result = await asyncio.wait_for(factory(), timeout)
+        self.stats.latencies.append(time.monotonic() - started)
+        return result
+
+    async def _attempt(
+        self, factory: Callable[[], Awaitable[Any]], hedge: bool
+    ) -> Any:
+        hedge_delay = self._hedge_delay() if hedge else None
+        if hedge_delay is None:
+            return await self._timed(factory)
+
+        primary = asyncio.ensure_future(self._timed(factory))
+        tasks = {primary}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=hedge_delay)
+            if done:
+                return primary.result()
+
+            # Первый запрос дольше перцентиля — отправляем второй
+            self.stats.hedges += 1
+            hedged = asyncio.ensure_future(self._timed(factory))
+            tasks.add(hedged)
+            pending = set(tasks)
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedged:
+                            self.stats.hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    def snapshot(self) -> dict:
+        stats = self.stats
+        return {
+            "state": self.breaker.state,
+            "calls": stats.calls,
+            "successes": stats.successes,
+            "failures": stats.failures,
+            "retries": stats.retries,
+            "timeouts": stats.timeouts,
+            "hedges": stats.hedges,
+            "hedge_wins": stats.hedge_wins,
+            "short_circuited": stats.short_circuited,
+            "p50": stats.percentile(50),
+            "p95": stats.percentile(95),
+            "p99": stats.percentile(99),
+        }
+
+
+dependencies: dict[str, Dependency] = {
+    "yandex_iam": Dependency("yandex_iam", timeout=10, max_retries=2),
+    "yandex_stt": Dependency(
+        "yandex_stt", timeout=15, max_retries=2, hedge_percentile=95
+    ),
+    "yandex_tts": Dependency(
+        "yandex_tts", timeout=15, max_retries=2, hedge_percentile=95
+    ),
+    "yandex_translate": Dependency(
+        "yandex_translate", timeout=5, max_retries=2, hedge_percentile=95
+    ),
+    "openai": Dependency("openai", timeout=30, max_retries=2),
+}
+
+
+def get_dependency(name: str) -> Dependency:
+    return dependencies[name]
+
+
+def dependency_stats() -> dict[str, dict]:
+    return {name: dep.snapshot() for name, dep in dependencies.items()}
+
+
+def resilient(name: str, idempotent: bool = True):
+    """
+    Decorator running a coroutine function through the named dependency.
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            return await dependencies[name].call(
+                functools.partial(func, *args, **kwargs),
+                idempotent=idempotent,
+            )
+
+        return wrapper
+
+    return decorator
+
+
+register_collected(
+    "bot_dependency_calls_total",
+    "Outbound dependency call outcomes",
+    lambda: [
+        ({"dependency": name, "outcome": outcome}, snapshot[outcome])
+        for name, snapshot in dependency_stats().items()
+        for outcome in (
+            "calls",
+            "successes",
+            "failures",
+            "retries",
+            "timeouts",
+            "hedges",
+            "short_circuited",
+        )
+    ],
+    kind="counter",
+)
+register_collected(
+    "bot_dependency_circuit_open",
+    "1 when the dependency circuit breaker is open",
+    lambda: [
+        ({"dependency": name}, int(dependency.is_open))
+        for name, dependency in dependencies.items()
+    ],
+)
@@ -1,128 +1,175 @@
 import calendar
 import logging
-from datetime import datetime
+from datetime import date, datetime, time, timedelta
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from dateutil.relativedelta import relativedelta
-from sqlalchemy import select
-from services.database import Survey, Postgres
+from sqlalchemy import func, select
+from services.database import (
+    Medication,
+    Survey,
+    SurveyDailySummary,
+    Postgres,
+)
+from services.database.daily_summary import upsert_daily_summary
+from services.medications import apply_survey_flags
 from utils.datetime_utils import get_current_time_in_almaty_naive
 
 logger = logging.getLogger(__name__)
 
 
 async def save_survey_response(database, response_data, selected_date):
-    existing_survey = await get_survey_by_date(
-        database, response_data["userid"], selected_date
-    )
-
     current_time = get_current_time_in_almaty_naive().time()
     combined_datetime = datetime.combine(selected_date, current_time)
     response_data["updated_at"] = combined_datetime
 
-    if existing_survey:
-        try:
-            for parameter, value in response_data.items():
-                if parameter != "userid":
-                    await database.update_entity_parameter(
-                        entity_id=(
-                            existing_survey.survey_id,
-                            existing_survey.userid,
-                        ),
-                        parameter=parameter,
-                        value=value,
-                        model_class=Survey,
-                    )
-        except Exception as e:
-            logger.error(f"Error updating existing survey: {e}")
-
-    else:
-        try:
-            survey_data = Survey(
-                userid=response_data["userid"],
-                headache_today=response_data["headache_today"],
-                medicament_today=response_data["medicament_today"],
-                pain_intensity=response_data["pain_intensity"],
-                pain_area=response_data["pain_area"],
-                area_detail=response_data["area_detail"],
-                pain_type=response_data["pain_type"],
-                comments=response_data["comments"],
-                created_at=combined_datetime,
-                updated_at=get_current_time_in_almaty_naive(),
-            )
-            await database.add_entity(
-                entity_data=survey_data,
-                model_class=Survey,
+    # Календарь и выгрузка этого пользователя читают с основного сервера
+    database.pin_primary(response_data["userid"])
+    try:
+        async with database.session_scope() as session:
+            survey = await _find_survey_by_date(
+                session, response_data["userid"], selected_date
             )
-        except Exception as e:
-            logger.error(f"Error adding new survey: {e}")
+            if survey:
+                for parameter, value in response_data.items():
+                    if parameter != "userid":
+                        setattr(survey, parameter, value)
+            else:
+                survey = Survey(
+                    userid=response_data["userid"],
+                    headache_today=response_data["headache_today"],
+                    medicament_today=response_data["medicament_today"],
+                    pain_intensity=response_data["pain_intensity"],
+                    pain_area=response_data["pain_area"],
+                    area_detail=response_data["area_detail"],
+                    pain_type=response_data["pain_type"],
+                    comments=response_data["comments"],
+                    created_at=combined_datetime,
+                    updated_at=get_current_time_in_almaty_naive(),
+                )
+                session.add(survey)
+                # Получаем survey_id до записи сводки
+                await session.flush()
+
+            # Нормализованные колонки и сводка дня пишутся в той же
+            # транзакции, что и опрос
+            await apply_survey_flags(session, survey)
+            await upsert_daily_summary(session, survey)
+    except Exception as e:
+        logger.error(f"Error saving survey response: {e}")
+
+
+async def _find_survey_by_date(session, user_id, day: date):
+    start = datetime.combine(day, time.min)
+    result = await session.execute(
+        select(Survey)
+        .where(Survey.userid == user_id)
+        .where(Survey.created_at >= start)
+        .where(Survey.created_at < start + timedelta(days=1))
+        .order_by(Survey.survey_id)
+        .limit(1)
+    )
+    return result.scalars().first()
 
 
 async def get_survey_by_date(database, user_id, date: datetime.date):
-    print(date)
-    filters = {"userid": user_id}
-    surveys = await database.get_entities_parameter(Survey, filters)
-
-    for survey in surveys:
-        logger.info(f"Survey date: {survey.created_at.date()}")
-
-    # Фильтрация опросов по дате
-    survey = next(
-        (survey for survey in surveys if survey.created_at.date() == date),
-        None,
-    )
+    # Только для чтения: строка без ORM-объекта
+    survey = await database.queries.survey_by_date(user_id, date)
     logger.info(f"Found survey: {survey}")
     return survey
 
 
 async def get_surveys_for_month(
     database: Postgres, user_id: int, month: int, year: int
+) -> list:
+    return await database.queries.surveys_for_month(user_id, month, year)
+
+
+async def get_daily_summaries_for_month(
+    database: Postgres, user_id: int, month: int, year: int
 ) -> list:
     try:
-        async with database.Session() as session:
-            start_date = datetime(year, month, 1)
+        async with database.read_scope(user_id) as session:
+            start_date = date(year, month, 1)
             end_date = start_date + relativedelta(months=1)
 
             result = await session.execute(
-                select(Survey)
-                .where(Survey.userid == user_id)
-                .where(Survey.created_at >= start_date)
-                .where(Survey.created_at < end_date)
+                select(SurveyDailySummary)
+                .where(SurveyDailySummary.userid == user_id)
+                .where(SurveyDailySummary.day >= start_date)
+                .where(SurveyDailySummary.day < end_date)
             )
             return result.scalars().all()
     except Exception as e:
-        logger.error(f"Error fetching surveys for month: {e}")
+        logger.error(f"Error fetching daily summaries for month: {e}")
         return []
 
 
 async def get_calendar_marks(
     database: Postgres, user_id: int, month: int, year: int
 ) -> dict:
-    surveys = await get_surveys_for_month(database, user_id, month, year)
+    summaries = await get_daily_summaries_for_month(
+        database, user_id, month, year
+    )
     marks = {}
     count_headache = 0
     count_headache_medicament_today = 0
     headache_medicament_today = []
 
-    for survey in surveys:
-        date_str = survey.created_at.strftime("%Y-%m-%d")
-        if "да" in survey.headache_today.lower():
-            if survey.medicament_today:
+    for summary in summaries:
+        date_str = summary.day.strftime("%Y-%m-%d")
+        if summary.has_headache:
+            if summary.has_medication:
                 marks[date_str] = "🔺"
                 count_headache += 1
                 count_headache_medicament_today += 1
-                headache_medicament_today.append(survey.medicament_today)
+                headache_medicament_today.append(summary.medicament_today)
             else:
                 marks[date_str] = "🔸"
                 count_headache += 1
-        elif "нет" in survey.headache_today.lower():
+        elif summary.has_headache is False:
             marks[date_str] = "✓"
     marks["count_headache"] = count_headache
     marks["count_headache_medicament_today"] = count_headache_medicament_today
     marks["headache_medicament_today"] = headache_medicament_today
-    print(marks)
+    if count_headache_medicament_today:
+        marks["medication_counts"] = await get_medication_counts_for_month(
+            database, user_id, month, year
+        )
     return marks
 
 
+async def get_medication_counts_for_month(
+    database: Postgres, user_id: int, month: int, year: int
+) -> list:
+    """
+    Days with headache per canonical medication, most frequent first.
+
+    :return: List of [medication name, number of days].
+    """
+    try:
+        async with database.read_scope(user_id) as session:
+            start_date = date(year, month, 1)
+            end_date = start_date + relativedelta(months=1)
+
+            result = await session.execute(
+                select(Medication.name, func.count())
+                .join(
+                    SurveyDailySummary,
+                    SurveyDailySummary.medication_id == Medication.id,
+                )
+                .where(SurveyDailySummary.userid == user_id)
+                .where(SurveyDailySummary.day >= start_date)
+                .where(SurveyDailySummary.day < end_date)
+                .where(SurveyDailySummary.has_headache.is_(True))
+                .group_by(Medication.name)
+                .order_by(func.count().desc())
+            )
+            return [[name, count] for name, count in result.all()]
+    except Exception as e:
+        logger.error(f"Error counting medications for month: {e}")
+        return []
+
+
 def generate_calendar_markup(
     month: int, year: int, marks: dict
 ) -> InlineKeyboardMarkup:
@@ -1,114 +1,198 @@
 import asyncio
+from datetime import datetime, time, timedelta
+from typing import Optional
 
 from aiogram import Bot
 from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import BaseStorage, StorageKey
+from apscheduler.events import EVENT_JOB_ERROR
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from sqlalchemy import and_, or_, select, text
 import pytz
-from datetime import datetime
 import logging
 from handlers.registration_handler import start_survey
-from services.database.models import User
+from services.database import User
+from services.database.leader import FENCE_SQL, NotLeaderError, leader
+from services.workers import ChatRing, send_to_worker
+from utils.config import WORKER_INDEX
+from utils.datetime_utils import get_current_time_in_almaty_naive
 
 logger = logging.getLogger(__name__)
 
+# Сколько минут назад новый ведущий проверяет пропущенные напоминания
+REMINDER_CATCH_UP = timedelta(minutes=5)
+# Сколько опросов запускается одновременно
+REMINDER_CONCURRENCY = 20
 
-async def log_current_state(state):
-    current_state = await state.get_state()
-    logger.info(f"Current state after job execution: {current_state}")
+CLAIM_REMINDER_SQL = f"""
+INSERT INTO reminder_deliveries (userid, remind_at, epoch, sent_at)
+SELECT :userid, :remind_at, :epoch, localtimestamp WHERE {FENCE_SQL}
+ON CONFLICT DO NOTHING
+RETURNING userid
+"""
 
 
-from apscheduler.events import EVENT_JOB_EXECUTED, EVENT_JOB_ERROR
+def job_listener(event):
+    logger.error(f"Job {event.job_id} failed: {event.exception}")
 
 
-def job_listener(event, state):
-    if event.exception:
-        logger.error(f"Job {event.job_id} failed")
-    else:
-        logger.info(f"Job {event.job_id} executed successfully")
-        # Логирование текущего состояния после завершения задания
-        loop = asyncio.get_event_loop()
-        loop.create_task(log_current_state(state))
+class ReminderManager:
+    """
+    Sends the daily survey reminders; a leader duty.
 
+    Every minute the users whose reminder time came since the previous
+    tick are read from the database, so a reminder time set on any
+    instance is picked up and survives restarts. Each reminder is claimed
+    in reminder_deliveries with a fenced insert before it is sent: once
+    per user and time, and never by a deposed leader.
 
-class ReminderManager:
-    def __init__(self, database, bot: Bot, state: FSMContext):
+    With several workers the survey is started by the worker owning the
+    user's chat, where the user's FSM state lives.
+    """
+
+    def __init__(
+        self,
+        database,
+        bot: Bot,
+        storage: BaseStorage,
+        ring: Optional[ChatRing] = None,
+    ):
         self.database = database
         self.bot = bot
+        self.storage = storage
+        self.ring = ring
         self.scheduler = AsyncIOScheduler(
             timezone=pytz.timezone("Asia/Almaty")
         )
-        self.scheduler.add_listener(
-            lambda event: job_listener(event, state),
-            EVENT_JOB_EXECUTED | EVENT_JOB_ERROR,
-        )
-        self.scheduler.start()
-        self.state = state
-
-    async def schedule_reminder(self, user_id, reminder_time):
-        job_id = f"reminder_{user_id}"
-        # Удаление существующего задания, если оно есть
-        existing_job = self.scheduler.get_job(job_id)
-        if existing_job:
-            self.scheduler.remove_job(job_id)
-            logger.info(
-                f"Scheduled reminder for user {user_id} at {reminder_time} is deleted"
-            )
+        self.scheduler.add_listener(job_listener, EVENT_JOB_ERROR)
+        self._last_tick: Optional[datetime] = None
+        self._semaphore = asyncio.Semaphore(REMINDER_CONCURRENCY)
+        self._catch_up: Optional[asyncio.Task] = None
 
+    def start(self) -> None:
+        self._last_tick = _minute(
+            get_current_time_in_almaty_naive() - REMINDER_CATCH_UP
+        )
         self.scheduler.add_job(
-            self.send_reminder,
+            self.send_due_reminders,
             "cron",
-            hour=reminder_time.hour,
-            minute=reminder_time.minute,
-            id=job_id,
-            args=[user_id],
+            second=0,
+            id="reminders",
+            coalesce=True,
+            max_instances=1,
+            replace_existing=True,
         )
-        logger.info(
-            f"Scheduled reminder for user {user_id} at {reminder_time}"
+        self.scheduler.start()
+        # Пропущенные при смене ведущего — сразу
+        self._catch_up = asyncio.create_task(self.send_due_reminders())
+        logger.info("Reminder scheduler started")
+
+    async def stop(self) -> None:
+        if self._catch_up:
+            self._catch_up.cancel()
+            try:
+                await self._catch_up
+            except asyncio.CancelledError:
+                pass
+            except Exception as e:
+                logger.error(f"Reminder catch-up failed: {e}")
+            self._catch_up = None
+        if self.scheduler.running:
+            self.scheduler.shutdown(wait=False)
+            logger.info("Reminder scheduler stopped")
+
+    async def send_due_reminders(self) -> None:
+        now = _minute(get_current_time_in_almaty_naive())
+        since, self._last_tick = self._last_tick, now
+        if since is None or since >= now:
+            return
+        due = await self._due_users(since, now)
+        if due:
+            logger.info(f"Sending {len(due)} reminders due by {now}")
+        await asyncio.gather(
+            *(self.send_reminder(user_id, at) for user_id, at in due)
         )
 
-    async def send_reminder(self, user_id):
-        try:
-            user = await self.database.get_entity_parameter(
-                model_class=User, filters={"userid": user_id}
+    async def _due_users(
+        self, since: datetime, until: datetime
+    ) -> list[tuple[int, datetime]]:
+        """
+        Users with a reminder time in (since, until], with the moment the
+        reminder was due.
+        """
+        start, end = since.time(), until.time()
+        if since.date() == until.date():
+            window = and_(
+                User.reminder_time > start, User.reminder_time <= end
             )
-            if user:
-                now = datetime.now(pytz.timezone("Asia/Almaty"))
-                reminder_time = await self.database.get_entity_parameter(
-                    model_class=User,
-                    filters={"userid": user_id},
-                    parameter="reminder_time",
+        else:
+            # Окно переходит через полночь
+            window = or_(User.reminder_time > start, User.reminder_time <= end)
+        async with self.database.Session() as session:
+            result = await session.execute(
+                select(User.userid, User.reminder_time).where(
+                    User.reminder_time.is_not(None), window
                 )
-                if (
-                    reminder_time
-                    and now.time() >= reminder_time
-                    and (
-                        now.time().hour == reminder_time.hour
-                        and now.time().minute == reminder_time.minute
-                    )
-                ):
-                    await self.bot.send_message(
-                        user_id,
-                        "Пора пройти ежедневный опрос.\n Одну секундочку...",
-                    )
-                    # Запускаем процесс опроса
-                    await start_survey(
-                        state=self.state,
-                        bot=self.bot,
-                        user_id=user_id,
+            )
+            rows = result.all()
+        return [
+            (
+                userid,
+                datetime.combine(
+                    until.date() if at <= end else since.date(), _floor(at)
+                ),
+            )
+            for userid, at in rows
+        ]
+
+    async def _claim(self, user_id: int, remind_at: datetime) -> bool:
+        async with self.database.engine.begin() as connection:
+            result = await connection.execute(
+                text(CLAIM_REMINDER_SQL),
+                {"userid": user_id, "remind_at": remind_at, **leader.fence()},
+            )
+            return result.first() is not None
+
+    async def send_reminder(self, user_id: int, remind_at: datetime):
+        async with self._semaphore:
+            try:
+                if not await self._claim(user_id, remind_at):
+                    return
+                owner = self.ring.owner(user_id) if self.ring else None
+                if owner is None or owner == WORKER_INDEX:
+                    await self.deliver(user_id)
+                    return
+                status = await send_to_worker(
+                    owner, "/internal/reminder", {"user_id": user_id}
+                )
+                if status != 200:
+                    logger.error(
+                        f"Worker {owner} failed reminder of user {user_id} "
+                        f"with HTTP status {status}"
                     )
-                    # Обновляем состояние после отправки сообщения
-                    # from states.states import Form
-                    #
-                    # await self.state.set_state(Form.waiting_for_voice)
-                    # logger.info("State updated to Form.waiting_for_voice")
-                    # current_state = await self.state.get_state()
-                    # logger.info(
-                    #     f"Current state in Send reminder: {current_state}"
-                    # )
-        except Exception as e:
-            logger.error(f"Error sending reminder: {e}")
-
-    async def cancel_reminder(self, user_id):
-        job_id = f"reminder_{user_id}"
-        self.scheduler.remove_job(job_id)
-        logger.info(f"Cancelled reminder for user {user_id}")
+            except NotLeaderError:
+                logger.warning(f"Reminder for user {user_id} left to leader")
+            except Exception as e:
+                logger.error(f"Error sending reminder: {e}")
+
+    async def deliver(self, user_id: int) -> None:
+        await self.bot.send_message(
+            user_id,
+            "Пора пройти ежедневный опрос.\n Одну секундочку...",
+        )
+        state = FSMContext(
+            storage=self.storage,
+            key=StorageKey(
+                bot_id=self.bot.id, chat_id=user_id, user_id=user_id
+            ),
+        )
+        # Запускаем процесс опроса
+        await start_survey(state=state, bot=self.bot, user_id=user_id)
+
+
+def _minute(value: datetime) -> datetime:
+    return value.replace(second=0, microsecond=0)
+
+
+def _floor(value: time) -> time:
+    return value.replace(second=0, microsecond=0)
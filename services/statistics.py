@@ -1,170 +1,204 @@
-import pandas as pd
+from datetime import date
 from io import BytesIO
-import aiofiles
+from itertools import groupby
 import locale
 from babel.dates import format_date
+from xlsxwriter import Workbook
+
+from services.medications import medication_flag, medication_index
+from services.report_pool import report_pool
 
 # Устанавливаем локаль на русскую
 locale.setlocale(locale.LC_TIME, "ru_RU.UTF-8")
 
 
-async def generate_statistics_file(user_records, user_info, user_id):
-    # Фильтруем записи по user_id
-    user_records = [record for record in user_records if record.userid == user_id]
-    user_info = [record for record in user_info if record.userid == user_id]
-
-    # Подготавливаем данные для DataFrame с записями
-    data = [
-        {
-            "Номер": record.survey_id,
-            "Дата создания": record.created_at.strftime("%Y-%m-%d %H:%M"),
-            "Дата обновления": record.updated_at.strftime("%Y-%m-%d %H:%M"),
-            "Головная боль сегодня": record.headache_today,
-            "Принимали ли медикаменты": record.medicament_today,
-            "Интенсивность боли": record.pain_intensity,
-            "Область боли": record.pain_area,
-            "Детали области": record.area_detail,
-            "Тип боли": record.pain_type,
-            "Комментарии": record.comments,
-        }
-        for record in user_records
+SURVEY_COLUMNS = (
+    "Номер",
+    "Дата создания",
+    "Дата обновления",
+    "Головная боль сегодня",
+    "Принимали ли медикаменты",
+    "Интенсивность боли",
+    "Область боли",
+    "Детали области",
+    "Тип боли",
+    "Комментарии",
+    "Лекарство по словарю",
+)
+
+USER_COLUMNS = (
+    "ID Пользователя",
+    "Имя пользователя в Telegram",
+    "Имя",
+    "Фамилия",
+    "ФИО",
+    "Дата рождения",
+    "Менструальный цикл",
+    "Страна",
+    "Город",
+    "Медикаменты",
+    "Постоянные медикаменты",
+    "Название постоянных медикаментов",
+    "Время напоминания",
+    "Дата создания",
+)
+
+
+def survey_rows(user_records) -> list[tuple]:
+    """
+    Convert Survey entities to plain tuples in SURVEY_COLUMNS order,
+    sorted by month of creation, newest month first.
+    """
+    records = sorted(
+        user_records,
+        key=lambda record: (record.created_at.year, record.created_at.month),
+        reverse=True,
+    )
+    return [
+        (
+            record.survey_id,
+            record.created_at.replace(second=0, microsecond=0),
+            record.updated_at.strftime("%Y-%m-%d %H:%M"),
+            record.headache_today,
+            record.medicament_today,
+            record.pain_intensity,
+            record.pain_area,
+            record.area_detail,
+            record.pain_type,
+            record.comments,
+            (
+                medication_index.canonicalize(record.medicament_today)
+                if medication_flag(record.medicament_today)
+                else None
+            ),
+        )
+        for record in records
     ]
 
-    # Создаем DataFrame для записей
-    df_records = pd.DataFrame(data)
-
-    # Создаем DataFrame для данных пользователя
-    user_data = [
-        {
-            "ID Пользователя": record.userid,
-            "Имя пользователя в Telegram": record.username,
-            "Имя": record.firstname,
-            "Фамилия": record.lastname,
-            "ФИО": record.fio,
-            "Дата рождения": (
+
+def user_rows(user_info) -> list[tuple]:
+    """
+    Convert User entities to plain tuples in USER_COLUMNS order.
+    """
+    return [
+        (
+            record.userid,
+            record.username,
+            record.firstname,
+            record.lastname,
+            record.fio,
+            (
                 record.birthdate.strftime("%Y-%m-%d")
                 if record.birthdate
                 else None
             ),
-            "Менструальный цикл": record.menstrual_cycle,
-            "Страна": record.country,
-            "Город": record.city,
-            "Медикаменты": record.medication,
-            "Постоянные медикаменты": record.const_medication,
-            "Название постоянных медикаментов": record.const_medication_name,
-            "Время напоминания": (
+            record.menstrual_cycle,
+            record.country,
+            record.city,
+            record.medication,
+            record.const_medication,
+            record.const_medication_name,
+            (
                 record.reminder_time.strftime("%H:%M:%S")
                 if record.reminder_time
                 else None
             ),
-            "Дата создания": record.created_at.strftime("%Y-%m-%d"),
-        }
+            record.created_at.strftime("%Y-%m-%d"),
+        )
         for record in user_info
     ]
-    df_user = pd.DataFrame(user_data)
 
-    # Сохраняем DataFrame в Excel файл на одном листе
-    excel_buffer = BytesIO()
-    with pd.ExcelWriter(excel_buffer, engine="xlsxwriter") as writer:
-        # Записываем данные пользователя
-        df_user.to_excel(
-            writer, sheet_name="Statistics", index=False, startrow=0
-        )
 
-        # Получаем workbook и worksheet для форматирования
-        workbook = writer.book
-        worksheet = writer.sheets["Statistics"]
+async def generate_statistics_file(user_records, user_info) -> bytes:
+    """
+    Build the statistics workbook of one user in the report process pool.
+
+    :param user_records: Survey entities of the user.
+    :param user_info: User entities (the user's profile).
+
+    :return: XLSX file contents.
+    """
+    return await report_pool.run(
+        render_statistics, survey_rows(user_records), user_rows(user_info)
+    )
 
-        # Форматирование заголовков таблицы пользователя
-        header_format = workbook.add_format(
-            {"bold": True, "bg_color": "#C6EFCE", "border": 2}
+
+def _month_key(row: tuple) -> tuple[int, int]:
+    return row[1].year, row[1].month
+
+
+def _write_row(worksheet, row_num: int, values: tuple, date_format) -> None:
+    for col_num, value in enumerate(values):
+        if value is None:
+            continue
+        if col_num == 1 and hasattr(value, "year"):
+            worksheet.write_datetime(row_num, col_num, value, date_format)
+        else:
+            worksheet.write(row_num, col_num, value)
+
+
+def render_statistics(records: list[tuple], users: list[tuple]) -> bytes:
+    """
+    Render the workbook; runs in a worker process.
+
+    Rows are streamed in constant-memory mode, so ``records`` must already
+    be grouped by month, newest first, as survey_rows returns them.
+    """
+    excel_buffer = BytesIO()
+    workbook = Workbook(excel_buffer, {"constant_memory": True})
+    worksheet = workbook.add_worksheet("Statistics")
+
+    header_format = workbook.add_format(
+        {"bold": True, "bg_color": "#C6EFCE", "border": 2}
+    )
+    user_format = workbook.add_format({"bg_color": "#C6EFCE", "border": 2})
+    survey_format = workbook.add_format({"bg_color": "#DDEBF7", "border": 2})
+    bold_format = workbook.add_format({"bold": True})
+    date_format = workbook.add_format({"num_format": "yyyy-mm-dd hh:mm:ss"})
+
+    # Таблица пользователя
+    worksheet.write_row(0, 0, USER_COLUMNS, header_format)
+    for row_num, user in enumerate(users, start=1):
+        _write_row(worksheet, row_num, user, date_format)
+    worksheet.conditional_format(
+        1,
+        0,
+        len(users),
+        len(USER_COLUMNS) - 1,
+        {"type": "no_errors", "format": user_format},
+    )
+
+    # Ширина колонок по содержимому таблицы пользователя
+    for col_num, column in enumerate(USER_COLUMNS):
+        column_width = (
+            max([len(column)] + [len(str(user[col_num])) for user in users])
+            + 2
         )
-        for col_num, value in enumerate(df_user.columns.values):
-            worksheet.write(0, col_num, value, header_format)
+        worksheet.set_column(col_num, col_num, column_width)
+
+    # Опросы по месяцам, строки пишутся строго сверху вниз
+    start_row = len(users) + 2
+    for (year, month), month_rows in groupby(records, key=_month_key):
+        month_name = format_date(
+            date(year, month, 1), "LLLL yyyy", locale="ru"
+        ).capitalize()
+        worksheet.write(start_row, 0, month_name, bold_format)
+        start_row += 1
+
+        worksheet.write_row(start_row, 0, SURVEY_COLUMNS, header_format)
+        end_row = start_row
+        for row in month_rows:
+            end_row += 1
+            _write_row(worksheet, end_row, row, date_format)
 
-        # Форматирование таблицы пользователя
-        user_rows = len(df_user)
-        user_format = workbook.add_format({"bg_color": "#C6EFCE", "border": 2})
         worksheet.conditional_format(
-            1,
+            start_row + 1,
             0,
-            user_rows,
-            len(df_user.columns) - 1,
-            {
-                "type": "no_errors",
-                "format": user_format,
-            },
+            end_row,
+            len(SURVEY_COLUMNS) - 1,
+            {"type": "no_errors", "format": survey_format},
         )
+        start_row = end_row + 3  # Добавляем отступ между таблицами
 
-        # Записываем данные опросов по месяцам
-        df_records["Дата создания"] = pd.to_datetime(
-            df_records["Дата создания"], format="%Y-%m-%d %H:%M"
-        )
-        months = (
-            df_records["Дата создания"]
-            .dt.to_period("M")
-            .sort_values(ascending=False)
-            .unique()
-        )
-        start_row = user_rows + 2
-
-        for month in months:
-            month_data = df_records[
-                df_records["Дата создания"].dt.to_period("M") == month
-            ]
-
-            # Пишем название месяца и года в именительном падеже с большой буквы и жирным шрифтом
-            month_name = format_date(
-                month.start_time, "LLLL yyyy", locale="ru"
-            ).capitalize()
-            bold_format = workbook.add_format({"bold": True})
-            worksheet.write(start_row, 0, month_name, bold_format)
-            start_row += 1
-
-            # Пишем данные за месяц
-            month_data.to_excel(
-                writer,
-                sheet_name="Statistics",
-                index=False,
-                startrow=start_row,
-            )
-
-            # Форматирование заголовков таблицы опросов
-            for col_num, value in enumerate(month_data.columns.values):
-                worksheet.write(start_row, col_num, value, header_format)
-
-            # Форматирование таблицы опросов
-            end_row = start_row + len(month_data)
-            survey_format = workbook.add_format(
-                {"bg_color": "#DDEBF7", "border": 2}
-            )
-            worksheet.conditional_format(
-                start_row + 1,
-                0,
-                end_row,
-                len(month_data.columns) - 1,
-                {
-                    "type": "no_errors",
-                    "format": survey_format,
-                },
-            )
-
-            start_row = end_row + 3  # Добавляем отступ между таблицами
-
-        # Автоматическая подгонка ширины колонок под содержимое
-        for column in df_user.columns:
-            column_width = (
-                max(df_user[column].astype(str).map(len).max(), len(column))
-                + 2
-            )
-            col_idx = df_user.columns.get_loc(column)
-            worksheet.set_column(col_idx, col_idx, column_width)
-
-    excel_buffer.seek(0)
-
-    # Сохраняем в временный файл для отправки
-    temp_file_path = "temp_statistics.xlsx"
-    async with aiofiles.open(temp_file_path, "wb") as f:
-        await f.write(excel_buffer.read())
-
-    return temp_file_path
+    workbook.close()
+    return excel_buffer.getvalue()
@@ -0,0 +1,417 @@
+import asyncio
+import functools
+import logging
+import os
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Iterator, Optional
+
+from services.http_clients import http_clients
+from utils.config import (
+    TRACING_EXPORTERS,
+    TRACING_OTLP_ENDPOINT,
+    TRACING_RING_SIZE,
+    TRACING_SLOW_THRESHOLD,
+)
+
+logger = logging.getLogger(__name__)
+
+SERVICE_NAME = "em-guide-bot"
+
+
+class Span:
+    __slots__ = (
+        "trace",
+        "span_id",
+        "parent_id",
+        "name",
+        "attributes",
+        "start_ns",
+        "end_ns",
+        "error",
+        "_started",
+        "duration",
+    )
+
+    def __init__(
+        self,
+        trace: "Trace",
+        name: str,
+        parent_id: Optional[str],
+        attributes: dict,
+    ):
+        self.trace = trace
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = attributes
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.error: Optional[str] = None
+        self._started = time.perf_counter()
+        self.duration: Optional[float] = None
+
+    def set(self, **attributes) -> None:
+        self.attributes.update(attributes)
+
+    def finish(self) -> None:
+        self.duration = time.perf_counter() - self._started
+        self.end_ns = self.start_ns + int(self.duration * 1e9)
+
+    def to_dict(self) -> dict:
+        return {
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start_ns / 1e9,
+            "duration_ms": (
+                round(self.duration * 1000, 2)
+                if self.duration is not None
+                else None
+            ),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+class Trace:
+    """
+    All spans of one Telegram update.
+    """
+
+    __slots__ = ("trace_id", "update_id", "spans", "root")
+
+    def __init__(self, update_id: Optional[int]):
+        self.trace_id = os.urandom(16).hex()
+        self.update_id = update_id
+        self.spans: list[Span] = []
+        self.root: Optional[Span] = None
+
+    def critical_path(self) -> list[Span]:
+        """
+        Chain of spans from the root that finished last at every level,
+        i.e. the spans that actually determined the turn duration.
+        """
+        children: dict[Optional[str], list[Span]] = {}
+        for span in self.spans:
+            if span.end_ns is not None:
+                children.setdefault(span.parent_id, []).append(span)
+        path = []
+        current = self.root
+        while current is not None:
+            path.append(current)
+            candidates = children.get(current.span_id)
+            current = (
+                max(candidates, key=lambda s: s.end_ns) if candidates else None
+            )
+        return path
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "update_id": self.update_id,
+            "duration_ms": (
+                self.root.to_dict()["duration_ms"] if self.root else None
+            ),
+            "critical_path": [span.name for span in self.critical_path()],
+            "spans": [span.to_dict() for span in self.spans],
+        }
+
+
+_current_span: ContextVar[Optional[Span]] = ContextVar(
+    "current_span", default=None
+)
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def current_update_id() -> Optional[int]:
+    span = _current_span.get()
+    return span.trace.update_id if span else None
+
+
+class LogExporter:
+    """
+    Logs one line per trace; slow traces are logged with the critical path.
+    """
+
+    def export(self, trace: Trace) -> None:
+        duration = trace.root.duration
+        if duration >= TRACING_SLOW_THRESHOLD:
+            path = " > ".join(
+                f"{span.name} {span.duration * 1000:.0f}ms"
+                for span in trace.critical_path()
+            )
+            logger.warning(
+                f"Slow update {trace.update_id} took {duration:.2f}s, "
+                f"critical path: {path}"
+            )
+        else:
+            logger.debug(
+                f"Update {trace.update_id} took {duration:.2f}s "
+                f"in {len(trace.spans)} spans"
+            )
+
+
+class RingBufferExporter:
+    """
+    Keeps the latest traces in memory for the /debug/traces endpoint.
+    """
+
+    def __init__(self, size: int):
+        self.traces: deque[Trace] = deque(maxlen=size)
+
+    def export(self, trace: Trace) -> None:
+        self.traces.append(trace)
+
+    def find(self, trace_id: str) -> Optional[Trace]:
+        for trace in self.traces:
+            if trace.trace_id == trace_id:
+                return trace
+        return None
+
+
+def _otlp_value(value: Any) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class OtlpExporter:
+    """
+    Sends traces to an OpenTelemetry collector over OTLP/HTTP JSON.
+
+    Export only queues the trace; a background task posts batches so the
+    update handling never waits on the collector.
+    """
+
+    def __init__(
+        self,
+        endpoint: str,
+        flush_interval: float = 5.0,
+        max_queue: int = 2000,
+    ):
+        self.endpoint = endpoint
+        self.flush_interval = flush_interval
+        self._queue: deque[Trace] = deque(maxlen=max_queue)
+        self._task: Optional[asyncio.Task] = None
+
+    def export(self, trace: Trace) -> None:
+        self._queue.append(trace)
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self) -> None:
+        if not self._queue:
+            return
+        traces = list(self._queue)
+        self._queue.clear()
+        try:
+            session = http_clients.session("otlp")
+            async with session.post(
+                self.endpoint, json=self._payload(traces)
+            ) as response:
+                if response.status >= 400:
+                    logger.warning(
+                        f"OTLP export failed: HTTP status {response.status}"
+                    )
+        except Exception as e:
+            logger.warning(f"OTLP export failed: {e}")
+
+    @staticmethod
+    def _payload(traces: list[Trace]) -> dict:
+        spans = []
+        for trace in traces:
+            for span in trace.spans:
+                if span.end_ns is None:
+                    continue
+                item = {
+                    "traceId": trace.trace_id,
+                    "spanId": span.span_id,
+                    "name": span.name,
+                    "kind": 1,
+                    "startTimeUnixNano": str(span.start_ns),
+                    "endTimeUnixNano": str(span.end_ns),
+                    "attributes": [
+                        {"key": key, "value": _otlp_value(value)}
+                        for key, value in span.attributes.items()
+                    ],
+                }
+                if span.parent_id:
+                    item["parentSpanId"] = span.parent_id
+                if span.error:
+                    item["status"] = {"code": 2, "message": span.error}
+                spans.append(item)
+        return {
+            "resourceSpans": [
+                {
+                    "resource": {
+                        "attributes": [
+                            {
+                                "key": "service.name",
+                                "value": {"stringValue": SERVICE_NAME},
+                            }
+                        ]
+                    },
+                    "scopeSpans": [
+                        {"scope": {"name": __name__}, "spans": spans}
+                    ],
+                }
+            ]
+        }
+
+
+class Tracer:
+    def __init__(self, exporters: list):
+        self.exporters = exporters
+        self.ring: Optional[RingBufferExporter] = next(
+            (e for e in exporters if isinstance(e, RingBufferExporter)), None
+        )
+
+    def start(self) -> None:
+        for exporter in self.exporters:
+            if hasattr(exporter, "start"):
+                exporter.start()
+
+    async def stop(self) -> None:
+        for exporter in self.exporters:
+            if hasattr(exporter, "stop"):
+                await exporter.stop()
+
+    def export(self, trace: Trace) -> None:
+        for exporter in self.exporters:
+            try:
+                exporter.export(trace)
+            except Exception as e:
+                logger.error(f"Trace export failed: {e}")
+
+
+def _build_exporters(names: str) -> list:
+    exporters = []
+    for name in filter(None, (n.strip() for n in names.split(","))):
+        if name == "log":
+            exporters.append(LogExporter())
+        elif name == "ring":
+            exporters.append(RingBufferExporter(TRACING_RING_SIZE))
+        elif name == "otlp":
+            exporters.append(OtlpExporter(TRACING_OTLP_ENDPOINT))
+        else:
+            logger.warning(f"Unknown trace exporter '{name}' ignored")
+    return exporters
+
+
+tracer = Tracer(_build_exporters(TRACING_EXPORTERS))
+
+
+@contextmanager
+def start_trace(name: str, update_id: Optional[int] = None, **attributes):
+    """
+    Open the root span of an update; the trace is exported when it closes.
+    """
+    trace = Trace(update_id)
+    if update_id is not None:
+        attributes["update_id"] = update_id
+    root = Span(trace, name, None, attributes)
+    trace.root = root
+    trace.spans.append(root)
+    token = _current_span.set(root)
+    try:
+        yield root
+    except BaseException as e:
+        root.error = repr(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        root.finish()
+        tracer.export(trace)
+
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[Optional[Span]]:
+    """
+    Child span of the current one; does nothing outside of a trace.
+    """
+    parent = _current_span.get()
+    if parent is None:
+        yield None
+        return
+    child = Span(parent.trace, name, parent.span_id, attributes)
+    parent.trace.spans.append(child)
+    token = _current_span.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.error = repr(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        child.finish()
+
+
+def traced(prefix: str):
+    """
+    Wrap a coroutine function into a span named ``prefix.<function>``.
+    """
+
+    def decorator(func):
+        name = f"{prefix}.{func.__name__}"
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with span(name):
+                return await func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class TraceContextFilter(logging.Filter):
+    """
+    Adds ``update_id`` and ``trace_id`` of the current update to records.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        current = _current_span.get()
+        record.update_id = current.trace.update_id if current else "-"
+        record.trace_id = current.trace.trace_id if current else "-"
+        return True
+
+
+def install_log_correlation() -> None:
+    """
+    Attach TraceContextFilter to the root handlers and prefix log lines
+    with the update id.
+    """
+    formatter = logging.Formatter(
+        "%(asctime)s %(levelname)s [update %(update_id)s] "
+        "%(name)s: %(message)s"
+    )
+    for handler in logging.getLogger().handlers:
+        handler.addFilter(TraceContextFilter())
+        handler.setFormatter(formatter)
@@ -0,0 +1,183 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Optional
+
+from services.metrics import register_collected
+from utils.config import TURN_CONCURRENCY_MODE, TURN_LOCK_SHARDS
+from utils.deadline import DeadlineExceeded, remaining_time
+
+logger = logging.getLogger(__name__)
+
+SERIALIZE = "serialize"
+COALESCE = "coalesce"
+CANCEL = "cancel"
+
+
+class TurnSuperseded(Exception):
+    """
+    Raised in a turn whose LLM run was cancelled by a newer message.
+    """
+
+
+class _UserTurn:
+    __slots__ = (
+        "lock",
+        "waiters",
+        "holder",
+        "pending_texts",
+        "llm_task",
+        "superseded",
+    )
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.waiters = 0
+        self.holder: Optional[asyncio.Task] = None
+        self.pending_texts: list[str] = []
+        self.llm_task: Optional[asyncio.Task] = None
+        self.superseded = False
+
+
+class UserTurns:
+    """
+    Serializes conversational turns per user.
+
+    Only one turn per user talks to the assistant thread at a time. Entries
+    live in sharded dicts and are dropped as soon as nobody holds or waits
+    for them, so memory is bounded by the number of users mid-turn.
+
+    Modes:
+    - ``serialize``: later messages wait for the running turn;
+    - ``coalesce``: messages that arrive while a turn runs are merged into
+      one LLM turn;
+    - ``cancel``: a new message cancels the in-flight LLM run and the new
+      turn answers instead.
+    """
+
+    def __init__(self, mode: str = SERIALIZE, shards: int = 64):
+        self.mode = mode
+        self._shards: list[dict[int, _UserTurn]] = [{} for _ in range(shards)]
+        self.acquired = 0
+        self.contended = 0
+        self.coalesced = 0
+        self.superseded = 0
+
+    def _shard(self, user_id: int) -> dict[int, _UserTurn]:
+        return self._shards[hash(user_id) % len(self._shards)]
+
+    async def acquire(self, user_id: int, text: str) -> Optional[str]:
+        """
+        Wait for the user's turn.
+
+        :return: Text to send to the assistant, or None when the message
+        was merged into a turn that already took it.
+        """
+        shard = self._shard(user_id)
+        entry = shard.get(user_id)
+        if entry is None:
+            entry = shard[user_id] = _UserTurn()
+
+        entry.waiters += 1
+        if entry.lock.locked():
+            self.contended += 1
+            logger.info(f"Turn contention for user {user_id}")
+            if (
+                self.mode == CANCEL
+                and not entry.superseded
+                and entry.llm_task
+                and not entry.llm_task.done()
+            ):
+                entry.superseded = True
+                entry.llm_task.cancel()
+                self.superseded += 1
+
+        if self.mode == COALESCE:
+            entry.pending_texts.append(text)
+
+        remaining = remaining_time()
+        try:
+            if remaining is None:
+                await entry.lock.acquire()
+            else:
+                await asyncio.wait_for(entry.lock.acquire(), max(remaining, 0))
+        except BaseException as e:
+            if text in entry.pending_texts:
+                entry.pending_texts.remove(text)
+            self._leave(user_id, entry)
+            if isinstance(e, asyncio.TimeoutError):
+                raise DeadlineExceeded("turn_lock") from None
+            raise
+        entry.holder = asyncio.current_task()
+        entry.superseded = False
+        self.acquired += 1
+
+        if self.mode != COALESCE:
+            return text
+        texts, entry.pending_texts = entry.pending_texts, []
+        if not texts:
+            return None
+        if len(texts) > 1:
+            self.coalesced += len(texts) - 1
+            logger.info(f"Coalesced {len(texts)} messages of user {user_id}")
+        return "\n".join(texts)
+
+    def release(self, user_id: int) -> None:
+        """
+        Release the turn if the current task holds it, otherwise do nothing.
+        """
+        entry = self._shard(user_id).get(user_id)
+        if entry is None or entry.holder is not asyncio.current_task():
+            return
+        entry.holder = None
+        entry.llm_task = None
+        entry.lock.release()
+        self._leave(user_id, entry)
+
+    def _leave(self, user_id: int, entry: _UserTurn) -> None:
+        entry.waiters -= 1
+        if entry.waiters == 0:
+            self._shard(user_id).pop(user_id, None)
+
+    async def run_llm(self, user_id: int, awaitable: Awaitable[Any]) -> Any:
+        """
+        Run the LLM call of the held turn so a newer message can cancel it.
+        """
+        entry = self._shard(user_id).get(user_id)
+        task = asyncio.ensure_future(awaitable)
+        if entry is not None:
+            entry.llm_task = task
+        try:
+            return await task
+        except asyncio.CancelledError:
+            if entry is not None and entry.superseded and task.cancelled():
+                raise TurnSuperseded() from None
+            task.cancel()
+            raise
+
+    def stats(self) -> dict:
+        return {
+            "mode": self.mode,
+            "active_users": sum(len(shard) for shard in self._shards),
+            "acquired": self.acquired,
+            "contended": self.contended,
+            "coalesced": self.coalesced,
+            "superseded": self.superseded,
+        }
+
+
+user_turns = UserTurns(mode=TURN_CONCURRENCY_MODE, shards=TURN_LOCK_SHARDS)
+
+register_collected(
+    "bot_user_turns_active",
+    "Users with a turn in progress or waiting",
+    lambda: [({}, user_turns.stats()["active_users"])],
+)
+register_collected(
+    "bot_user_turns_total",
+    "Conversational turn events",
+    lambda: [
+        ({"event": event}, user_turns.stats()[event])
+        for event in ("acquired", "contended", "coalesced", "superseded")
+    ],
+    kind="counter",
+)
@@ -0,0 +1,133 @@
+import asyncio
+import logging
+from typing import Optional
+
+from aiogram import Bot
+from aiogram.types import BufferedInputFile, Message
+
+from services.metrics import cache_requests
+from services.resilience import get_dependency
+from services.yandex_service import synthesize_speech
+from utils.deadline import (
+    DeadlineExceeded,
+    record_exhausted,
+    run_stage,
+    turn_deadline,
+)
+
+logger = logging.getLogger(__name__)
+
+TRY_AGAIN_TEXT = {
+    "ru": "Не удалось вовремя обработать сообщение. Попробуйте ещё раз.",
+    "kk": "Хабарламаны уақытында өңдеу мүмкін болмады. Қайталап көріңізші.",
+}
+
+TRY_AGAIN_SYNTHESIS_TIMEOUT = 15
+
+# Озвученный ответ «попробуйте ещё раз»: сначала байты, затем file_id
+_try_again_audio: dict[str, bytes] = {}
+_try_again_file_ids: dict[str, str] = {}
+_background_tasks: set = set()
+
+
+async def send_voice_reply(
+    text: str,
+    lang_code: str,
+    message: Optional[Message] = None,
+    bot: Optional[Bot] = None,
+    chat_id: Optional[int] = None,
+) -> Message:
+    """
+    Send ``text`` as a voice message with the text as caption.
+
+    When TTS is open-circuited or synthesis fails the reply degrades to a
+    plain text message instead of failing the whole turn.
+
+    :param text: Reply text, already in the user's language.
+    :param lang_code: Language code for the TTS voice.
+    :param message: Message to answer to.
+    :param bot: Bot used together with ``chat_id`` when there is no message.
+    :param chat_id: Chat to send to when there is no message.
+
+    :return: The sent message.
+    """
+    audio_response_bytes = None
+    if get_dependency("yandex_tts").is_open:
+        logger.warning("TTS circuit is open, replying with text only")
+    else:
+        try:
+            logger.info("Generating speech audio with TTS API")
+            audio_response_bytes = await run_stage(
+                "tts", synthesize_speech(text, lang_code=lang_code)
+            )
+            logger.info("Generated speech audio")
+        except DeadlineExceeded as e:
+            # Ответ уже готов — отправим его хотя бы текстом
+            record_exhausted(e.stage)
+        except Exception as e:
+            logger.error(f"TTS failed, replying with text only: {e}")
+
+    if audio_response_bytes is None:
+        if message:
+            return await message.answer(text)
+        return await bot.send_message(chat_id=chat_id, text=text)
+
+    voice = BufferedInputFile(audio_response_bytes, filename="response.mp3")
+    if message:
+        return await run_stage(
+            "upload", message.answer_voice(voice=voice, caption=text)
+        )
+    return await run_stage(
+        "upload", bot.send_voice(chat_id=chat_id, voice=voice, caption=text)
+    )
+
+
+async def _synthesize_try_again(lang_code: str) -> None:
+    # Задача унаследовала истёкший бюджет хода, задаём собственный
+    try:
+        with turn_deadline(TRY_AGAIN_SYNTHESIS_TIMEOUT):
+            _try_again_audio[lang_code] = await synthesize_speech(
+                TRY_AGAIN_TEXT[lang_code], lang_code=lang_code
+            )
+    except Exception as e:
+        logger.error(f"Failed to synthesize try again reply: {e}")
+
+
+async def send_try_again_reply(message: Message, lang_code: str) -> Message:
+    """
+    Short "try again" reply for turns that ran out of time.
+
+    The audio is synthesized once in the background and afterwards sent by
+    its Telegram file_id, so this reply never waits on TTS.
+    """
+    if lang_code not in TRY_AGAIN_TEXT:
+        lang_code = "ru"
+    text = TRY_AGAIN_TEXT[lang_code]
+
+    try:
+        file_id = _try_again_file_ids.get(lang_code)
+        cache_requests.inc(
+            cache="try_again_audio",
+            result=(
+                "hit" if file_id or lang_code in _try_again_audio else "miss"
+            ),
+        )
+        if file_id:
+            return await message.answer_voice(voice=file_id, caption=text)
+        audio = _try_again_audio.get(lang_code)
+        if audio:
+            sent = await message.answer_voice(
+                voice=BufferedInputFile(audio, filename="try_again.mp3"),
+                caption=text,
+            )
+            _try_again_file_ids[lang_code] = sent.voice.file_id
+            return sent
+    except Exception as e:
+        logger.error(f"Failed to send cached try again reply: {e}")
+        _try_again_file_ids.pop(lang_code, None)
+
+    if lang_code not in _try_again_audio:
+        task = asyncio.create_task(_synthesize_try_again(lang_code))
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+    return await message.answer(text)
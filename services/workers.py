@@ -0,0 +1,289 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import signal
+import sys
+import time
+from bisect import bisect
+from typing import Optional
+
+import aiohttp
+from aiohttp import web
+
+from services.http_clients import http_clients
+from utils.config import (
+    WORKER_BASE_PORT,
+    WORKER_HEALTH_FAILURES,
+    WORKER_HEALTH_INTERVAL,
+    WORKER_INDEX,
+)
+
+logger = logging.getLogger(__name__)
+
+# Точек на кольце на один воркер: чем больше, тем ровнее доли чатов
+RING_POINTS = 160
+# Сколько ждать завершения воркера по SIGTERM перед SIGKILL, в секундах:
+# воркер дожидается начатых ходов и сбрасывает отложенные записи
+WORKER_STOP_TIMEOUT = 60.0
+
+
+def _hash(key: str) -> int:
+    digest = hashlib.blake2b(key.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+def worker_url(index: int, path: str) -> str:
+    return f"http://127.0.0.1:{WORKER_BASE_PORT + index}{path}"
+
+
+class ChatRing:
+    """
+    Consistent hash ring mapping chat ids to worker indexes.
+
+    A chat always lands on the same worker, so its updates are handled in
+    one process with that process's FSM storage, turn locks and caches.
+    Changing the number of workers moves only about 1/n of the chats.
+    """
+
+    def __init__(self, workers: int, points: int = RING_POINTS):
+        ring = sorted(
+            (_hash(f"worker-{index}-{point}"), index)
+            for index in range(workers)
+            for point in range(points)
+        )
+        self._keys = [key for key, _ in ring]
+        self._workers = [index for _, index in ring]
+
+    def owner(self, chat_id: int) -> int:
+        position = bisect(self._keys, _hash(str(chat_id)))
+        return self._workers[position % len(self._keys)]
+
+
+def update_chat_id(update: dict) -> Optional[int]:
+    """
+    Chat of an update, or its sender for updates without a chat.
+    """
+    for value in update.values():
+        if not isinstance(value, dict):
+            continue
+        chat = value.get("chat") or (value.get("message") or {}).get("chat")
+        if chat:
+            return chat["id"]
+        user = value.get("from") or value.get("user")
+        if user:
+            return user["id"]
+    return None
+
+
+async def send_to_worker(index: int, path: str, payload: dict) -> int:
+    """
+    POST a JSON payload to a worker.
+
+    :return: The HTTP status of the response.
+    """
+    session = http_clients.session("workers")
+    async with session.post(worker_url(index, path), json=payload) as response:
+        await response.read()
+        return response.status
+
+
+class WorkerProcess:
+    """
+    One bot process serving the chats of its ring slot.
+    """
+
+    def __init__(self, index: int):
+        self.index = index
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.failures = 0
+        self.restarts = 0
+        self.healthy = False
+        self.started_at = 0.0
+
+    async def spawn(self) -> None:
+        env = {
+            **os.environ,
+            "WORKER_INDEX": str(self.index),
+            "PORT": str(WORKER_BASE_PORT + self.index),
+            "WEBAPP_HOST": "127.0.0.1",
+        }
+        self.process = await asyncio.create_subprocess_exec(
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "main:app",
+            "--host",
+            "127.0.0.1",
+            # PORT занимает вебхук воркера, у uvicorn маршрутов нет
+            "--port",
+            "0",
+            env=env,
+        )
+        self.failures = 0
+        self.healthy = False
+        self.started_at = time.monotonic()
+        logger.info(
+            f"Worker {self.index} started, pid {self.process.pid}, "
+            f"port {env['PORT']}"
+        )
+
+    async def terminate(self) -> None:
+        process, self.process = self.process, None
+        self.healthy = False
+        if process is None or process.returncode is not None:
+            return
+        process.terminate()
+        try:
+            await asyncio.wait_for(process.wait(), WORKER_STOP_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning(f"Worker {self.index} did not stop, killing it")
+            process.kill()
+            await process.wait()
+
+    def stats(self) -> dict:
+        return {
+            "pid": self.process.pid if self.process else None,
+            "healthy": self.healthy,
+            "failures": self.failures,
+            "restarts": self.restarts,
+            "uptime": (
+                round(time.monotonic() - self.started_at)
+                if self.process
+                else None
+            ),
+        }
+
+
+class WorkerPool:
+    """
+    Worker processes behind the front, with health checks and restarts.
+
+    Every ``interval`` seconds each worker's /healthz is polled. A worker
+    that exited is started again at once; one that failed ``max_failures``
+    checks in a row is restarted. A new worker gets ``grace`` seconds to
+    start up before failed checks count.
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        interval: float = WORKER_HEALTH_INTERVAL,
+        max_failures: int = WORKER_HEALTH_FAILURES,
+        grace: float = 60.0,
+    ):
+        self.ring = ChatRing(workers)
+        self.workers = [WorkerProcess(index) for index in range(workers)]
+        self.interval = interval
+        self.max_failures = max_failures
+        self.grace = grace
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        for worker in self.workers:
+            await worker.spawn()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._supervise_loop())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await asyncio.gather(*(worker.terminate() for worker in self.workers))
+
+    async def _supervise_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            await asyncio.gather(
+                *(self._supervise(worker) for worker in self.workers)
+            )
+
+    async def _supervise(self, worker: WorkerProcess) -> None:
+        try:
+            if worker.process is None or worker.process.returncode is not None:
+                code = worker.process.returncode if worker.process else None
+                logger.error(f"Worker {worker.index} exited with code {code}")
+                await self._restart(worker)
+                return
+            if await self._check(worker):
+                worker.failures = 0
+                worker.healthy = True
+                return
+            worker.healthy = False
+            if time.monotonic() - worker.started_at < self.grace:
+                return
+            worker.failures += 1
+            if worker.failures >= self.max_failures:
+                logger.error(
+                    f"Worker {worker.index} failed {worker.failures} "
+                    "health checks, restarting"
+                )
+                await self._restart(worker)
+        except Exception as e:
+            logger.error(f"Supervising worker {worker.index} failed: {e}")
+
+    async def _check(self, worker: WorkerProcess) -> bool:
+        session = http_clients.session("workers")
+        try:
+            async with session.get(
+                worker_url(worker.index, "/healthz"),
+                timeout=aiohttp.ClientTimeout(total=self.interval),
+            ) as response:
+                return response.status == 200
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            return False
+
+    async def _restart(self, worker: WorkerProcess) -> None:
+        await worker.terminate()
+        await worker.spawn()
+        worker.restarts += 1
+
+    async def forward(self, request: web.Request) -> web.Response:
+        """
+        Pass a webhook update to the worker owning its chat.
+
+        Telegram gets the worker's status; if the worker cannot be reached
+        it gets 503 and delivers the update again later.
+        """
+        body = await request.read()
+        update = json.loads(body)
+        chat_id = update_chat_id(update)
+        index = self.ring.owner(
+            chat_id if chat_id is not None else update.get("update_id", 0)
+        )
+        session = http_clients.session("workers")
+        try:
+            async with session.post(
+                worker_url(index, request.path),
+                data=body,
+                headers={"Content-Type": "application/json"},
+            ) as response:
+                return web.Response(
+                    status=response.status, body=await response.read()
+                )
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.warning(f"Update not forwarded to worker {index}: {e}")
+            return web.Response(status=503, text="Worker unavailable")
+
+    def stats(self) -> dict:
+        return {str(worker.index): worker.stats() for worker in self.workers}
+
+
+async def watch_parent(interval: float = WORKER_HEALTH_INTERVAL) -> None:
+    """
+    Stop a worker whose front has gone, instead of serving nobody.
+    """
+    parent = os.getppid()
+    while True:
+        await asyncio.sleep(interval)
+        if os.getppid() != parent:
+            logger.error(f"Front of worker {WORKER_INDEX} is gone, exiting")
+            # Обычная остановка uvicorn: shutdown сбросит отложенные
+            # записи и отпустит ведущего
+            os.kill(os.getpid(), signal.SIGTERM)
+            return
@@ -1,62 +1,295 @@
 import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Optional
 
-import requests
 import logging
+from cachetools import TTLCache
+from services.http_clients import http_clients
+from services.metrics import cache_requests
+from services.resilience import resilient
 from settings import YANDEX_OAUTH_TOKEN, YANDEX_FOLDER_ID
+from utils.config import (
+    TRANSLATION_CACHE_SIZE,
+    TRANSLATION_CACHE_TTL,
+    IAM_TOKEN_REFRESH_INTERVAL,
+    IAM_TOKEN_REFRESH_MARGIN,
+    IAM_TOKEN_RETRY_DELAY,
+)
 
-YANDEX_IAM_TOKEN = None
 logger = logging.getLogger(__name__)
 
+IAM_TOKEN_URL = "https://iam.api.cloud.yandex.net/iam/v1/tokens"
+# Имя токена в общей таблице shared_tokens
+IAM_TOKEN_NAME = "yandex_iam"
 
-def get_iam_token():
-    global YANDEX_IAM_TOKEN
-    url = "https://iam.api.cloud.yandex.net/iam/v1/tokens"
-    payload = {"yandexPassportOauthToken": YANDEX_OAUTH_TOKEN}
-    response = requests.post(url, json=payload)
-    response.raise_for_status()
-    YANDEX_IAM_TOKEN = response.json()["iamToken"]
-    logger.info(f"Received new IAM token: {YANDEX_IAM_TOKEN}")
-
-
-async def refresh_iam_token():
-    while True:
-        await asyncio.sleep(6 * 3600)
-        get_iam_token()
-        logger.info("IAM token refreshed")
-
-
-def recognize_speech(audio_content, lang="ru-RU"):
-    if not YANDEX_IAM_TOKEN:
-        get_iam_token()
-    url = f"https://stt.api.cloud.yandex.net/speech/v1/stt:recognize?folderId={YANDEX_FOLDER_ID}&lang={lang}"
-    headers = {"Authorization": f"Bearer {YANDEX_IAM_TOKEN}"}
-    response = requests.post(url, headers=headers, data=audio_content)
-    response.raise_for_status()
-    if response.status_code == 200:
-        result = response.json().get("result")
-        if not result:
-            logger.info(
-                "Recognition result is empty. Asking user to repeat the question."
-            )
-            return None  # Возвращаем None в случае пустого результата
-        logger.info(f"Recognition result: {result}")
-        return result
-    else:
-        error_message = (
-            f"Failed to recognize speech, status code: {response.status_code}"
+# Кэш переводов: ключ (text, source_lang, target_lang)
+_translation_cache: TTLCache = TTLCache(
+    maxsize=TRANSLATION_CACHE_SIZE, ttl=TRANSLATION_CACHE_TTL
+)
+
+
+def _parse_expires_at(value: Optional[str]) -> Optional[float]:
+    """
+    Convert IAM ``expiresAt`` (RFC 3339 with nanoseconds) to seconds left.
+    """
+    if not value:
+        return None
+    try:
+        value = value.rstrip("Z")
+        if "." in value:
+            head, fraction = value.split(".", 1)
+            value = f"{head}.{fraction[:6]}"
+        expires_at = datetime.fromisoformat(value).replace(tzinfo=timezone.utc)
+        return (expires_at - datetime.now(timezone.utc)).total_seconds()
+    except ValueError:
+        logger.warning(f"Unexpected IAM token expiresAt format: {value}")
+        return None
+
+
+@resilient("yandex_iam")
+async def _request_iam_token(oauth_token: Optional[str]) -> dict:
+    payload = {"yandexPassportOauthToken": oauth_token}
+    session = http_clients.session("yandex")
+    async with session.post(IAM_TOKEN_URL, json=payload) as response:
+        response.raise_for_status()
+        return await response.json()
+
+
+class IamTokenManager:
+    """
+    Keeps a Yandex IAM token fresh in the background.
+
+    The token is refreshed ahead of its expiry by a background task, and
+    concurrent refresh attempts share one in-flight request.
+
+    With shared tokens only the instance running the background task (the
+    leader) requests tokens and publishes them; the others read the
+    published token and request their own only if there is none. They
+    reload it in the background with ``follow`` ahead of its expiry, so
+    their handlers wait only on a cold start too.
+    """
+
+    def __init__(self, oauth_token: Optional[str]):
+        self._oauth_token = oauth_token
+        self._token: Optional[str] = None
+        self._expires_at: float = 0.0
+        self._inflight: Optional[asyncio.Future] = None
+        self._task: Optional[asyncio.Task] = None
+        self._follow_task: Optional[asyncio.Task] = None
+        self._shared = None
+
+    @property
+    def token(self) -> Optional[str]:
+        """
+        The current token, or None if none has been received yet.
+        """
+        if self._token and time.monotonic() < self._expires_at:
+            return self._token
+        return None
+
+    @property
+    def refreshing(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def share(self, tokens) -> None:
+        """
+        Exchange tokens with other instances through ``SharedTokens``.
+        """
+        self._shared = tokens
+
+    def start(self) -> None:
+        """
+        Start background refreshing without waiting for the first token.
+        """
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def follow(self) -> None:
+        """
+        Keep the shared token loaded in the background while this
+        instance is not the one refreshing it.
+        """
+        if self._shared is None:
+            return
+        if self._follow_task is None or self._follow_task.done():
+            self._follow_task = asyncio.create_task(self._follow_loop())
+
+    async def stop_following(self) -> None:
+        if self._follow_task:
+            self._follow_task.cancel()
+            try:
+                await self._follow_task
+            except asyncio.CancelledError:
+                pass
+            self._follow_task = None
+
+    async def get_token(self) -> str:
+        """
+        Return the cached token; only waits on a cold start or after expiry,
+        joining the refresh that is already in flight.
+        """
+        token = self.token
+        if token:
+            return token
+        return await self.refresh()
+
+    async def refresh(self) -> str:
+        if self._inflight is None or self._inflight.done():
+            self._inflight = asyncio.ensure_future(self._fetch())
+        return await asyncio.shield(self._inflight)
+
+    async def _fetch(self) -> str:
+        if self._shared is not None and not self.refreshing:
+            token = await self._load_shared()
+            if token:
+                return token
+        body = await _request_iam_token(self._oauth_token)
+        expires_in = _parse_expires_at(body.get("expiresAt"))
+        if expires_in is None:
+            expires_in = 12 * 3600
+        self._token = body["iamToken"]
+        self._expires_at = time.monotonic() + expires_in
+        logger.info(
+            f"Received new IAM token, expires in {int(expires_in)} seconds"
+        )
+        if self._shared is not None and self.refreshing:
+            await self._publish(expires_in)
+        return self._token
+
+    async def _load_shared(self) -> Optional[str]:
+        try:
+            shared = await self._shared.load(IAM_TOKEN_NAME)
+        except Exception as e:
+            logger.warning(f"Shared IAM token not loaded: {e}")
+            return None
+        if shared is None:
+            return None
+        token, expires_at = shared
+        # Ведущий обновляет токен за IAM_TOKEN_REFRESH_MARGIN до истечения,
+        # к середине этого запаса в таблице уже новый
+        expires_in = (
+            expires_at - datetime.now(timezone.utc)
+        ).total_seconds() - IAM_TOKEN_REFRESH_MARGIN / 2
+        if expires_in <= 0:
+            return None
+        self._token = token
+        self._expires_at = time.monotonic() + expires_in
+        logger.info(
+            f"Loaded shared IAM token, using it for {int(expires_in)} seconds"
+        )
+        return token
+
+    async def _publish(self, expires_in: float) -> None:
+        expires_at = datetime.now(timezone.utc) + timedelta(seconds=expires_in)
+        try:
+            if not await self._shared.publish(
+                IAM_TOKEN_NAME, self._token, expires_at
+            ):
+                logger.warning("IAM token not published: leader was replaced")
+        except Exception as e:
+            logger.warning(f"IAM token not published: {e}")
+
+    def _next_refresh_delay(self) -> float:
+        time_left = self._expires_at - time.monotonic()
+        return max(
+            min(
+                IAM_TOKEN_REFRESH_INTERVAL,
+                time_left - IAM_TOKEN_REFRESH_MARGIN,
+            ),
+            1.0,
+        )
+
+    def _reload_ahead(self) -> float:
+        # Токен в таблице сменяется за IAM_TOKEN_REFRESH_MARGIN до
+        # истечения, а загруженный годен до середины этого запаса:
+        # перечитываем между ними
+        time_left = self._expires_at - time.monotonic()
+        return time_left - IAM_TOKEN_REFRESH_MARGIN / 4
+
+    async def _follow_loop(self) -> None:
+        while True:
+            delay = IAM_TOKEN_RETRY_DELAY
+            try:
+                if not self.refreshing:
+                    if self.token is None or self._reload_ahead() <= 0:
+                        await self.refresh()
+                    ahead = self._reload_ahead()
+                    if ahead > 0:
+                        delay = max(min(IAM_TOKEN_REFRESH_INTERVAL, ahead), 1.0)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Shared IAM token not refreshed: {e}")
+            await asyncio.sleep(delay)
+
+    async def _refresh_loop(self) -> None:
+        while True:
+            try:
+                await self.refresh()
+                delay = self._next_refresh_delay()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Failed to refresh IAM token: {e}")
+                delay = IAM_TOKEN_RETRY_DELAY
+            await asyncio.sleep(delay)
+
+
+iam_token_manager = IamTokenManager(YANDEX_OAUTH_TOKEN)
+
+
+# Токен берётся до вызова зависимости: сбой IAM не повторяется
+# внутри STT, TTS и перевода и не открывает их цепи
+async def recognize_speech(audio_content, lang="ru-RU"):
+    token = await iam_token_manager.get_token()
+    return await _recognize_request(token, audio_content, lang)
+
+
+@resilient("yandex_stt")
+async def _recognize_request(token, audio_content, lang):
+    url = "https://stt.api.cloud.yandex.net/speech/v1/stt:recognize"
+    params = {"folderId": YANDEX_FOLDER_ID, "lang": lang}
+    headers = {"Authorization": f"Bearer {token}"}
+    session = http_clients.session("yandex")
+    async with session.post(
+        url, params=params, headers=headers, data=audio_content
+    ) as response:
+        response.raise_for_status()
+        body = await response.json()
+    result = body.get("result")
+    if not result:
+        logger.info(
+            "Recognition result is empty. Asking user to repeat the question."
         )
-        logger.error(error_message)
-        raise Exception(error_message)
+        return None  # Возвращаем None в случае пустого результата
+    logger.info(f"Recognition result: {result}")
+    return result
+
 
+async def synthesize_speech(text, lang_code):
+    token = await iam_token_manager.get_token()
+    return await _synthesize_request(token, text, lang_code)
 
-def synthesize_speech(text, lang_code):
+
+@resilient("yandex_tts")
+async def _synthesize_request(token, text, lang_code):
     voice_settings = {
         "ru": {"lang": "ru-RU", "voice": "jane", "emotion": "good"},
         "kk": {"lang": "kk-KK", "voice": "amira", "emotion": "neutral"},
     }
     settings = voice_settings.get(lang_code, voice_settings["ru"])
     url = "https://tts.api.cloud.yandex.net/speech/v1/tts:synthesize"
-    headers = {"Authorization": f"Bearer {YANDEX_IAM_TOKEN}"}
+    headers = {"Authorization": f"Bearer {token}"}
     data = {
         "text": text,
         "lang": settings["lang"],
@@ -64,34 +297,112 @@ def synthesize_speech(text, lang_code):
         "emotion": settings["emotion"],
         "folderId": YANDEX_FOLDER_ID,
         "format": "mp3",
-        "sampleRateHertz": 48000,
+        "sampleRateHertz": "48000",
         "speed": "1.2",
     }
-    response = requests.post(url, headers=headers, data=data, stream=True)
-    if response.status_code == 200:
-        return response.content
-    else:
-        error_message = f"Failed to synthesize speech, status code: {response.status_code}, response text: {response.text}"
-        logger.error(error_message)
-        raise Exception(error_message)
+    session = http_clients.session("yandex")
+    async with session.post(url, headers=headers, data=data) as response:
+        if response.status != 200:
+            logger.error(
+                f"Failed to synthesize speech, status code: "
+                f"{response.status}, response text: {await response.text()}"
+            )
+        response.raise_for_status()
+        return await response.read()
 
 
-def translate_text(text, source_lang="ru", target_lang="kk"):
+@resilient("yandex_translate")
+async def _translate_request(token, texts, source_lang, target_lang):
     url = "https://translate.api.cloud.yandex.net/translate/v2/translate"
     headers = {
-        "Authorization": f"Bearer {YANDEX_IAM_TOKEN}",
+        "Authorization": f"Bearer {token}",
         "Content-Type": "application/json",
     }
     payload = {
         "folder_id": YANDEX_FOLDER_ID,
-        "texts": [text],
+        "texts": texts,
         "targetLanguageCode": target_lang,
         "sourceLanguageCode": source_lang,
     }
-    response = requests.post(url, json=payload, headers=headers)
-    response.raise_for_status()
-    translations = response.json().get("translations", [])
-    if translations:
-        return translations[0]["text"]
-    else:
-        return "Перевод не найден."
+    session = http_clients.session("yandex")
+    async with session.post(url, json=payload, headers=headers) as response:
+        response.raise_for_status()
+        body = await response.json()
+    return body.get("translations", [])
+
+
+async def translate_many(texts, source_lang="ru", target_lang="kk"):
+    """
+    Translate a list of strings, serving repeated ones from the cache.
+
+    All strings missing from the cache are sent in a single request,
+    the Yandex endpoint accepts a ``texts`` array.
+
+    :param texts: Strings to translate.
+    :param source_lang: Source language code.
+    :param target_lang: Target language code.
+
+    :return: Translations in the same order as ``texts``.
+    """
+    results = [None] * len(texts)
+    missing = {}
+    for index, text in enumerate(texts):
+        cached = _translation_cache.get((text, source_lang, target_lang))
+        if cached is not None:
+            results[index] = cached
+        else:
+            missing.setdefault(text, []).append(index)
+    hits = len(texts) - sum(len(indices) for indices in missing.values())
+    if hits:
+        cache_requests.inc(hits, cache="translation", result="hit")
+    if len(texts) - hits:
+        cache_requests.inc(
+            len(texts) - hits, cache="translation", result="miss"
+        )
+
+    if missing:
+        logger.info(
+            f"Translating {len(missing)} of {len(texts)} strings "
+            f"{source_lang}->{target_lang}, the rest served from cache"
+        )
+        token = await iam_token_manager.get_token()
+        translations = await _translate_request(
+            token, list(missing), source_lang, target_lang
+        )
+
+        for position, (text, indices) in enumerate(missing.items()):
+            if position < len(translations):
+                translated = translations[position]["text"]
+                _translation_cache[(text, source_lang, target_lang)] = (
+                    translated
+                )
+            else:
+                translated = "Перевод не найден."
+            for index in indices:
+                results[index] = translated
+
+    return results
+
+
+async def translate_text(text, source_lang="ru", target_lang="kk"):
+    return (await translate_many([text], source_lang, target_lang))[0]
+
+
+async def translate_reply(text, source_lang="ru", target_lang="kk"):
+    """
+    Translate an assistant reply line by line.
+
+    Survey questions recur across replies even when the surrounding text
+    changes, so translating per line lets them hit the cache while the
+    remaining lines still go out in one request.
+    """
+    lines = text.split("\n")
+    to_translate = [line for line in lines if line.strip()]
+    if not to_translate:
+        return text
+    translated = iter(
+        await translate_many(to_translate, source_lang, target_lang)
+    )
+    return "\n".join(
+        next(translated) if line.strip() else line for line in lines
+    )
@@ -1,3 +1,4 @@
+import hmac
 import json
 import os
 import uuid
@@ -14,6 +15,16 @@ from supabase import create_client, Client
 import logging
 from datetime import datetime
 from hashlib import md5
+from services.database.leader import leader
+from services.database.profiler import query_profiler
+from services.http_clients import http_clients
+from services.loop_watchdog import loop_watchdog
+from services.metrics import registry
+from services.resilience import dependency_stats
+from services.tracing import start_trace, tracer
+from services.user_turns import user_turns
+from services.workers import WorkerPool, watch_parent
+from utils.config import SERVICE_TOKEN, WORKER_INDEX
 
 load_dotenv()
 logger = logging.getLogger(__name__)
@@ -79,6 +90,8 @@ async def on_startup(bot: Bot, webhook_url: str):
 async def on_shutdown(app):
     bot = app["bot"]
     await bot.session.close()
+    await tracer.stop()
+    await http_clients.close()
 
 
 #
@@ -103,6 +116,86 @@ async def on_shutdown(app):
 #         logger.info("Message inserted successfully")
 
 
+# Статистика, метрики и трассы: в них пути и задержки запросов, тексты
+# запросов к базе и состояние процесса
+SERVICE_ROUTES = frozenset(
+    {
+        "/dependencies",
+        "/turns",
+        "/http_clients",
+        "/metrics",
+        "/workers",
+        "/debug/traces",
+        "/debug/loop",
+        "/debug/queries",
+        "/debug/leader",
+    }
+)
+
+
+def _service_allowed(request: web.Request) -> bool:
+    if SERVICE_TOKEN is not None:
+        return hmac.compare_digest(
+            request.headers.get("Authorization", ""),
+            f"Bearer {SERVICE_TOKEN}",
+        )
+    return request.remote in ("127.0.0.1", "::1")
+
+
+@web.middleware
+async def protect_service_routes(request: web.Request, handler):
+    if request.path in SERVICE_ROUTES and not _service_allowed(request):
+        raise web.HTTPUnauthorized(text="Service token required")
+    return await handler(request)
+
+
+async def _cancel(task: asyncio.Task) -> None:
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+
+
+async def handle_healthz(request: web.Request):
+    return web.json_response({"status": "ok", "worker": WORKER_INDEX})
+
+
+async def run_front(
+    bot: Bot,
+    pool: WorkerPool,
+    webhook_url: str,
+    webhook_path: str,
+    host: str,
+    port: int,
+):
+    """
+    Serve the webhook in the front process: every update is passed to
+    the worker owning its chat.
+
+    :return: The runner serving the webhook; the caller cleans it up and
+    stops the pool on shutdown.
+    """
+    app = web.Application(middlewares=[protect_service_routes])
+    app["bot"] = bot
+    app.on_startup.append(lambda app: on_startup(bot, webhook_url))
+    app.on_shutdown.append(on_shutdown)
+
+    async def handle_workers(request: web.Request):
+        return web.json_response(pool.stats())
+
+    app.router.add_post(webhook_path, pool.forward)
+    app.router.add_get("/healthz", handle_healthz)
+    app.router.add_get("/workers", handle_workers)
+
+    await pool.start()
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    return runner
+
+
 async def run_webhook(
     app_dispatcher: Dispatcher,
     bot: Bot,
@@ -110,11 +203,22 @@ async def run_webhook(
     webhook_path: str,
     host: str,
     port: int,
+    reminders=None,
 ):
-    app = web.Application()
+    """
+    Serve the webhook and the service endpoints of the bot.
+
+    :return: The runner serving them; the caller cleans it up on shutdown.
+    """
+    app = web.Application(middlewares=[protect_service_routes])
     app["bot"] = bot
     app["dispatcher"] = app_dispatcher
-    app.on_startup.append(lambda app: on_startup(bot, webhook_url))
+    # Вебхук воркеров устанавливает фронт
+    if WORKER_INDEX is None:
+        app.on_startup.append(lambda app: on_startup(bot, webhook_url))
+    else:
+        app["watch_parent"] = asyncio.create_task(watch_parent())
+        app.on_cleanup.append(lambda app: _cancel(app["watch_parent"]))
     app.on_shutdown.append(on_shutdown)
 
     async def get_file_url(bot, file_id):
@@ -126,8 +230,9 @@ async def run_webhook(
         bot = app["bot"]
         update_dict = await request.json()
         update = Update(**update_dict)
-        logger.info(f"Received update: {update_dict}")
-        await app["dispatcher"].feed_update(bot, update)
+        with start_trace("update", update_id=update.update_id):
+            logger.info(f"Received update: {update_dict}")
+            await app["dispatcher"].feed_update(bot, update)
 
         # if update.message:
         #     user_id = update.message.from_user.id
@@ -225,16 +330,84 @@ async def run_webhook(
 
         return web.Response(text="OK")
 
+    async def handle_reminder(request: web.Request):
+        # Напоминание, заявленное ведущим для чата этого воркера
+        payload = await request.json()
+        await reminders.deliver(payload["user_id"])
+        return web.Response(text="OK")
+
     async def handle_root(request: web.Request):
         return web.Response(text="Hello! The bot is running.")
 
+    async def handle_dependencies(request: web.Request):
+        return web.json_response(dependency_stats())
+
+    async def handle_turns(request: web.Request):
+        return web.json_response(user_turns.stats())
+
+    async def handle_http_clients(request: web.Request):
+        return web.json_response(http_clients.stats())
+
+    async def handle_metrics(request: web.Request):
+        return web.Response(
+            text=registry.render(),
+            content_type="text/plain",
+            charset="utf-8",
+            headers={"X-Content-Type-Options": "nosniff"},
+        )
+
+    async def handle_loop(request: web.Request):
+        return web.json_response(loop_watchdog.stats())
+
+    async def handle_leader(request: web.Request):
+        return web.json_response(leader.stats())
+
+    async def handle_queries(request: web.Request):
+        return web.json_response(query_profiler.stats())
+
+    async def handle_traces(request: web.Request):
+        if tracer.ring is None:
+            raise web.HTTPNotFound(text="Ring buffer exporter is disabled")
+        trace_id = request.query.get("trace_id")
+        if trace_id:
+            trace = tracer.ring.find(trace_id)
+            if trace is None:
+                raise web.HTTPNotFound(text="Trace not found")
+            return web.json_response(trace.to_dict())
+        # Самые медленные сверху, без списка спанов
+        traces = sorted(
+            tracer.ring.traces,
+            key=lambda trace: trace.root.duration or 0,
+            reverse=True,
+        )
+        limit = int(request.query.get("limit", 50))
+        return web.json_response(
+            [
+                {
+                    key: value
+                    for key, value in trace.to_dict().items()
+                    if key != "spans"
+                }
+                for trace in traces[:limit]
+            ]
+        )
+
     app.router.add_post(webhook_path, handle_webhook)
     app.router.add_get("/", handle_root)
+    app.router.add_get("/healthz", handle_healthz)
+    if reminders is not None and WORKER_INDEX is not None:
+        app.router.add_post("/internal/reminder", handle_reminder)
+    app.router.add_get("/dependencies", handle_dependencies)
+    app.router.add_get("/turns", handle_turns)
+    app.router.add_get("/http_clients", handle_http_clients)
+    app.router.add_get("/metrics", handle_metrics)
+    app.router.add_get("/debug/traces", handle_traces)
+    app.router.add_get("/debug/loop", handle_loop)
+    app.router.add_get("/debug/queries", handle_queries)
+    app.router.add_get("/debug/leader", handle_leader)
 
     runner = web.AppRunner(app)
     await runner.setup()
     site = web.TCPSite(runner, host, port)
     await site.start()
-
-    while True:
-        await asyncio.sleep(3600)
\ No newline at end of file
+    return runner
\ No newline at end of file
@@ -1,5 +1,5 @@
 import os
-from typing import Final
+from typing import Final, Optional
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -19,7 +19,149 @@ WEBHOOK_PATH: Final[str] = os.getenv("WEBHOOK_PATH", "/webhook")
 WEBHOOK_URL: Final[str] = os.getenv("WEBHOOK_URL")
 WEBAPP_HOST: Final[str] = os.getenv("WEBAPP_HOST", "0.0.0.0")
 WEBAPP_PORT: Final[int] = int(os.getenv("PORT", "8080"))
+# Токен служебных маршрутов (/metrics, /debug/...): заголовок
+# Authorization: Bearer <токен>. Без токена они доступны только с localhost
+SERVICE_TOKEN: Final[Optional[str]] = os.getenv("SERVICE_TOKEN") or None
 
 
 THROTTLING_TIME_PERIOD: Final[int] = 2
 THROTTLING_MAX_RATE: Final[int] = 1
+
+
+TRANSLATION_CACHE_SIZE: Final[int] = int(
+    os.getenv("TRANSLATION_CACHE_SIZE", "5000")
+)
+TRANSLATION_CACHE_TTL: Final[int] = int(
+    os.getenv("TRANSLATION_CACHE_TTL", str(24 * 3600))
+)
+
+# IAM-токен Яндекса живёт 12 часов, обновляем заранее
+IAM_TOKEN_REFRESH_INTERVAL: Final[int] = int(
+    os.getenv("IAM_TOKEN_REFRESH_INTERVAL", "3600")
+)
+IAM_TOKEN_REFRESH_MARGIN: Final[int] = int(
+    os.getenv("IAM_TOKEN_REFRESH_MARGIN", "600")
+)
+IAM_TOKEN_RETRY_DELAY: Final[int] = int(
+    os.getenv("IAM_TOKEN_RETRY_DELAY", "30")
+)
+
+# Повторный запрос при ответе дольше p95: запросы Yandex платные,
+# поэтому по умолчанию выключено
+HEDGED_REQUESTS_ENABLED: Final[bool] = (
+    os.getenv("HEDGED_REQUESTS_ENABLED", "false").lower() == "true"
+)
+
+# Общий бюджет времени на один голосовой ход, в секундах
+VOICE_TURN_DEADLINE: Final[float] = float(
+    os.getenv("VOICE_TURN_DEADLINE", "45")
+)
+
+# Что делать с новым сообщением, пока идёт предыдущий ход пользователя:
+# serialize, coalesce или cancel
+TURN_CONCURRENCY_MODE: Final[str] = os.getenv(
+    "TURN_CONCURRENCY_MODE", "serialize"
+)
+TURN_LOCK_SHARDS: Final[int] = int(os.getenv("TURN_LOCK_SHARDS", "64"))
+
+# Экспорт трассировок: log, otlp, ring — можно несколько через запятую
+TRACING_EXPORTERS: Final[str] = os.getenv("TRACING_EXPORTERS", "log,ring")
+TRACING_OTLP_ENDPOINT: Final[str] = os.getenv(
+    "TRACING_OTLP_ENDPOINT", "http://localhost:4318/v1/traces"
+)
+TRACING_RING_SIZE: Final[int] = int(os.getenv("TRACING_RING_SIZE", "200"))
+# Трассы длиннее порога логируются с критическим путём, в секундах
+TRACING_SLOW_THRESHOLD: Final[float] = float(
+    os.getenv("TRACING_SLOW_THRESHOLD", "10")
+)
+
+# Сторож цикла событий: период опроса и порог задержки, в секундах
+LOOP_WATCHDOG_INTERVAL: Final[float] = float(
+    os.getenv("LOOP_WATCHDOG_INTERVAL", "0.05")
+)
+LOOP_STALL_THRESHOLD: Final[float] = float(
+    os.getenv("LOOP_STALL_THRESHOLD", "0.1")
+)
+# В строгом режиме любая блокировка цикла длиннее порога — ошибка
+LOOP_WATCHDOG_STRICT: Final[bool] = (
+    os.getenv("LOOP_WATCHDOG_STRICT", "false").lower() == "true"
+)
+
+# Пул процессов для построения XLSX-отчётов
+REPORT_POOL_WORKERS: Final[int] = int(os.getenv("REPORT_POOL_WORKERS", "2"))
+REPORT_MAX_QUEUE: Final[int] = int(os.getenv("REPORT_MAX_QUEUE", "20"))
+REPORT_TIMEOUT: Final[float] = float(os.getenv("REPORT_TIMEOUT", "60"))
+
+# Кэш готовых выгрузок статистики, ограничение по суммарному размеру в байтах
+EXPORT_CACHE_MAX_BYTES: Final[int] = int(
+    os.getenv("EXPORT_CACHE_MAX_BYTES", str(64 * 1024 * 1024))
+)
+
+# Применять миграции схемы при запуске бота
+MIGRATE_ON_STARTUP: Final[bool] = (
+    os.getenv("MIGRATE_ON_STARTUP", "true").lower() == "true"
+)
+
+# Помесячные партиции survey: сколько месяцев создавать заранее,
+# как часто проверять (в секундах) и с какого возраста в месяцах
+# добавлять BRIN-индекс (0 — не добавлять)
+SURVEY_PARTITIONS_AHEAD: Final[int] = int(
+    os.getenv("SURVEY_PARTITIONS_AHEAD", "3")
+)
+SURVEY_PARTITION_CHECK_INTERVAL: Final[float] = float(
+    os.getenv("SURVEY_PARTITION_CHECK_INTERVAL", str(24 * 3600))
+)
+SURVEY_BRIN_AFTER_MONTHS: Final[int] = int(
+    os.getenv("SURVEY_BRIN_AFTER_MONTHS", "0")
+)
+
+# Отложенная запись полей профиля: период сброса в секундах и число
+# пользователей в буфере, при котором сброс начинается сразу
+WRITE_BEHIND_INTERVAL: Final[float] = float(
+    os.getenv("WRITE_BEHIND_INTERVAL", "1.0")
+)
+WRITE_BEHIND_MAX_PENDING: Final[int] = int(
+    os.getenv("WRITE_BEHIND_MAX_PENDING", "200")
+)
+
+# Реплики для чтения: host[:port] через запятую (например localhost:5433),
+# база и учётные данные те же, что у основного сервера
+DB_REPLICA_HOSTS: Final[list[str]] = [
+    host.strip()
+    for host in os.getenv("PGREPLICA_HOSTS", "").split(",")
+    if host.strip()
+]
+# Сколько секунд после записи чтения пользователя идут на основной сервер
+READ_YOUR_WRITES_WINDOW: Final[float] = float(
+    os.getenv("READ_YOUR_WRITES_WINDOW", "5")
+)
+
+# Профилирование запросов: порог медленного запроса в секундах и сколько
+# раз один запрос может повториться за обновление, прежде чем это N+1
+DB_SLOW_QUERY_THRESHOLD: Final[float] = float(
+    os.getenv("DB_SLOW_QUERY_THRESHOLD", "0.2")
+)
+DB_REPEATED_QUERY_THRESHOLD: Final[int] = int(
+    os.getenv("DB_REPEATED_QUERY_THRESHOLD", "3")
+)
+
+# Выбор ведущего экземпляра: как часто ведущий проверяет блокировку,
+# а остальные пытаются её взять, в секундах
+LEADER_ELECTION_INTERVAL: Final[float] = float(
+    os.getenv("LEADER_ELECTION_INTERVAL", "5")
+)
+
+# Многопроцессный режим: число воркеров (1 — один процесс, как раньше),
+# порт первого воркера, период и число неудачных проверок здоровья до
+# перезапуска. WORKER_INDEX фронт задаёт своим воркерам сам
+WEB_WORKERS: Final[int] = int(os.getenv("WEB_WORKERS", "1"))
+WORKER_BASE_PORT: Final[int] = int(os.getenv("WORKER_BASE_PORT", "8100"))
+WORKER_HEALTH_INTERVAL: Final[float] = float(
+    os.getenv("WORKER_HEALTH_INTERVAL", "5")
+)
+WORKER_HEALTH_FAILURES: Final[int] = int(
+    os.getenv("WORKER_HEALTH_FAILURES", "3")
+)
+WORKER_INDEX: Final[Optional[int]] = (
+    int(os.getenv("WORKER_INDEX")) if os.getenv("WORKER_INDEX") else None
+)
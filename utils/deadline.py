@@ -0,0 +1,120 @@
+import asyncio
+import logging
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Iterator, Optional
+
+from services.metrics import errors, observe_stage
+from services.tracing import span
+
+logger = logging.getLogger(__name__)
+
+
+class DeadlineExceeded(Exception):
+    """
+    Raised when a stage runs out of the time budget of the current turn.
+    """
+
+    def __init__(self, stage: str):
+        super().__init__(f"Deadline exceeded during stage '{stage}'")
+        self.stage = stage
+
+
+class Deadline:
+    """
+    Time budget of one conversational turn.
+    """
+
+    def __init__(self, budget: float):
+        self.budget = budget
+        self.started_at = time.monotonic()
+        self.expires_at = self.started_at + budget
+        self.stage: Optional[str] = None
+
+    def remaining(self) -> float:
+        return self.expires_at - time.monotonic()
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+
+_current_deadline: ContextVar[Optional[Deadline]] = ContextVar(
+    "turn_deadline", default=None
+)
+
+# Сколько раз бюджет был исчерпан на каждом этапе
+exhausted_stages: Counter = Counter()
+
+
+def current_deadline() -> Optional[Deadline]:
+    return _current_deadline.get()
+
+
+def remaining_time() -> Optional[float]:
+    """
+    Seconds left in the current turn, or None outside of a turn.
+    """
+    deadline = _current_deadline.get()
+    return deadline.remaining() if deadline else None
+
+
+@contextmanager
+def turn_deadline(budget: float) -> Iterator[Deadline]:
+    """
+    Set a deadline for everything awaited inside the block.
+    """
+    deadline = Deadline(budget)
+    token = _current_deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current_deadline.reset(token)
+
+
+def record_exhausted(stage: str) -> None:
+    exhausted_stages[stage] += 1
+    errors.inc(kind="deadline_exceeded", stage=stage)
+    logger.warning(f"Turn deadline exhausted during stage '{stage}'")
+
+
+def check_deadline(stage: str) -> None:
+    """
+    Raise DeadlineExceeded if the current turn has no time left.
+    """
+    deadline = _current_deadline.get()
+    if deadline and deadline.expired:
+        raise DeadlineExceeded(stage)
+
+
+async def run_stage(stage: str, awaitable: Awaitable[Any]) -> Any:
+    """
+    Await ``awaitable`` within the time left in the current turn.
+
+    Outside of a turn the awaitable is simply awaited. When the budget runs
+    out the stage is cancelled and DeadlineExceeded is raised.
+    """
+    deadline = _current_deadline.get()
+    started = time.perf_counter()
+    with span(f"stage.{stage}"):
+        try:
+            if deadline is None:
+                return await awaitable
+
+            remaining = deadline.remaining()
+            if remaining <= 0:
+                if asyncio.iscoroutine(awaitable):
+                    awaitable.close()
+                raise DeadlineExceeded(stage)
+
+            deadline.stage = stage
+            try:
+                return await asyncio.wait_for(awaitable, remaining)
+            except asyncio.TimeoutError:
+                if deadline.expired:
+                    raise DeadlineExceeded(stage) from None
+                raise
+        finally:
+            observe_stage(stage, time.perf_counter() - started)